@@ -1,5 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth import get_user_model
+from .models import Follow
 
 # Register your models here.
-User = get_user_model()
\ No newline at end of file
+User = get_user_model()
+admin.site.register(Follow)
\ No newline at end of file
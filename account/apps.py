@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class AccountConfig(AppConfig):
     name = 'account'
+
+    def ready(self):
+        # Connect the signal receivers
+        from . import authentication  # noqa: F401
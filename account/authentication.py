@@ -0,0 +1,134 @@
+"""
+JWT authentication without a user query per request.
+
+request.user is a User instance (it can be compared to and assigned as a
+foreign key like a loaded one) built from:
+
+- the cached user row, kept settings.ACCOUNT_USER_CACHE_TTL seconds and
+  dropped whenever the user is saved, deleted or logs out; loaded from the
+  database on a miss
+- the token claims (account.tokens.USER_CLAIMS) when that cache is off
+  (ACCOUNT_USER_CACHE_TTL = 0). Tokens issued without them fall back to the
+  database.
+
+The token version (account.tokens) is checked first, a revoked token is
+refused without touching the database. Saving a user with a new password,
+is_active, is_staff or is_superuser bumps it: the claims of the tokens
+issued before would be out of date.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .tokens import USER_CLAIMS, VERSION_CLAIM, bump_token_version, token_version
+
+User = get_user_model()
+
+# Everything but the password, which is loaded on access
+USER_FIELDS = (
+    'id', 'username', 'email', 'first_name', 'last_name',
+    'is_active', 'is_staff', 'is_superuser', 'date_joined', 'last_login',
+)
+
+# Changing one of these (or the password) revokes the tokens of the user
+REVOKING_FIELDS = ('is_active', 'is_staff', 'is_superuser')
+
+
+def user_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def forget_user(user_id):
+    cache.delete(user_key(user_id))
+
+
+def build_user(row):
+    """A User from a dict of some of its fields, as if loaded with .only() on them"""
+    names = [field.attname for field in User._meta.concrete_fields if field.attname in row]
+    return User.from_db(DEFAULT_DB_ALIAS, names, [row[name] for name in names])
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        user_id = self._user_id(validated_token)
+        self._check_version(validated_token, token_version(user_id))
+
+        row = cache.get(user_key(user_id)) or self._claims_row(user_id, validated_token)
+        if row is None:
+            row = User.objects.filter(id=user_id).values(*USER_FIELDS).first()
+            self._remember(user_id, row)
+        return self._user(row)
+
+    @staticmethod
+    def _user_id(validated_token):
+        try:
+            return int(validated_token[api_settings.USER_ID_CLAIM])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidToken("Token contained no recognizable user identification")
+
+    @staticmethod
+    def _check_version(validated_token, current):
+        if validated_token.get(VERSION_CLAIM, 0) < current:
+            raise AuthenticationFailed("Token has been revoked", code='token_revoked')
+
+    @staticmethod
+    def _claims_row(user_id, validated_token):
+        if settings.ACCOUNT_USER_CACHE_TTL or not all(claim in validated_token for claim in USER_CLAIMS):
+            return None
+        # Deactivation bumps the token version, a valid token is an active user's
+        row = {'id': user_id, 'is_active': True}
+        row.update((claim, validated_token[claim]) for claim in USER_CLAIMS)
+        return row
+
+    @staticmethod
+    def _remember(user_id, row):
+        if row is not None and settings.ACCOUNT_USER_CACHE_TTL:
+            cache.set(user_key(user_id), row, settings.ACCOUNT_USER_CACHE_TTL)
+
+    @staticmethod
+    def _user(row):
+        if row is None:
+            raise AuthenticationFailed("User not found", code='user_not_found')
+        if api_settings.CHECK_USER_IS_ACTIVE and not row['is_active']:
+            raise AuthenticationFailed("User is inactive", code='user_inactive')
+        return build_user(row)
+
+
+@receiver(pre_save, sender=User)
+def user_saving(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Note whether the save changes the password or one of REVOKING_FIELDS"""
+    # set_password() keeps the raw password until the save; the rehash of a login does not
+    instance._revokes_tokens = instance._password is not None
+    fields = [name for name in REVOKING_FIELDS if update_fields is None or name in update_fields]
+    if instance._revokes_tokens or raw or instance._state.adding or not fields:
+        return
+    old = User.objects.filter(pk=instance.pk).values(*fields).first()
+    instance._revokes_tokens = old is not None and any(old[name] != getattr(instance, name) for name in fields)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created=False, **kwargs):
+    user_id = instance.id
+    revoke = not created and (getattr(instance, '_revokes_tokens', False) or not instance.is_active)
+
+    def forget():
+        forget_user(user_id)
+        if revoke:
+            bump_token_version(user_id)
+    transaction.on_commit(forget)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    user_id = instance.id
+
+    def forget():
+        forget_user(user_id)
+        bump_token_version(user_id)
+    transaction.on_commit(forget)
@@ -0,0 +1,70 @@
+"""
+Refresh-token blacklist in Redis, in place of the token_blacklist tables.
+
+    auth:blacklist:<jti>    set when the token is blacklisted (logout,
+                            rotation), expires with the token
+    auth:blacklist:synced   set once the jtis the tables still blacklist were
+                            copied here (copy_tables())
+
+A check is one round trip whatever the number of tokens ever issued, and the
+keys clean themselves up. The keys live with the token versions in the
+Redis database of the 'auth' cache alias.
+
+The tables are no longer written. Run `manage.py sync_token_blacklist` when
+deploying; until then (or the first purge_expired_tokens run, which copies
+them too), a jti missing here is also looked up in the tables so tokens
+blacklisted before the switch stay refused.
+"""
+import time
+
+from django.utils import timezone
+from django_redis import get_redis_connection
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+SYNCED_KEY = 'auth:blacklist:synced'
+
+
+def _key(jti):
+    return f'auth:blacklist:{jti}'
+
+
+def add(jti, exp):
+    """
+    Blacklist `jti` until `exp` (epoch seconds). Returns False when it was
+    already blacklisted, or has expired: the token must not be used.
+    """
+    if exp <= time.time():
+        return False
+    return bool(get_redis_connection('auth').set(_key(jti), 1, exat=int(exp), nx=True))
+
+
+def add_many(entries):
+    """Blacklist every (jti, exp) of `entries` in one round trip; returns the number added"""
+    now = time.time()
+    added = 0
+    with get_redis_connection('auth').pipeline(transaction=False) as pipe:
+        for jti, exp in entries:
+            if exp > now:
+                pipe.set(_key(jti), 1, exat=int(exp))
+                added += 1
+        pipe.execute()
+    return added
+
+
+def contains(jti):
+    listed, synced = get_redis_connection('auth').mget(_key(jti), SYNCED_KEY)
+    if listed is not None or synced is not None:
+        return listed is not None
+    return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+def copy_tables():
+    """Copy the unexpired jtis of the token_blacklist tables here; returns their number"""
+    copied = add_many(
+        (jti, expires_at.timestamp())
+        for jti, expires_at in BlacklistedToken.objects.filter(
+            token__expires_at__gt=timezone.now()
+        ).values_list('token__jti', 'token__expires_at').iterator()
+    )
+    get_redis_connection('auth').set(SYNCED_KEY, 1)
+    return copied
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2-SHA256 with settings.PASSWORD_PBKDF2_ITERATIONS rounds.
+    Same algorithm name, so existing hashes verify, and are rehashed on the
+    next successful login when the setting changes.
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
@@ -0,0 +1,62 @@
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure login requests per second on one core (sequential requests in this process) "
+        "for several PBKDF2 iteration counts and hasher policies, and how fast throttled "
+        "attempts are turned away"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--iterations', type=int, nargs='+', default=[1_000_000, 600_000, 260_000])
+        parser.add_argument('--policies', nargs='+', default=['pbkdf2', 'scrypt'], choices=list(settings.PASSWORD_HASHER_POLICIES))
+
+    def handle(self, *args, **options):
+        # One warning per throttled request otherwise
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        self.stdout.write(f"{'hasher':>24} {'logins/s':>10} {'ms/login':>10}")
+        # No throttling while measuring the hashers; testserver is the test client's host
+        limits = {'LOGIN_IP_LIMIT': 10 ** 9, 'LOGIN_USERNAME_LIMIT': 10 ** 9,
+                  'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver']}
+        with override_settings(**limits):
+            for policy in options['policies']:
+                hashers = settings.PASSWORD_HASHER_POLICIES[policy]
+                iterations = options['iterations'] if policy == 'pbkdf2' else [settings.PASSWORD_PBKDF2_ITERATIONS]
+                for count in iterations:
+                    label = f'pbkdf2 x{count}' if policy == 'pbkdf2' else policy
+                    with override_settings(PASSWORD_HASHERS=hashers, PASSWORD_PBKDF2_ITERATIONS=count):
+                        self.report(label, self.measure(options['requests']))
+
+        with override_settings(LOGIN_IP_LIMIT=0, ALLOWED_HOSTS=limits['ALLOWED_HOSTS']):
+            self.report('throttled (429)', self.measure(options['requests'] * 10, status=429))
+
+    def report(self, label, per_second):
+        self.stdout.write(f"{label:>24} {per_second:>10.1f} {1000 / per_second:>10.2f}")
+
+    def measure(self, requests, status=200):
+        username, password = f'bench-{uuid.uuid4().hex[:12]}', uuid.uuid4().hex
+        user = User.objects.create_user(username=username, password=password)
+        client = Client()
+        data = {'username': username, 'password': password}
+        try:
+            # Warm up: the first login may rehash with the hasher being measured
+            client.post(reverse('account:login'), data, content_type='application/json')
+            started = time.perf_counter()
+            for _ in range(requests):
+                response = client.post(reverse('account:login'), data, content_type='application/json')
+                assert response.status_code == status, response.content
+            return requests / (time.perf_counter() - started)
+        finally:
+            user.delete()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from account import blacklist
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the refresh tokens still blacklisted in the token_blacklist tables to the Redis "
+        "blacklist; run once when deploying, refreshes query the tables until then"
+    )
+
+    def handle(self, *args, **options):
+        copied = blacklist.copy_tables()
+        self.stdout.write(self.style.SUCCESS(f"Copied {copied} blacklisted tokens to Redis"))
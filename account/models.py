@@ -1,3 +1,23 @@
 from django.db import models
+from django.contrib.auth import get_user_model
 
 # Create your models here.
+User = get_user_model()
+
+
+class Follow(models.Model):
+    id = models.AutoField(primary_key=True)
+    follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name="following")
+    followee = models.ForeignKey(User, on_delete=models.CASCADE, related_name="followers")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["follower", "followee"], name="uniq_follow")
+        ]
+        indexes = [
+            models.Index(fields=["followee", "follower"]),
+        ]
+
+    def __str__(self):
+        return f"#{self.follower_id} follows #{self.followee_id}"
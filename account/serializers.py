@@ -1,7 +1,12 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
-from rest_framework.validators import UniqueValidator
+from django.db.models import Q
+from rest_framework_simplejwt import serializers as jwt_serializers
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from .tokens import VERSION_CLAIM, RefreshToken, token_version
 
 User = get_user_model()
 
@@ -9,14 +14,9 @@ User = get_user_model()
 class UserSignupSerializer(serializers.ModelSerializer):
     """Serializer for user registration"""
     
-    username = serializers.CharField(
-        required=True,
-        validators=[UniqueValidator(queryset=User.objects.all())]
-    )
-    email = serializers.EmailField(
-        required=True,
-        validators=[UniqueValidator(queryset=User.objects.all())]
-    )
+    # Uniqueness of both is checked with one query in validate()
+    username = serializers.CharField(required=True)
+    email = serializers.EmailField(required=True)
     password = serializers.CharField(
         write_only=True,
         required=True,
@@ -38,11 +38,22 @@ class UserSignupSerializer(serializers.ModelSerializer):
         }
     
     def validate(self, attrs):
-        """Validate that passwords match"""
+        """Validate that passwords match and that the username and email are free"""
         if attrs['password'] != attrs['password2']:
             raise serializers.ValidationError({
                 "password": "Password fields didn't match."
             })
+
+        errors = {}
+        for username, email in User.objects.filter(
+            Q(username=attrs['username']) | Q(email=attrs['email'])
+        ).values_list('username', 'email')[:2]:
+            if username == attrs['username']:
+                errors['username'] = "A user with that username already exists."
+            if email == attrs['email']:
+                errors['email'] = "This field must be unique."
+        if errors:
+            raise serializers.ValidationError(errors)
         return attrs
     
     def create(self, validated_data):
@@ -75,4 +86,32 @@ class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'username', 'email', 'first_name', 'last_name', 'date_joined')
-        read_only_fields = ('id', 'date_joined')
\ No newline at end of file
+        read_only_fields = ('id', 'date_joined')
+
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    """
+    simplejwt's refresh without a database query: the token is checked against
+    the Redis blacklist, and the token version (bumped on deactivation and
+    deletion) stands in for loading the user. A rotated token is blacklisted
+    atomically, so two refreshes racing with it cannot both succeed.
+    """
+    token_class = RefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if refresh.get(VERSION_CLAIM, 0) < token_version(refresh[api_settings.USER_ID_CLAIM]):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+
+        data = {'access': str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                try:
+                    refresh.blacklist()
+                except TokenError as e:
+                    raise InvalidToken(e.args[0])
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data['refresh'] = str(refresh)
+        return data
@@ -0,0 +1,26 @@
+from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+from . import blacklist
+
+
+@shared_task
+def purge_expired_tokens():
+    """
+    Delete the expired OutstandingToken rows, their BlacklistedToken rows with
+    them, in batches; copy the jtis still blacklisted in the tables to the
+    Redis blacklist, which is the one checked.
+    """
+    blacklist.copy_tables()
+
+    expired = OutstandingToken.objects.filter(expires_at__lte=timezone.now())
+    purged = 0
+    while True:
+        ids = list(expired.values_list('id', flat=True)[:settings.ACCOUNT_TOKEN_PURGE_BATCH])
+        if not ids:
+            break
+        OutstandingToken.objects.filter(id__in=ids).delete()
+        purged += len(ids)
+    return f"Purged {purged} expired tokens"
@@ -1,3 +1,280 @@
-from django.test import TestCase
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django_redis import get_redis_connection
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from . import blacklist
+from .tasks import purge_expired_tokens
+from .tokens import RefreshToken, bump_token_version
+
+User = get_user_model()
+
+
+class CachedJWTAuthenticationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        get_redis_connection('auth').flushdb()
+        self.user = User.objects.create_user(
+            username='alice', email='alice@example.com', password='pass12345', first_name='Alice', last_name='A',
+        )
+        self.refresh = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.refresh.access_token}')
+        self.url = reverse('account:profile')
+
+    def test_user_row_is_cached(self):
+        with self.assertNumQueries(1):
+            first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(second.data['email'], 'alice@example.com')
+
+    @override_settings(ACCOUNT_USER_CACHE_TTL=0)
+    def test_user_from_claims_without_cache(self):
+        post_url = reverse('post-list-create')
+        response = self.client.post(post_url, {'title': 'Hello', 'body': 'World'}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        with self.assertNumQueries(2):  # posts, liked posts; no user
+            post_id = self.client.get(post_url).data['results'][0]['id']
+        # The claims user is the author: the ownership check passes
+        response = self.client.put(
+            reverse('post-update-delete', kwargs={'post_id': post_id}), {'title': 'Hi', 'body': 'There'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_saving_the_user_drops_the_cached_row(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Alicia'
+            self.user.save()
+
+        self.assertEqual(self.client.get(self.url).data['first_name'], 'Alicia')
+
+    def test_deactivation_revokes_tokens(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'token_revoked')
+
+    def test_privilege_and_password_changes_revoke_tokens(self):
+        for change in (lambda user: setattr(user, 'is_staff', True), lambda user: user.set_password('new-pass12345')):
+            with self.subTest(change=change):
+                self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+                self.assertEqual(self.client.get(self.url).status_code, 200)
+                with self.captureOnCommitCallbacks(execute=True):
+                    change(self.user)
+                    self.user.save()
+                self.assertEqual(self.client.get(self.url).data['code'], 'token_revoked')
+
+    def test_other_saves_keep_tokens(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Alicia'
+            self.user.save()
+            # A login rehashing the password with the current hasher
+            with override_settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+                self.assertTrue(self.user.check_password('pass12345'))
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_versions_survive_cache_clear(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_superuser = True
+            self.user.save()
+        cache.clear()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_logout_everywhere_revokes_other_tokens(self):
+        other = RefreshToken.for_user(self.user)
+        response = self.client.post(
+            reverse('account:logout'), {'refresh': str(self.refresh), 'everywhere': True}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {other.access_token}')
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+        # Tokens issued afterwards carry the new version
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_plain_logout_keeps_other_tokens(self):
+        other = RefreshToken.for_user(self.user)
+        self.client.post(reverse('account:logout'), {'refresh': str(self.refresh)}, format='json')
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {other.access_token}')
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_versions_only_move_forward(self):
+        self.assertEqual(bump_token_version(self.user.id), 1)
+        self.assertEqual(bump_token_version(self.user.id), 2)
+        self.assertEqual(RefreshToken.for_user(self.user)['ver'], 2)
+
+
+class TokenBlacklistTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        get_redis_connection('auth').flushdb()
+        # Deployed: the tables were copied
+        blacklist.copy_tables()
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.refresh = RefreshToken.for_user(self.user)
+        self.url = reverse('account:token_refresh')
+
+    def refresh_with(self, token):
+        return self.client.post(self.url, {'refresh': str(token)}, format='json')
+
+    def test_rotation_without_queries(self):
+        with self.assertNumQueries(0):
+            response = self.refresh_with(self.refresh)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.refresh_with(self.refresh).status_code, 401)
+        self.assertEqual(self.refresh_with(response.data['refresh']).status_code, 200)
+
+        # The blacklist entry lives as long as the token
+        ttl = get_redis_connection('auth').ttl(f'auth:blacklist:{self.refresh["jti"]}')
+        self.assertAlmostEqual(ttl, self.refresh['exp'] - time.time(), delta=5)
+        self.assertFalse(OutstandingToken.objects.exists())
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+    def test_logout_blacklists_the_refresh_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.refresh.access_token}')
+        self.client.post(reverse('account:logout'), {'refresh': str(self.refresh)}, format='json')
+
+        self.assertEqual(self.refresh_with(self.refresh).status_code, 401)
+
+    def test_deactivated_user_cannot_refresh(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+
+        response = self.refresh_with(self.refresh)
+        self.assertEqual((response.status_code, response.data['code']), (401, 'no_active_account'))
+
+    def test_purge_deletes_expired_rows_and_keeps_blacklist(self):
+        now = timezone.now()
+        expired = [
+            OutstandingToken.objects.create(user=self.user, jti=f'old{i}', token='x', expires_at=now - timedelta(hours=1))
+            for i in range(3)
+        ]
+        valid = OutstandingToken.objects.create(user=self.user, jti='live', token='x', expires_at=now + timedelta(hours=1))
+        BlacklistedToken.objects.create(token=expired[0])
+        BlacklistedToken.objects.create(token=valid)
+
+        with override_settings(ACCOUNT_TOKEN_PURGE_BATCH=2):
+            purge_expired_tokens()
+
+        self.assertEqual(list(OutstandingToken.objects.values_list('jti', flat=True)), ['live'])
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+        self.assertTrue(blacklist.contains('live'))
+        self.assertFalse(blacklist.contains('old0'))
+
+    def test_tables_are_checked_until_copied(self):
+        token = OutstandingToken.objects.create(
+            user=self.user, jti=self.refresh['jti'], token=str(self.refresh),
+            expires_at=timezone.now() + timedelta(days=1),
+        )
+        BlacklistedToken.objects.create(token=token)
+        get_redis_connection('auth').flushdb()
+
+        self.assertEqual(self.refresh_with(self.refresh).status_code, 401)
+
+        out = StringIO()
+        call_command('sync_token_blacklist', stdout=out)
+        self.assertIn('Copied 1 blacklisted tokens', out.getvalue())
+        with self.assertNumQueries(0):
+            self.assertEqual(self.refresh_with(self.refresh).status_code, 401)
+
+
+class LoginThrottleTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.url = reverse('account:login')
+
+    def login(self, password, username='alice', ip='10.0.0.1'):
+        return self.client.post(self.url, {'username': username, 'password': password}, format='json', REMOTE_ADDR=ip)
+
+    def test_failed_logins_lock_the_username(self):
+        for _ in range(settings.LOGIN_USERNAME_LIMIT):
+            self.assertEqual(self.login('wrong').status_code, 401)
+
+        with mock.patch('account.views.authenticate') as authenticate:
+            response = self.login('pass12345', ip='10.0.0.2')
+        authenticate.assert_not_called()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+    def test_successful_login_clears_failures(self):
+        for _ in range(settings.LOGIN_USERNAME_LIMIT - 1):
+            self.login('wrong')
+        self.assertEqual(self.login('pass12345').status_code, 200)
+        self.assertEqual(self.login('wrong').status_code, 401)
+
+    @override_settings(LOGIN_IP_LIMIT=3)
+    def test_attempts_are_limited_per_ip(self):
+        for username in ('a', 'b', 'c'):
+            self.assertEqual(self.login('x', username=username).status_code, 401)
+        self.assertEqual(self.login('x', username='d').status_code, 429)
+        self.assertEqual(self.login('x', username='d', ip='10.0.0.2').status_code, 401)
+
+    @override_settings(SIGNUP_IP_LIMIT=1)
+    def test_signups_are_limited_per_ip(self):
+        data = {'email': 'b@example.com', 'password': 'Xy7!pass-word', 'password2': 'Xy7!pass-word',
+                'first_name': 'B', 'last_name': 'B'}
+        url = reverse('account:signup')
+        self.assertEqual(self.client.post(url, {**data, 'username': 'bob'}, format='json').status_code, 201)
+        self.assertEqual(self.client.post(url, {**data, 'username': 'carol'}, format='json').status_code, 429)
+
+
+class PasswordPolicyTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.signup = {
+            'username': 'bob', 'email': 'bob@example.com', 'password': 'Xy7!pass-word', 'password2': 'Xy7!pass-word',
+            'first_name': 'Bob', 'last_name': 'B',
+        }
+
+    def test_signup_checks_username_and_email_in_one_query(self):
+        with self.assertNumQueries(2):  # existence check, insert
+            response = self.client.post(reverse('account:signup'), self.signup, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.post(reverse('account:signup'), self.signup, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {'username', 'email'})
+        response = self.client.post(reverse('account:signup'), {**self.signup, 'username': 'bobby'}, format='json')
+        self.assertEqual(set(response.data), {'email'})
+
+    def test_login_rehashes_with_the_current_policy(self):
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+            user = User.objects.create_user(username='alice', password='pass12345')
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+
+        login = {'username': 'alice', 'password': 'pass12345'}
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.assertEqual(self.client.post(reverse('account:login'), login, format='json').status_code, 200)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$2000$'))
+
+        with override_settings(PASSWORD_HASHERS=settings.PASSWORD_HASHER_POLICIES['scrypt']):
+            self.assertEqual(self.client.post(reverse('account:login'), login, format='json').status_code, 200)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('scrypt$'))
@@ -0,0 +1,71 @@
+"""
+Redis rate limits in front of login and signup, checked before any password
+is hashed:
+
+    throttle:login:ip:<ip>          login attempts of the window
+    throttle:login:user:<username>  failed logins of the window, deleted by a
+                                    successful one
+    throttle:signup:ip:<ip>         signups of the window
+
+Fixed windows: the first hit of a window creates its counter with the window
+as TTL. Rejected attempts count too, a client hammering the endpoint stays
+blocked until it slows down.
+"""
+from django.conf import settings
+from django_redis import get_redis_connection
+from rest_framework.throttling import BaseThrottle
+
+_throttle = BaseThrottle()
+
+
+def client_ip(request):
+    """The client address, behind REST_FRAMEWORK['NUM_PROXIES'] proxies like DRF's throttles"""
+    return _throttle.get_ident(request)
+
+
+def _username_key(username):
+    return f'throttle:login:user:{username.lower()}'
+
+
+def _hit(pipe, key, window):
+    pipe.set(key, 0, ex=window, nx=True)
+    pipe.incr(key)
+    pipe.ttl(key)
+
+
+def check_login(request, username):
+    """
+    Count a login attempt. Returns the seconds to wait when the client IP or
+    the username is over its limit, None when the attempt may go on.
+    """
+    user_key = _username_key(username)
+    with get_redis_connection('default').pipeline(transaction=False) as pipe:
+        _hit(pipe, f'throttle:login:ip:{client_ip(request)}', settings.LOGIN_IP_WINDOW)
+        pipe.get(user_key)
+        pipe.ttl(user_key)
+        _, attempts, ip_ttl, failures, user_ttl = pipe.execute()
+
+    if attempts > settings.LOGIN_IP_LIMIT:
+        return max(ip_ttl, 1)
+    if int(failures or 0) >= settings.LOGIN_USERNAME_LIMIT:
+        return max(user_ttl, 1)
+    return None
+
+
+def record_login(username, success):
+    """A successful login clears the failures of the username, a failed one adds to them"""
+    redis = get_redis_connection('default')
+    if success:
+        redis.delete(_username_key(username))
+        return
+    with redis.pipeline(transaction=False) as pipe:
+        _hit(pipe, _username_key(username), settings.LOGIN_USERNAME_WINDOW)
+        pipe.execute()
+
+
+def check_signup(request):
+    """Count a signup attempt; the seconds to wait when the client IP is over its limit, else None"""
+    with get_redis_connection('default').pipeline(transaction=False) as pipe:
+        _hit(pipe, f'throttle:signup:ip:{client_ip(request)}', settings.SIGNUP_IP_WINDOW)
+        _, attempts, ttl = pipe.execute()
+    return max(ttl, 1) if attempts > settings.SIGNUP_IP_LIMIT else None
@@ -0,0 +1,65 @@
+"""
+The refresh token of the account app: token versions, the claims
+CachedJWTAuthentication builds request.user from, and the Redis blacklist.
+
+Every user has a token version, 0 until first bumped. Tokens carry the
+version current when they were issued; authentication refuses those older
+than the user's current version, so bumping it revokes every token of the
+user at once (deactivation, privilege or password change, logout
+everywhere). Versions are raw keys in the Redis database of the 'auth'
+cache alias, without expiry: a lost one would bring revoked tokens back, so
+they stay out of the default cache, which is cleared and evicted.
+"""
+from django_redis import get_redis_connection
+from rest_framework_simplejwt import tokens
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from . import blacklist as jti_blacklist
+
+VERSION_CLAIM = 'ver'
+USER_CLAIMS = ('username', 'is_staff', 'is_superuser')
+
+
+def version_key(user_id):
+    return f'auth:token_version:{user_id}'
+
+
+def token_version(user_id):
+    return int(get_redis_connection('auth').get(version_key(user_id)) or 0)
+
+
+def bump_token_version(user_id):
+    """Revoke every token issued to the user so far; returns the new version"""
+    return get_redis_connection('auth').incr(version_key(user_id))
+
+
+class RefreshToken(tokens.RefreshToken):
+    """
+    simplejwt's refresh token plus the token version and USER_CLAIMS; its
+    access tokens (and those of /token/refresh/) copy them.
+
+    Blacklisted in Redis (account.blacklist) rather than in the
+    token_blacklist tables, and not recorded as outstanding.
+    """
+
+    @classmethod
+    def for_user(cls, user):
+        # Skips BlacklistMixin.for_user, which writes an OutstandingToken row
+        token = super(tokens.BlacklistMixin, cls).for_user(user)
+        token[VERSION_CLAIM] = token_version(user.id)
+        for claim in USER_CLAIMS:
+            token[claim] = getattr(user, claim)
+        return token
+
+    def check_blacklist(self):
+        if jti_blacklist.contains(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError("Token is blacklisted")
+
+    def blacklist(self):
+        """Blacklist this token; raises TokenError when it already was"""
+        if not jti_blacklist.add(self.payload[api_settings.JTI_CLAIM], self.payload['exp']):
+            raise TokenError("Token is blacklisted")
+
+    def outstand(self):
+        return None
@@ -1,6 +1,6 @@
 from django.urls import path
 from rest_framework_simplejwt.views import TokenRefreshView
-from .views import SignupView, LoginView, LogoutView, UserProfileView
+from .views import SignupView, LoginView, LogoutView, UserProfileView, FollowToggleView
 
 app_name = 'account'
 
@@ -13,6 +13,9 @@ urlpatterns = [
     # User profile
     path('profile/', UserProfileView.as_view(), name='profile'),
     
+    # Follow/unfollow
+    path('users/<int:user_id>/follow', FollowToggleView.as_view(), name='follow-toggle'),
+    
     # Token refresh
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 ]
\ No newline at end of file
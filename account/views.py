@@ -2,16 +2,25 @@ from rest_framework import status, generics
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.exceptions import TokenError
 from django.contrib.auth import authenticate, get_user_model
 
+from . import throttling
+from .authentication import forget_user
+from .models import Follow
+from .tokens import RefreshToken, bump_token_version
 from .serializers import UserSignupSerializer, UserLoginSerializer, UserSerializer
 
 User = get_user_model()
 
 
+def _too_many_requests(message, retry_after):
+    return Response({
+        'error': message
+    }, status=status.HTTP_429_TOO_MANY_REQUESTS, headers={'Retry-After': str(retry_after)})
+
+
 class SignupView(generics.CreateAPIView):
     """
     API endpoint for user registration
@@ -31,6 +40,10 @@ class SignupView(generics.CreateAPIView):
     serializer_class = UserSignupSerializer
     
     def create(self, request, *args, **kwargs):
+        retry_after = throttling.check_signup(request)
+        if retry_after:
+            return _too_many_requests('Too many signups, try again later', retry_after)
+
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
@@ -67,9 +80,15 @@ class LoginView(APIView):
         
         username = serializer.validated_data['username']
         password = serializer.validated_data['password']
-        
-        # Authenticate user
+
+        # Before authenticate(), which hashes the password
+        retry_after = throttling.check_login(request, username)
+        if retry_after:
+            return _too_many_requests('Too many login attempts, try again later', retry_after)
+
+        # Authenticate user; a hash from an older hasher policy is upgraded here
         user = authenticate(request, username=username, password=password)
+        throttling.record_login(username, success=user is not None)
         
         if user is not None:
             if user.is_active:
@@ -100,7 +119,8 @@ class LogoutView(APIView):
     
     POST /account/logout/
     {
-        "refresh": "refresh_token_here"
+        "refresh": "refresh_token_here",
+        "everywhere": false      // optional, true also revokes every other token of the user
     }
     """
     permission_classes = [IsAuthenticated]
@@ -117,6 +137,9 @@ class LogoutView(APIView):
             # Blacklist the refresh token
             token = RefreshToken(refresh_token)
             token.blacklist()
+            forget_user(request.user.id)
+            if request.data.get('everywhere') is True:
+                bump_token_version(request.user.id)
             
             return Response({
                 'message': 'Logout successful'
@@ -142,4 +165,35 @@ class UserProfileView(generics.RetrieveAPIView):
     serializer_class = UserSerializer
     
     def get_object(self):
-        return self.request.user
\ No newline at end of file
+        user = self.request.user
+        # Built from token claims: load the profile fields in one query, not one per field
+        if user.get_deferred_fields() & set(self.serializer_class.Meta.fields):
+            user = User.objects.get(id=user.id)
+        return user
+
+
+class FollowToggleView(APIView):
+    """
+    API endpoint to follow/unfollow a user
+
+    POST /account/users/<user_id>/follow
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, user_id):
+        if user_id == request.user.id:
+            return Response({
+                'error': 'You cannot follow yourself'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if not User.objects.filter(id=user_id).exists():
+            return Response({
+                'error': 'User not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        deleted, _ = Follow.objects.filter(follower=request.user, followee_id=user_id).delete()
+        if not deleted:
+            Follow.objects.get_or_create(follower=request.user, followee_id=user_id)
+
+        return Response({
+            'following': not deleted
+        }, status=status.HTTP_200_OK)
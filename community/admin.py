@@ -1,8 +1,9 @@
 from django.contrib import admin
-from .models import Post, PostLike, Comment, CommentLike
+from .models import Post, PostLike, Comment, CommentLike, KarmaRollup
 
 # Register your models here.
 admin.site.register(Post)
 admin.site.register(PostLike)
 admin.site.register(Comment)
-admin.site.register(CommentLike)
\ No newline at end of file
+admin.site.register(CommentLike)
+admin.site.register(KarmaRollup)
\ No newline at end of file
@@ -3,3 +3,12 @@ from django.apps import AppConfig
 
 class CommunityConfig(AppConfig):
     name = 'community'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+        from . import search
+
+        post_migrate.connect(search.create_index, sender=self)
+
+        # Connect the like_toggled, Follow, save and delete receivers
+        from . import feed, karma_cache, leaderboard, rollups, trending, versions  # noqa: F401
@@ -0,0 +1,27 @@
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.utils import timezone
+
+
+def today():
+    """The current calendar day in settings.TIME_ZONE"""
+    return timezone.localdate(timezone=timezone.get_default_timezone())
+
+
+def day_of(moment):
+    """The calendar day in settings.TIME_ZONE of an aware datetime, e.g. a like's created_at"""
+    return timezone.localdate(moment, timezone=timezone.get_default_timezone())
+
+
+def day_window(day):
+    """
+    Half-open [start, end) UTC range of a calendar day in settings.TIME_ZONE.
+
+    Filter with created_at__gte=start, created_at__lt=end: unlike
+    created_at__date it compares the raw column, so an index on created_at
+    can serve it. Days around DST changes are 23 or 25 hours long.
+    """
+    tz = timezone.get_default_timezone()
+    start = datetime.combine(day, time.min, tzinfo=tz)
+    end = datetime.combine(day + timedelta(days=1), time.min, tzinfo=tz)
+    return start.astimezone(dt_timezone.utc), end.astimezone(dt_timezone.utc)
@@ -0,0 +1,68 @@
+"""
+Streaming NDJSON export of posts, comments and likes.
+
+Rows are read with .values().iterator(chunk_size) and encoded one line at a
+time, so memory stays flat however much is exported. Every line is an object
+with a "type" ("post", "comment", "post_like", "comment_like").
+"""
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import days
+from .models import Post, PostLike, Comment, CommentLike
+
+# type -> (model, exported fields, author field, post field)
+EXPORTS = {
+    'post': (Post, ['id', 'author_id', 'title', 'body', 'like_count', 'created_at'], 'author_id', 'id'),
+    'comment': (
+        Comment, ['id', 'post_id', 'author_id', 'parent_id', 'body', 'like_count', 'created_at'], 'author_id', 'post_id'
+    ),
+    'post_like': (PostLike, ['id', 'post_id', 'user_id', 'created_at'], 'user_id', 'post_id'),
+    'comment_like': (CommentLike, ['id', 'comment_id', 'user_id', 'created_at'], 'user_id', 'comment__post_id'),
+}
+
+
+def parse_bound(value, end=False):
+    """
+    A date (a whole day in settings.TIME_ZONE, `end` includes it) or a datetime
+    as the bound of the created_at range; raises ValueError when unparsable.
+    """
+    day = parse_date(value)
+    if day is not None:
+        return days.day_window(day)[1 if end else 0]
+    moment = parse_datetime(value)
+    if moment is None:
+        raise ValueError(f"Not a date or datetime: {value!r}")
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+def querysets(types, author_id=None, start=None, end=None, post_id=None):
+    """
+    (type, queryset of dicts) for every requested type. `author_id` is the
+    author of posts/comments and the user of likes; [start, end) filters on
+    created_at; `post_id` keeps a post and what belongs to it.
+    """
+    for kind in types:
+        model, fields, author_field, post_field = EXPORTS[kind]
+        queryset = model.objects.order_by('id')
+        if author_id is not None:
+            queryset = queryset.filter(**{author_field: author_id})
+        if start is not None:
+            queryset = queryset.filter(created_at__gte=start)
+        if end is not None:
+            queryset = queryset.filter(created_at__lt=end)
+        if post_id is not None:
+            queryset = queryset.filter(**{post_field: post_id})
+        yield kind, queryset.values(*fields)
+
+
+def ndjson_lines(types, chunk_size=None, **filters):
+    """Encoded NDJSON lines (bytes) of the export, generated lazily"""
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for kind, queryset in querysets(types, **filters):
+        for row in queryset.iterator(chunk_size=chunk_size):
+            row['type'] = kind
+            yield (encoder.encode(row) + '\n').encode()
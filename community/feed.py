@@ -0,0 +1,141 @@
+"""
+Home feed: the newest posts of the users you follow, plus your own.
+
+Fan-out on write: when a post is created, fan_out_post pushes its id to the
+timeline of the author and of every follower.
+
+    feed:timeline:<user id>     LIST of post ids, newest first, capped at
+                                settings.FEED_TIMELINE_SIZE
+    feed:celebrities            SET of authors with at least
+                                settings.FEED_CELEBRITY_THRESHOLD followers
+
+Posts of celebrities are not pushed (one post would mean millions of writes),
+they are pulled on read from the posts table instead and merged in.
+A page of the feed is hydrated with one in_bulk query.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django_redis import get_redis_connection
+
+from account.models import Follow
+from .models import Post
+
+CELEBRITIES_KEY = 'feed:celebrities'
+
+
+def _timeline_key(user_id):
+    return f'feed:timeline:{user_id}'
+
+
+def _push(pipe, user_id, post_ids):
+    key = _timeline_key(user_id)
+    pipe.lpush(key, *post_ids)
+    pipe.ltrim(key, 0, settings.FEED_TIMELINE_SIZE - 1)
+
+
+def fan_out(post_id, author_id):
+    """Push `post_id` to the timelines of its author and followers; returns the number of timelines written"""
+    redis = get_redis_connection('default')
+    followers = Follow.objects.filter(followee_id=author_id)
+
+    if followers.count() >= settings.FEED_CELEBRITY_THRESHOLD:
+        with redis.pipeline() as pipe:
+            pipe.sadd(CELEBRITIES_KEY, author_id)
+            _push(pipe, author_id, [post_id])
+            pipe.execute()
+        return 1
+
+    redis.srem(CELEBRITIES_KEY, author_id)
+    written = 0
+    follower_ids = followers.values_list('follower_id', flat=True).iterator(chunk_size=settings.FEED_FANOUT_BATCH)
+    with redis.pipeline(transaction=False) as pipe:
+        _push(pipe, author_id, [post_id])
+        written += 1
+        for follower_id in follower_ids:
+            _push(pipe, follower_id, [post_id])
+            written += 1
+            if written % settings.FEED_FANOUT_BATCH == 0:
+                pipe.execute()
+        pipe.execute()
+    return written
+
+
+def backfill(user_id, followee_id):
+    """Merge the recent posts of a newly followed user into `user_id`'s timeline"""
+    if get_redis_connection('default').sismember(CELEBRITIES_KEY, followee_id):
+        return 0
+    post_ids = list(
+        Post.objects.filter(author_id=followee_id)
+        .order_by('-id').values_list('id', flat=True)[:settings.FEED_TIMELINE_SIZE]
+    )
+    if not post_ids:
+        return 0
+
+    key = _timeline_key(user_id)
+
+    def merge(pipe):
+        # Retried by redis-py when a concurrent fan-out touches the list
+        merged = set(post_ids).union(int(post_id) for post_id in pipe.lrange(key, 0, -1))
+        merged = sorted(merged, reverse=True)[:settings.FEED_TIMELINE_SIZE]
+        pipe.multi()
+        pipe.delete(key)
+        pipe.rpush(key, *merged)
+
+    get_redis_connection('default').transaction(merge, key)
+    return len(post_ids)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_new_follow(sender, instance, created, **kwargs):
+    if not created:
+        return
+    # Imported here, tasks.py imports this module
+    from .tasks import backfill_timeline
+
+    follower_id, followee_id = instance.follower_id, instance.followee_id
+    transaction.on_commit(lambda: backfill_timeline.delay(follower_id, followee_id))
+
+
+def page(user, before, limit):
+    """
+    Posts of the feed of `user` older than post id `before` (None for the
+    newest), newest first. Returns (posts, next_before); next_before is None
+    on the last page.
+
+    Entries of users unfollowed since they were pushed, and of deleted posts,
+    are skipped.
+    """
+    redis = get_redis_connection('default')
+    with redis.pipeline(transaction=False) as pipe:
+        pipe.lrange(_timeline_key(user.id), 0, -1)
+        pipe.smembers(CELEBRITIES_KEY)
+        pushed, celebrities = pipe.execute()
+
+    followees = set(Follow.objects.filter(follower=user).values_list('followee_id', flat=True))
+    followed_celebrities = followees.intersection(int(user_id) for user_id in celebrities)
+
+    candidates = {int(post_id) for post_id in pushed}
+    if followed_celebrities:
+        pulled = Post.objects.filter(author_id__in=followed_celebrities)
+        if before is not None:
+            pulled = pulled.filter(id__lt=before)
+        candidates.update(pulled.order_by('-id').values_list('id', flat=True)[:limit + 1])
+    if before is not None:
+        candidates = {post_id for post_id in candidates if post_id < before}
+
+    # Over-fetch a little so skipped entries rarely leave a page short
+    ids = sorted(candidates, reverse=True)[:limit * 2 + 1]
+    posts = Post.objects.in_bulk(ids)
+    allowed = followees | {user.id}
+    items = [posts[post_id] for post_id in ids if post_id in posts and posts[post_id].author_id in allowed]
+
+    next_before = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_before = items[-1].id
+    elif len(ids) > limit * 2:
+        # Short page because of skipped entries, continue after the last id looked at
+        next_before = ids[-1]
+    return items, next_before
@@ -0,0 +1,156 @@
+"""
+Batch creation of posts and comments, for importers and migration scripts.
+
+A batch is validated item by item; invalid items are reported by index and
+the valid ones are written with bulk_create in chunks of
+settings.BULK_CHUNK_SIZE, all in one transaction.
+
+bulk_create skips Model.save() and post_save, so what they would have done is
+done here for the whole batch: comment paths, the search index, post versions
+and the feed fan-out.
+"""
+from django.conf import settings
+from django.db import transaction
+
+from . import search, versions
+from .models import Post, Comment, comment_path_segment
+from .serializers import PostBulkSerializer, CommentBulkSerializer
+
+
+def _chunks(items):
+    size = settings.BULK_CHUNK_SIZE
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _errors(item_errors):
+    return [{"index": index, "errors": errors} for index, errors in sorted(item_errors.items())]
+
+
+def ingest_posts(author, items):
+    """
+    Create the valid posts of `items` for `author`.
+    Returns {"created": [{"index", "id"}], "errors": [{"index", "errors"}]};
+    raises ValidationError when `items` is not a list or too long.
+    """
+    # Imported here, tasks.py imports the feed, which imports the models
+    from .tasks import fan_out_posts
+
+    serializer = PostBulkSerializer(data=items, many=True, max_length=settings.BULK_MAX_ITEMS)
+    serializer.is_valid(raise_exception=True)
+    valid = serializer.validated_data
+
+    posts = [Post(author=author, **data) for _, data in valid]
+    with transaction.atomic():
+        for chunk in _chunks(posts):
+            Post.objects.bulk_create(chunk)
+        search.get_index().saved(search.POST, posts)
+
+    post_ids = [post.id for post in posts]
+    if post_ids:
+        transaction.on_commit(lambda: fan_out_posts.delay(post_ids))
+    return {
+        "created": [{"index": index, "id": post.id} for (index, _), post in zip(valid, posts)],
+        "errors": _errors(serializer.item_errors),
+    }
+
+
+def ingest_comments(author, items, refs=None):
+    """
+    Create the valid comments of `items` for `author`.
+
+    A comment can reply to an existing comment (`parent`) or to one earlier in
+    the batch (`parent_ref`, the `ref` of that item). `refs` ({ref: comment id})
+    carries the refs of earlier batches along and is updated with this one.
+
+    Returns {"created": [{"index", "id", "ref"}], "errors": [{"index", "errors"}]};
+    raises ValidationError when `items` is not a list or too long.
+    """
+    refs = {} if refs is None else refs
+    serializer = CommentBulkSerializer(data=items, many=True, max_length=settings.BULK_MAX_ITEMS)
+    serializer.is_valid(raise_exception=True)
+    item_errors = dict(serializer.item_errors)
+
+    # Everything referenced, checked with two queries for the whole batch
+    valid = serializer.validated_data
+    post_ids = set(Post.objects.filter(id__in={data['post'] for _, data in valid}).values_list('id', flat=True))
+    parent_ids = {data['parent'] for _, data in valid if data.get('parent')}
+    parent_ids.update(refs[data['parent_ref']] for _, data in valid if data.get('parent_ref') in refs)
+    parents = {
+        row['id']: row for row in Comment.objects.filter(id__in=parent_ids).values('id', 'post_id', 'path', 'depth')
+    }
+
+    # Resolve parents in batch order; pending[ref] is an item accepted earlier in this batch
+    pending = {}
+    accepted = []
+    for index, data in valid:
+        ref, parent_ref = data.pop('ref', None), data.pop('parent_ref', None)
+        parent, level, error = None, 0, None
+        if data['post'] not in post_ids:
+            error = {"post": ["Post not found."]}
+        elif ref is not None and (ref in pending or ref in refs):
+            error = {"ref": ["Duplicate ref."]}
+        elif parent_ref is not None and parent_ref in pending:
+            parent = pending[parent_ref]
+            level = parent['level'] + 1
+        elif parent_ref is not None and parent_ref in refs:
+            parent = parents.get(refs[parent_ref])
+        elif parent_ref is not None:
+            error = {"parent_ref": ["Unknown ref, or its comment could not be created."]}
+        elif data.get('parent'):
+            parent = parents.get(data['parent'])
+            if parent is None:
+                error = {"parent": ["Comment not found."]}
+
+        if error is None and parent is not None and parent['post_id'] != data['post']:
+            error = {"parent": ["The parent comment belongs to another post."]}
+        if error is None and parent is None and parent_ref is not None:
+            error = {"parent_ref": ["Comment not found."]}
+        if error:
+            item_errors[index] = error
+            continue
+
+        item = {
+            'index': index, 'ref': ref, 'level': level, 'parent': parent, 'post_id': data['post'],
+            'comment': Comment(author=author, post_id=data['post'], body=data['body']),
+        }
+        accepted.append(item)
+        if ref is not None:
+            pending[ref] = item
+
+    # One level at a time, so every parent has its id and path before its replies are written
+    with transaction.atomic():
+        for level in range(max((item['level'] for item in accepted), default=-1) + 1):
+            items_of_level = [item for item in accepted if item['level'] == level]
+            for item in items_of_level:
+                parent = item['parent']
+                if parent is not None:
+                    item['comment'].parent_id = parent['comment'].id if 'comment' in parent else parent['id']
+            comments = [item['comment'] for item in items_of_level]
+            for chunk in _chunks(comments):
+                Comment.objects.bulk_create(chunk)
+
+            for item in items_of_level:
+                comment, parent = item['comment'], item['parent']
+                if parent is None:
+                    parent_path, parent_depth = '', -1
+                elif 'comment' in parent:
+                    parent_path, parent_depth = parent['comment'].path, parent['comment'].depth
+                else:
+                    parent_path, parent_depth = parent['path'], parent['depth']
+                comment.path = parent_path + comment_path_segment(comment.id)
+                comment.depth = parent_depth + 1
+            Comment.objects.bulk_update(comments, ['path', 'depth'], batch_size=settings.BULK_CHUNK_SIZE)
+
+        search.get_index().saved(search.COMMENT, [item['comment'] for item in accepted])
+        # bulk_create sends no post_save
+        versions.bump_posts(item['post_id'] for item in accepted)
+
+    refs.update({item['ref']: item['comment'].id for item in accepted if item['ref'] is not None})
+    return {
+        "created": [
+            {"index": item['index'], "id": item['comment'].id, "ref": item['ref']}
+            for item in sorted(accepted, key=lambda item: item['index'])
+        ],
+        "errors": _errors(item_errors),
+    }
@@ -0,0 +1,125 @@
+"""
+Caches in front of the karma reads.
+
+Leaderboards: stale-while-revalidate. The boards are kept for
+KARMA_CACHE_HARD_TTL and served even when older than KARMA_CACHE_SOFT_TTL; a
+stale read enqueues refresh_karma_boards instead, which only recomputes the
+top-N boards from the rollups. The day rebuild of update_daily_karma_cache
+(reconcile) is left to the nightly schedule, UpdateKarmaCacheView and days
+missing from the real-time leaderboard. A lock per task in the cache (a Redis
+SET NX) makes sure only one of each is in flight, so concurrent readers and
+UpdateKarmaCacheView share it.
+
+Per-user totals: the daily / weekly / monthly karma of a user, loaded from the
+rollup table on a miss and dropped by the like_toggled signal whenever the
+user likes or unlikes something.
+"""
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.dispatch import receiver
+from django_redis import get_redis_connection
+
+from . import days, rollups, versions
+from .signals import like_toggled
+
+CACHE_KEY = 'karma_leaderboards'
+LOCK_KEY = 'karma_leaderboards:refresh'
+RECONCILE_LOCK_KEY = 'karma_leaderboards:reconcile'
+USER_TOTALS_HITS = 'karma:user_totals:hits'
+USER_TOTALS_MISSES = 'karma:user_totals:misses'
+
+
+def store(boards):
+    cache.set(CACHE_KEY, {'boards': boards, 'computed_at': time.time()}, settings.KARMA_CACHE_HARD_TTL)
+    versions.bump_boards()
+
+
+def get_boards():
+    """(boards, age in seconds or None) of the last good leaderboards; refreshes them in the background when stale"""
+    entry = cache.get(CACHE_KEY)
+    if entry is None:
+        request_refresh()
+        return {}, None
+
+    age = int(time.time() - entry['computed_at'])
+    if age > settings.KARMA_CACHE_SOFT_TTL:
+        request_refresh()
+    return entry['boards'], age
+
+
+def _lock_key(reconcile):
+    return RECONCILE_LOCK_KEY if reconcile else LOCK_KEY
+
+
+def request_refresh(reconcile=False):
+    """
+    Enqueue refresh_karma_boards, or update_daily_karma_cache with `reconcile`,
+    unless the same task is already in flight. Returns (task_id, enqueued);
+    task_id is the in-flight task when not enqueued.
+    """
+    # Imported here, tasks.py imports this module
+    from .tasks import refresh_karma_boards, update_daily_karma_cache
+
+    task = update_daily_karma_cache if reconcile else refresh_karma_boards
+    lock_key = _lock_key(reconcile)
+    task_id = str(uuid.uuid4())
+    if not cache.add(lock_key, task_id, settings.KARMA_REFRESH_LOCK_TTL):
+        return cache.get(lock_key), False
+
+    try:
+        task.apply_async(task_id=task_id)
+    except Exception:
+        cache.delete(lock_key)
+        raise
+    return task_id, True
+
+
+def release_refresh_lock(task_id, reconcile=False):
+    """Called by the refresh tasks when done; only the task holding the lock releases it"""
+    lock_key = _lock_key(reconcile)
+    if task_id and cache.get(lock_key) == task_id:
+        cache.delete(lock_key)
+
+
+def _user_totals_key(user_id, day):
+    return f'karma_user_totals:{user_id}:{day.isoformat()}'
+
+
+def get_user_totals(user, day):
+    """Daily / weekly / monthly karma of `user` (see rollups.karma_totals), cached per user and day"""
+    key = _user_totals_key(user.id, day)
+    totals = cache.get(key)
+    redis = get_redis_connection('default')
+    if totals is not None:
+        redis.incr(USER_TOTALS_HITS)
+        return totals
+
+    redis.incr(USER_TOTALS_MISSES)
+    totals = rollups.karma_totals(user, day)
+    cache.set(key, totals, settings.KARMA_USER_CACHE_TTL)
+    return totals
+
+
+@receiver(like_toggled)
+def invalidate_user_totals(sender, user, **kwargs):
+    cache.delete(_user_totals_key(user.id, days.today()))
+
+
+def forget_user_totals(user_ids):
+    """Drop the cached totals of `user_ids`, e.g. once the like buffer changed their rollups"""
+    today = days.today()
+    cache.delete_many([_user_totals_key(user_id, today) for user_id in user_ids])
+    versions.bump_user_karma(user_ids)
+
+
+def user_totals_stats():
+    hits, misses = get_redis_connection('default').mget(USER_TOTALS_HITS, USER_TOTALS_MISSES)
+    hits, misses = int(hits or 0), int(misses or 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+    }
@@ -0,0 +1,171 @@
+"""
+Real-time daily karma leaderboard in Redis.
+
+    karma:daily:<date>          ZSET user id -> karma of that day
+    karma:daily:<date>:likes    HASH "<user id>:postlike" / "<user id>:commentlike" -> like counts
+    karma:daily:<date>:built    set once update_daily_karma_cache rebuilt the day
+
+Like toggles adjust the day incrementally through the like_toggled signal,
+update_daily_karma_cache rebuilds it from the database as reconciliation.
+"""
+import hashlib
+
+from django.contrib.auth import get_user_model
+from django.dispatch import receiver
+from django_redis import get_redis_connection
+
+from .models import PostLike, CommentLike, POST_LIKE_KARMA, COMMENT_LIKE_KARMA
+from .signals import like_toggled
+
+User = get_user_model()
+
+KARMA_WEIGHTS = {PostLike: POST_LIKE_KARMA, CommentLike: COMMENT_LIKE_KARMA}
+
+# Keep a few days around, older days are never read
+DAY_TTL = 60 * 60 * 24 * 3
+
+
+def _keys(day):
+    key = f'karma:daily:{day.isoformat()}'
+    return key, f'{key}:likes', f'{key}:built'
+
+
+@receiver(like_toggled)
+def record_like(sender, user, liked, karma_day, **kwargs):
+    if karma_day is None:
+        return
+    scores_key, likes_key, _ = _keys(karma_day)
+    delta = 1 if liked else -1
+
+    with get_redis_connection('default').pipeline() as pipe:
+        pipe.zincrby(scores_key, KARMA_WEIGHTS[sender] * delta, user.id)
+        pipe.hincrby(likes_key, f'{user.id}:{sender._meta.model_name}', delta)
+        if delta < 0:
+            pipe.zremrangebyscore(scores_key, '-inf', 0)
+        pipe.expire(scores_key, DAY_TTL)
+        pipe.expire(likes_key, DAY_TTL)
+        pipe.execute()
+
+
+def is_built(day):
+    return bool(get_redis_connection('default').exists(_keys(day)[2]))
+
+
+def top(day, n):
+    """The n users with the most karma on `day`, best first"""
+    redis = get_redis_connection('default')
+    scores_key, likes_key, _ = _keys(day)
+    ranked = redis.zrevrange(scores_key, 0, n - 1, withscores=True)
+    if not ranked:
+        return []
+
+    user_ids = [int(user_id) for user_id, _ in ranked]
+    like_counts = _like_counts(redis, likes_key, user_ids)
+    usernames = _usernames(user_ids)
+
+    return [{
+        'user_id': user_id,
+        'username': usernames.get(user_id),
+        'daily_karma': int(score),
+        'post_likes': like_counts[user_id][0],
+        'comment_likes': like_counts[user_id][1],
+    } for user_id, (_, score) in zip(user_ids, ranked)]
+
+
+def standing(day, user_id, around=0):
+    """
+    Rank, karma and like counts of any user on `day`, plus the `around` users
+    ranked directly above and below. O(log n + around) on the sorted set.
+    Users without karma that day have no rank.
+    """
+    redis = get_redis_connection('default')
+    scores_key, likes_key, _ = _keys(day)
+
+    with redis.pipeline(transaction=False) as pipe:
+        pipe.zrevrank(scores_key, user_id)
+        pipe.zscore(scores_key, user_id)
+        position, score = pipe.execute()
+    post_likes, comment_likes = _like_counts(redis, likes_key, [user_id])[user_id]
+
+    result = {
+        'rank': None,
+        'daily_karma': int(score or 0),
+        'post_likes': post_likes,
+        'comment_likes': comment_likes,
+        'neighbors': [],
+    }
+    if position is None:
+        return result
+
+    result['rank'] = position + 1
+    if around:
+        start = max(position - around, 0)
+        window = redis.zrevrange(scores_key, start, position + around, withscores=True)
+        usernames = _usernames([int(member) for member, _ in window])
+        result['neighbors'] = [{
+            'rank': start + offset + 1,
+            'user_id': int(member),
+            'username': usernames.get(int(member)),
+            'daily_karma': int(score),
+        } for offset, (member, score) in enumerate(window)]
+    return result
+
+
+def fingerprint(day, user_id, n, around=0):
+    """
+    A digest of the sorted set as seen through top(day, n) and
+    standing(day, user_id, around): changes whenever one of them would, and
+    only then. Two Redis round trips, no database.
+    """
+    redis = get_redis_connection('default')
+    scores_key, likes_key, _ = _keys(day)
+
+    with redis.pipeline(transaction=False) as pipe:
+        pipe.zrevrange(scores_key, 0, n - 1, withscores=True)
+        pipe.zrevrank(scores_key, user_id)
+        pipe.zscore(scores_key, user_id)
+        pipe.hmget(likes_key, [f'{user_id}:postlike', f'{user_id}:commentlike'])
+        seen = pipe.execute()
+    position = seen[1]
+    if position is not None and around:
+        seen.append(redis.zrevrange(scores_key, max(position - around, 0), position + around, withscores=True))
+    return hashlib.md5(repr(seen).encode()).hexdigest()
+
+
+def _like_counts(redis, likes_key, user_ids):
+    """{user_id: (post_likes, comment_likes)}"""
+    fields = [f'{user_id}:{kind}' for user_id in user_ids for kind in ('postlike', 'commentlike')]
+    values = redis.hmget(likes_key, fields)
+    return {
+        user_id: (int(values[2 * i] or 0), int(values[2 * i + 1] or 0))
+        for i, user_id in enumerate(user_ids)
+    }
+
+
+def _usernames(user_ids):
+    return dict(User.objects.filter(id__in=user_ids).values_list('id', 'username'))
+
+
+def rebuild(day, user_karma):
+    """
+    Replace the leaderboard of `day` with `user_karma`, as computed by
+    update_daily_karma_cache: {user_id: {'post_likes', 'comment_likes', 'total'}}
+    """
+    redis = get_redis_connection('default')
+    scores_key, likes_key, built_key = _keys(day)
+    scores = {user_id: data['total'] for user_id, data in user_karma.items() if data['total'] > 0}
+    like_counts = {}
+    for user_id, data in user_karma.items():
+        like_counts[f'{user_id}:postlike'] = data['post_likes']
+        like_counts[f'{user_id}:commentlike'] = data['comment_likes']
+
+    with redis.pipeline() as pipe:
+        pipe.delete(scores_key, likes_key)
+        if scores:
+            pipe.zadd(scores_key, scores)
+            pipe.expire(scores_key, DAY_TTL)
+        if like_counts:
+            pipe.hset(likes_key, mapping=like_counts)
+            pipe.expire(likes_key, DAY_TTL)
+        pipe.set(built_key, 1, ex=DAY_TTL)
+        pipe.execute()
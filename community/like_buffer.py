@@ -0,0 +1,272 @@
+"""
+Write-behind buffer for likes (settings.LIKE_WRITE_BEHIND).
+
+While enabled, a like toggle only touches Redis:
+
+    likes:<kind>:<id>:users     SET of user ids that like the object, plus the
+                                "*" marker so an object without likes still
+                                has a key. SCARD - 1 is the like count.
+    likes:<kind>:<id>:pending   HASH user id -> "1"/"0", the net state of every
+                                user who toggled since the last flush
+    likes:<kind>:dirty          SET of object ids with pending changes
+    likes:<kind>:<id>:post      id of the post the object belongs to (its own
+                                for a post), sent along with like_toggled
+
+flush() (run by the flush_like_buffer Celery task) moves the pending changes
+to PostLike / CommentLike with bulk inserts and deletes, a batch of objects at
+a time, and applies them to the KarmaRollup rows.
+"""
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django_redis import get_redis_connection
+
+from . import days, karma_cache, rollups
+
+MARKER = '*'
+SEED_CHUNK = 1000
+
+# Flip the user in the set and record the new state as pending.
+# Returns nil if the set is not loaded yet, otherwise {liked, count, unflushed}
+# where unflushed tells that an unlike removed a like not flushed yet.
+TOGGLE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return nil
+end
+local liked = 1
+local unflushed = redis.call('HGET', KEYS[2], ARGV[1]) == '1' and 1 or 0
+if redis.call('SREM', KEYS[1], ARGV[1]) == 1 then
+    liked = 0
+else
+    redis.call('SADD', KEYS[1], ARGV[1])
+end
+redis.call('HSET', KEYS[2], ARGV[1], liked)
+redis.call('SADD', KEYS[3], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return {liked, redis.call('SCARD', KEYS[1]) - 1, unflushed}
+"""
+
+# Promote the freshly loaded set in KEYS[3] to KEYS[1], with unflushed changes
+# applied on top, unless a concurrent request loaded it first.
+SEED_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('DEL', KEYS[3])
+    return 0
+end
+redis.call('RENAME', KEYS[3], KEYS[1])
+local pending = redis.call('HGETALL', KEYS[2])
+for i = 1, #pending, 2 do
+    if pending[i + 1] == '1' then
+        redis.call('SADD', KEYS[1], pending[i])
+    else
+        redis.call('SREM', KEYS[1], pending[i])
+    end
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# Hand over the pending changes of one object to the flusher
+TAKE_PENDING_SCRIPT = """
+local pending = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return pending
+"""
+
+# Put changes back after a failed flush, without clobbering newer toggles
+RESTORE_PENDING_SCRIPT = """
+for i = 1, #ARGV - 1, 2 do
+    redis.call('HSETNX', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('SADD', KEYS[2], ARGV[#ARGV])
+return 1
+"""
+
+
+def _kind(target_model):
+    return target_model._meta.model_name
+
+
+def _keys(target_model, target_id):
+    prefix = f'likes:{_kind(target_model)}'
+    return f'{prefix}:{target_id}:users', f'{prefix}:{target_id}:pending', f'{prefix}:dirty'
+
+
+def _post_key(target_model, target_id):
+    return f'likes:{_kind(target_model)}:{target_id}:post'
+
+
+def _post_field(target_model):
+    return 'pk' if _kind(target_model) == 'post' else 'post_id'
+
+
+def _target_field(like_model, target_model):
+    return like_model._meta.get_field(_kind(target_model)).attname
+
+
+def toggle(like_model, target_model, target_id, user):
+    """Buffered counterpart of likes.toggle_like(), returns (liked, like_count, unflushed, post_id)"""
+    redis = get_redis_connection('default')
+    users_key, pending_key, dirty_key = _keys(target_model, target_id)
+    post_key = _post_key(target_model, target_id)
+    args = [user.id, target_id, settings.LIKE_BUFFER_TTL]
+
+    with redis.pipeline(transaction=False) as pipe:
+        pipe.eval(TOGGLE_SCRIPT, 3, users_key, pending_key, dirty_key, *args)
+        pipe.get(post_key)
+        pipe.expire(post_key, settings.LIKE_BUFFER_TTL)
+        result, post_id, _ = pipe.execute()
+    if result is None:
+        post_id = _seed(redis, like_model, target_model, target_id)
+        result = redis.eval(TOGGLE_SCRIPT, 3, users_key, pending_key, dirty_key, *args)
+    elif post_id is None:
+        # Expired on its own while the like set lived on
+        post_id = target_model.objects.filter(pk=target_id).values_list(_post_field(target_model), flat=True).get()
+        redis.set(post_key, post_id, ex=settings.LIKE_BUFFER_TTL)
+
+    liked, like_count, unflushed = result
+    return bool(liked), like_count, bool(unflushed), int(post_id)
+
+
+def get_states(target_model, target_ids, user):
+    """
+    {target_id: (liked, like_count)} of the objects whose like set is loaded,
+    in one round trip. The others have no pending changes, the database is
+    up to date for them.
+    """
+    target_ids = list(target_ids)
+    with get_redis_connection('default').pipeline(transaction=False) as pipe:
+        for target_id in target_ids:
+            users_key, _, _ = _keys(target_model, target_id)
+            pipe.sismember(users_key, user.id)
+            # 0 for a set that is not loaded, the marker counts one otherwise
+            pipe.scard(users_key)
+        results = pipe.execute()
+
+    states = {}
+    for i, target_id in enumerate(target_ids):
+        liked, members = results[2 * i], results[2 * i + 1]
+        if members:
+            states[target_id] = (bool(liked), members - 1)
+    return states
+
+
+def _seed(redis, like_model, target_model, target_id):
+    """Load the like set of the object into Redis, returns the id of its post"""
+    post_id = target_model.objects.filter(pk=target_id).values_list(_post_field(target_model), flat=True).first()
+    if post_id is None:
+        raise target_model.DoesNotExist
+    users_key, pending_key, _ = _keys(target_model, target_id)
+    seed_key = f'{users_key}:seed:{uuid.uuid4().hex}'
+    user_ids = like_model.objects.filter(
+        **{_target_field(like_model, target_model): target_id}
+    ).values_list('user_id', flat=True)
+
+    with redis.pipeline(transaction=False) as pipe:
+        pipe.sadd(seed_key, MARKER)
+        batch = []
+        for user_id in user_ids.iterator(chunk_size=SEED_CHUNK):
+            batch.append(user_id)
+            if len(batch) == SEED_CHUNK:
+                pipe.sadd(seed_key, *batch)
+                batch = []
+        if batch:
+            pipe.sadd(seed_key, *batch)
+        pipe.expire(seed_key, settings.LIKE_BUFFER_TTL)
+        pipe.set(_post_key(target_model, target_id), post_id, ex=settings.LIKE_BUFFER_TTL)
+        pipe.execute()
+    redis.eval(SEED_SCRIPT, 3, users_key, pending_key, seed_key, settings.LIKE_BUFFER_TTL)
+    return post_id
+
+
+def flush(like_model, target_model, batch_size=None):
+    """Write the buffered likes of one model to the database; returns the number of objects flushed"""
+    redis = get_redis_connection('default')
+    batch_size = batch_size or settings.LIKE_BUFFER_FLUSH_BATCH
+    dirty_key = f'likes:{_kind(target_model)}:dirty'
+
+    flushed = 0
+    while True:
+        target_ids = [int(target_id) for target_id in redis.spop(dirty_key, batch_size)]
+        if not target_ids:
+            return flushed
+
+        with redis.pipeline(transaction=False) as pipe:
+            for target_id in target_ids:
+                _, pending_key, _ = _keys(target_model, target_id)
+                pipe.eval(TAKE_PENDING_SCRIPT, 1, pending_key)
+            taken = pipe.execute()
+        changes = {
+            target_id: dict(zip(pending[::2], pending[1::2])) for target_id, pending in zip(target_ids, taken)
+        }
+
+        try:
+            user_ids = _write(like_model, target_model, changes)
+        except Exception:
+            with redis.pipeline(transaction=False) as pipe:
+                for target_id, pending in changes.items():
+                    _, pending_key, dirty_key = _keys(target_model, target_id)
+                    args = [value for item in pending.items() for value in item]
+                    pipe.eval(RESTORE_PENDING_SCRIPT, 2, pending_key, dirty_key, *args, target_id)
+                pipe.execute()
+            raise
+
+        karma_cache.forget_user_totals(user_ids)
+        flushed += len(target_ids)
+
+
+def _write(like_model, target_model, changes):
+    """Apply a batch of pending changes; returns the ids of the users whose karma changed"""
+    target_field = _target_field(like_model, target_model)
+    existing = set(target_model.objects.filter(pk__in=changes).values_list('pk', flat=True))
+
+    # (target_id, user_id) -> new state, of the objects still there
+    states = {
+        (target_id, int(user_id)): state == b'1'
+        for target_id, pending in changes.items() if target_id in existing
+        for user_id, state in pending.items()
+    }
+    if not states:
+        return set()
+    users_by_target = defaultdict(list)
+    for target_id, user_id in states:
+        users_by_target[target_id].append(user_id)
+    pairs = Q()
+    for target_id, user_ids in users_by_target.items():
+        pairs |= Q(**{target_field: target_id, 'user_id__in': user_ids})
+
+    today = days.today()
+    rollup_deltas = defaultdict(int)
+    with transaction.atomic():
+        stored = {
+            (row[target_field], row['user_id']): row
+            for row in like_model.objects.filter(pairs).values('id', target_field, 'user_id', 'created_at')
+        }
+        removed = [row for key, row in stored.items() if not states[key]]
+        added = [key for key, liked in states.items() if liked and key not in stored]
+
+        if removed:
+            like_model.objects.filter(id__in=[row['id'] for row in removed]).delete()
+            for row in removed:
+                rollup_deltas[row['user_id'], days.day_of(row['created_at'])] -= 1
+        if added:
+            like_model.objects.bulk_create(
+                [like_model(**{target_field: target_id, 'user_id': user_id}) for target_id, user_id in added],
+                ignore_conflicts=True,
+            )
+            for _, user_id in added:
+                rollup_deltas[user_id, today] += 1
+        rollups.apply_deltas(like_model, rollup_deltas)
+
+        # Re-count the flushed objects only
+        like_counts = like_model.objects.filter(
+            **{target_field: OuterRef('pk')}
+        ).order_by().values(target_field).annotate(total=Count('id')).values('total')
+        target_model.objects.filter(pk__in=existing).update(
+            like_count=Coalesce(Subquery(like_counts), 0)
+        )
+    return {user_id for user_id, _ in rollup_deltas}
@@ -0,0 +1,93 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from . import days, like_buffer
+from .models import Post
+from .signals import like_toggled
+
+
+def toggle_like(like_model, target_model, target_id, user):
+    """
+    Like or unlike a post/comment for `user`; returns (liked, like_count).
+
+    Built to be safe under concurrent double-taps:
+    - one lookup of the like's pk and created_at (the day its karma went to),
+      then unliking is a DELETE by pk; a row count of 0 means a concurrent
+      request removed it first
+    - liking is an INSERT in a savepoint; losing the race against a concurrent
+      like of the same user hits the unique constraint and counts as "liked"
+    - the like_count UPDATE doubles as the existence check for the target, a
+      missing post/comment raises target_model.DoesNotExist and rolls back;
+      reading the new count back also gives the post_id for like_toggled
+
+    With settings.LIKE_WRITE_BEHIND the toggle goes to the Redis like buffer
+    instead and reaches the database on the next flush_like_buffer run.
+
+    Every change of state is announced through the like_toggled signal; a
+    failing receiver is logged and does not fail the toggle.
+    """
+    today = days.today()
+
+    if settings.LIKE_WRITE_BEHIND:
+        liked, like_count, unflushed, post_id = like_buffer.toggle(like_model, target_model, target_id, user)
+        # Only a like still in the buffer is known to be from today
+        karma_day = today if liked or unflushed else None
+        like_toggled.send_robust(
+            like_model, target_id=target_id, post_id=post_id, user=user, liked=liked, karma_day=karma_day
+        )
+        return liked, like_count
+
+    target_field = like_model._meta.get_field(target_model._meta.model_name).attname
+    lookup = {target_field: target_id, 'user': user}
+
+    with transaction.atomic():
+        existing = like_model.objects.filter(**lookup).values_list('pk', 'created_at').first()
+        if existing is not None:
+            pk, created_at = existing
+            deleted, _ = like_model.objects.filter(pk=pk).delete()
+            liked, delta = False, -1 if deleted else 0
+            karma_day = days.day_of(created_at)
+        else:
+            liked, delta, karma_day = True, 1, today
+            try:
+                with transaction.atomic():
+                    like_model.objects.create(**lookup)
+            except IntegrityError:
+                delta = 0
+
+        targets = target_model.objects.filter(pk=target_id)
+        if delta and not targets.update(like_count=F('like_count') + delta):
+            raise target_model.DoesNotExist
+        post_field = 'pk' if target_model is Post else 'post_id'
+        like_count, post_id = targets.values_list('like_count', post_field).get()
+
+        if delta:
+            transaction.on_commit(lambda: like_toggled.send_robust(
+                like_model, target_id=target_id, post_id=post_id, user=user, liked=liked, karma_day=karma_day
+            ))
+
+    return liked, like_count
+
+
+def annotate_likes(like_model, target_model, objects, user):
+    """
+    Set `liked_by_me` on a page of posts/comments for `user`, with one query
+    for the whole page; like_count is the denormalized column. With
+    settings.LIKE_WRITE_BEHIND, both are taken from the like buffer where it
+    has them, in one Redis round trip.
+    """
+    objects = list(objects)
+    if not objects:
+        return objects
+    target_field = like_model._meta.get_field(target_model._meta.model_name).attname
+    ids = [obj.id for obj in objects]
+    liked = set(
+        like_model.objects.filter(user=user, **{f'{target_field}__in': ids}).values_list(target_field, flat=True)
+    )
+    states = like_buffer.get_states(target_model, ids, user) if settings.LIKE_WRITE_BEHIND else {}
+
+    for obj in objects:
+        obj.liked_by_me = obj.id in liked
+        if obj.id in states:
+            obj.liked_by_me, obj.like_count = states[obj.id]
+    return objects
@@ -0,0 +1,64 @@
+import json
+import sys
+from abc import ABCMeta, abstractmethod
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+User = get_user_model()
+
+
+class JsonlImportCommand(BaseCommand, metaclass=ABCMeta):
+    """Feed a JSONL file, one object per line, to ingest() in batches; subclasses must define it"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="JSONL file, '-' for stdin")
+        parser.add_argument('--author', required=True, help="Username the content is created for")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    @abstractmethod
+    def ingest(self, author, items):
+        """Create `items` for `author`; returns {'created': [...], 'errors': [{'index', 'errors'}]}"""
+
+    def handle(self, *args, **options):
+        try:
+            author = User.objects.get(username=options['author'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['author']!r} does not exist")
+
+        created = failed = 0
+        for line_numbers, items in self.batches(options['path'], options['batch_size']):
+            try:
+                result = self.ingest(author, items)
+            except ValidationError as exc:
+                raise CommandError(f"Batch starting at line {line_numbers[0]}: {exc.detail}")
+            created += len(result['created'])
+            for error in result['errors']:
+                failed += 1
+                self.stderr.write(f"line {line_numbers[error['index']]}: {error['errors']}")
+
+        style = self.style.SUCCESS if not failed else self.style.WARNING
+        self.stdout.write(style(f"Created {created}, failed {failed}"))
+
+    def batches(self, path, batch_size):
+        """([line number of each item], [item]) per batch; unparsable lines become items that fail validation"""
+        stream = sys.stdin if path == '-' else open(path, encoding='utf-8')
+        try:
+            line_numbers, items = [], []
+            for line_number, line in enumerate(stream, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    items.append(json.loads(line))
+                except json.JSONDecodeError:
+                    items.append(None)
+                line_numbers.append(line_number)
+                if len(items) >= batch_size:
+                    yield line_numbers, items
+                    line_numbers, items = [], []
+            if items:
+                yield line_numbers, items
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
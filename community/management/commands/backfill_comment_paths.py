@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from community.models import Comment, comment_path_segment
+
+
+class Command(BaseCommand):
+    help = "Fill in Comment.path / Comment.depth for comments created before materialized paths existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated = 0
+
+        # Walk the forest one level at a time, top-level comments first, so
+        # every parent path is known before its children are visited.
+        parent_paths = {None: ''}
+        depth = 0
+        while parent_paths:
+            level_paths = {}
+            parent_ids = list(parent_paths)
+            for start in range(0, len(parent_ids), batch_size):
+                chunk = parent_ids[start:start + batch_size]
+                if chunk == [None]:
+                    comments = Comment.objects.filter(parent__isnull=True)
+                else:
+                    comments = Comment.objects.filter(parent_id__in=chunk)
+
+                changed = []
+                for comment in comments.only('id', 'parent_id', 'path', 'depth').iterator(chunk_size=batch_size):
+                    path = parent_paths[comment.parent_id] + comment_path_segment(comment.id)
+                    level_paths[comment.id] = path
+                    if comment.path != path or comment.depth != depth:
+                        comment.path, comment.depth = path, depth
+                        changed.append(comment)
+                Comment.objects.bulk_update(changed, ['path', 'depth'], batch_size=batch_size)
+                updated += len(changed)
+
+            parent_paths = level_paths
+            depth += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Updated paths for {updated} comments"))
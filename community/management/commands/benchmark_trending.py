@@ -0,0 +1,57 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+
+from community import trending
+
+LOAD_CHUNK = 10000
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure trending page reads against synthetic sorted sets of growing size; "
+        "latency should stay flat since a page is O(log n + page size)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--reads', type=int, default=500)
+
+    def handle(self, *args, **options):
+        redis = get_redis_connection('default')
+        self.stdout.write(f"{'posts':>10} {'first page p50':>15} {'first page p99':>15} {'deep page p50':>15} {'deep page p99':>15}")
+
+        for size in options['sizes']:
+            key = f'trending:benchmark:{size}'
+            try:
+                self.load(redis, key, size)
+                first = self.measure(key, None, options['limit'], options['reads'])
+                # A cursor halfway down the set
+                member, score = redis.zrevrange(key, size // 2, size // 2, withscores=True)[0]
+                deep = self.measure(key, (score, int(member)), options['limit'], options['reads'])
+            finally:
+                redis.delete(key)
+            self.stdout.write(f"{size:>10} {first[0]:>13.3f}ms {first[1]:>13.3f}ms {deep[0]:>13.3f}ms {deep[1]:>13.3f}ms")
+
+    def load(self, redis, key, size):
+        redis.delete(key)
+        now = time.time()
+        for start in range(0, size, LOAD_CHUNK):
+            scores = {
+                post_id: random.random() * 4 + (now - random.random() * 86400 * 30) / 45000
+                for post_id in range(start + 1, min(start + LOAD_CHUNK, size) + 1)
+            }
+            redis.zadd(key, scores)
+
+    def measure(self, key, position, limit, reads):
+        timings = []
+        for _ in range(reads):
+            started = time.perf_counter()
+            trending.page_ids(position, limit, key=key)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
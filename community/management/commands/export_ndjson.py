@@ -0,0 +1,50 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from community import export
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Stream posts, comments and likes as NDJSON, one object per line"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', dest='types', action='append', choices=list(export.EXPORTS),
+                            help="Repeat for several types, default all")
+        parser.add_argument('--author', help="Username: posts/comments they wrote, likes they gave")
+        parser.add_argument('--since', help="Date (inclusive) or datetime")
+        parser.add_argument('--until', help="Date (inclusive) or datetime")
+        parser.add_argument('--post', type=int, help="A post and its comments and likes")
+        parser.add_argument('--output', help="File to write, default stdout")
+        parser.add_argument('--chunk-size', type=int)
+
+    def handle(self, *args, **options):
+        filters = {'post_id': options['post'], 'author_id': None, 'start': None, 'end': None}
+        if options['author']:
+            try:
+                filters['author_id'] = User.objects.values_list('id', flat=True).get(username=options['author'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['author']!r} does not exist")
+        try:
+            if options['since']:
+                filters['start'] = export.parse_bound(options['since'])
+            if options['until']:
+                filters['end'] = export.parse_bound(options['until'], end=True)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        lines = export.ndjson_lines(options['types'] or list(export.EXPORTS), options['chunk_size'], **filters)
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                count = self.write(output, lines)
+            self.stderr.write(self.style.SUCCESS(f"Exported {count} objects to {options['output']}"))
+        else:
+            for line in lines:
+                self.stdout.write(line.decode(), ending='')
+
+    def write(self, output, lines):
+        count = 0
+        for count, line in enumerate(lines, start=1):
+            output.write(line)
+        return count
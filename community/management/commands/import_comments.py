@@ -0,0 +1,18 @@
+from community.ingest import ingest_comments
+
+from ._jsonl import JsonlImportCommand
+
+
+class Command(JsonlImportCommand):
+    help = (
+        "Create comments from a JSONL file of {\"post\", \"body\", \"parent\" | \"parent_ref\", \"ref\"} objects; "
+        "parent_ref may point to any earlier line of the file"
+    )
+
+    def handle(self, *args, **options):
+        # Refs live across batches
+        self.refs = {}
+        super().handle(*args, **options)
+
+    def ingest(self, author, items):
+        return ingest_comments(author, items, refs=self.refs)
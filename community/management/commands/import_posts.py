@@ -0,0 +1,10 @@
+from community.ingest import ingest_posts
+
+from ._jsonl import JsonlImportCommand
+
+
+class Command(JsonlImportCommand):
+    help = "Create posts from a JSONL file of {\"title\", \"body\"} objects"
+
+    def ingest(self, author, items):
+        return ingest_posts(author, items)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from community import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of posts and comments from the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        index = search.get_index()
+        indexed = search.rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} posts and comments ({type(index).__name__})"))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F
+
+from community.models import Post, Comment
+
+
+class Command(BaseCommand):
+    help = "Repair Post.like_count / Comment.like_count where they drifted from the like tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Only report how many rows drifted")
+
+    def handle(self, *args, **options):
+        for model in (Post, Comment):
+            repaired = self.reconcile(model, options['batch_size'], options['dry_run'])
+            verb = "Found" if options['dry_run'] else "Repaired"
+            self.stdout.write(self.style.SUCCESS(f"{verb} {repaired} {model._meta.verbose_name_plural} with a wrong like_count"))
+
+    def reconcile(self, model, batch_size, dry_run):
+        drifted = (
+            model.objects.order_by()
+            .annotate(actual=Count('likes'))
+            .exclude(like_count=F('actual'))
+            .only('id', 'like_count')
+        )
+
+        repaired = 0
+        batch = []
+        for obj in drifted.iterator(chunk_size=batch_size):
+            obj.like_count = obj.actual
+            batch.append(obj)
+            if len(batch) >= batch_size:
+                repaired += self.save(model, batch, dry_run)
+                batch = []
+        repaired += self.save(model, batch, dry_run)
+        return repaired
+
+    def save(self, model, batch, dry_run):
+        if batch and not dry_run:
+            model.objects.bulk_update(batch, ['like_count'])
+        return len(batch)
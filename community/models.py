@@ -1,9 +1,22 @@
 from django.db import models
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
 from django.contrib.auth import get_user_model
 
 # Create your models here.
 User = get_user_model()
 
+# Karma earned per like
+POST_LIKE_KARMA = 5
+COMMENT_LIKE_KARMA = 1
+
+# Digits per materialized path segment, zero padded so paths sort like the tree
+COMMENT_PATH_WIDTH = 10
+
+
+def comment_path_segment(comment_id):
+    return f"{comment_id:0{COMMENT_PATH_WIDTH}d}/"
+
 
 class Post(models.Model):
     id = models.AutoField(primary_key=True)
@@ -11,8 +24,12 @@ class Post(models.Model):
     title = models.CharField(max_length=255)
     body = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    like_count = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
+        indexes = [
+            models.Index(fields=["author", "-created_at", "-id"]),
+        ]
         ordering = ["-created_at"]
     
     def __str__(self):
@@ -29,6 +46,9 @@ class PostLike(models.Model):
         constraints = [
             models.UniqueConstraint(fields=["post", "user"], name="uniq_post_like")
         ]
+        indexes = [
+            models.Index(fields=["created_at"]),
+        ]
     
     def __str__(self):
         return f"Post #{self.post.id} liked by #{self.user.id}"
@@ -41,17 +61,45 @@ class Comment(models.Model):
     parent = models.ForeignKey("self", null=True, blank=True, on_delete=models.CASCADE, related_name="children")
     body = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # Materialized path: ancestor ids (root first) followed by our own id,
+    # e.g. "0000000001/0000000004/". A subtree is a prefix range scan.
+    # Unbounded like the reply depth: 11 characters per level.
+    path = models.TextField(blank=True, default="", editable=False)
+    depth = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         indexes = [
             models.Index(fields=["post", "created_at"]),
             models.Index(fields=["parent", "created_at"]),
+            models.Index(fields=["post", "path"]),
         ]
         ordering = ["created_at"]
     
     def __str__(self):
         return f"Comment #{self.author} on Post by #{self.post.id}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        parent_path = self.parent.path if self.parent_id else ""
+        path = parent_path + comment_path_segment(self.id)
+        if path != self.path:
+            self._set_path(path, parent_path.count("/"))
+
+    def _set_path(self, path, depth):
+        """Store a new path for this comment and carry its subtree along"""
+        comments = Comment.objects.all()
+        if self.path:
+            comments = comments.filter(path__startswith=self.path)
+            comments.update(
+                path=Concat(Value(path), Substr("path", len(self.path) + 1), output_field=models.TextField()),
+                depth=F("depth") + (depth - self.depth),
+            )
+        else:
+            comments.filter(pk=self.pk).update(path=path, depth=depth)
+        self.path, self.depth = path, depth
+
 
 class CommentLike(models.Model):
     id = models.AutoField(primary_key=True)
@@ -63,6 +111,33 @@ class CommentLike(models.Model):
         constraints = [
             models.UniqueConstraint(fields=["comment", "user"], name="uniq_comment_like")
         ]
+        indexes = [
+            models.Index(fields=["created_at"]),
+        ]
 
     def __str__(self):
         return f"Comment #{self.comment.id} liked by #{self.user.id}"
+
+
+class KarmaRollup(models.Model):
+    """Likes given by a user on one day, pre-aggregated for karma reads"""
+    id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="karma_rollups")
+    bucket = models.DateField()
+    post_likes = models.IntegerField(default=0)
+    comment_likes = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "bucket"], name="uniq_karma_rollup")
+        ]
+        indexes = [
+            models.Index(fields=["bucket"]),
+        ]
+
+    def __str__(self):
+        return f"Karma of #{self.user_id} on {self.bucket}"
+
+    @property
+    def karma(self):
+        return self.post_likes * POST_LIKE_KARMA + self.comment_likes * COMMENT_LIKE_KARMA
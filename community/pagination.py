@@ -0,0 +1,98 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+
+def encode_cursor(*values):
+    """Opaque, url-safe token for a keyset position, e.g. (created_at, id)"""
+    values = [v.isoformat() if hasattr(v, 'isoformat') else v for v in values]
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_values(token):
+    raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    return json.loads(raw)
+
+
+def decode_cursor(token):
+    """Inverse of encode_cursor() for (created_at, id) positions; [] means "from the start" """
+    try:
+        values = _decode_values(token)
+        if values == []:
+            return values
+        created_at, pk = values
+        created_at = parse_datetime(created_at)
+        if created_at is None or not isinstance(pk, int):
+            raise ValueError
+    except (ValueError, TypeError):
+        raise ValidationError({'cursor': 'Invalid cursor.'})
+    return [created_at, pk]
+
+
+def decode_id_cursor(token):
+    """Inverse of encode_cursor() for positions that are just an id"""
+    try:
+        (pk,) = _decode_values(token)
+        if not isinstance(pk, int):
+            raise ValueError
+    except (ValueError, TypeError):
+        raise ValidationError({'cursor': 'Invalid cursor.'})
+    return pk
+
+
+def decode_score_cursor(token):
+    """Inverse of encode_cursor() for (score, id) positions"""
+    try:
+        score, pk = _decode_values(token)
+        if not isinstance(score, (int, float)) or not isinstance(pk, int):
+            raise ValueError
+    except (ValueError, TypeError):
+        raise ValidationError({'cursor': 'Invalid cursor.'})
+    return float(score), pk
+
+
+def get_int_param(request, name, default, minimum=0, maximum=None):
+    """Read an integer query param, clamped to `maximum`"""
+    value = request.query_params.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValidationError({name: 'Must be an integer.'})
+    if value < minimum:
+        raise ValidationError({name: f'Must be at least {minimum}.'})
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
+
+def keyset_paginate(queryset, cursor, limit, descending=False):
+    """
+    One page of `queryset` ordered by (created_at, id), starting after `cursor`.
+
+    Returns (items, next_cursor); next_cursor is None on the last page.
+    """
+    if descending:
+        queryset = queryset.order_by('-created_at', '-id')
+    else:
+        queryset = queryset.order_by('created_at', 'id')
+
+    position = decode_cursor(cursor) if cursor else []
+    if position:
+        created_at, pk = position
+        if descending:
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        else:
+            queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+
+    items = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1].created_at, items[-1].id)
+    return items, next_cursor
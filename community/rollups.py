@@ -0,0 +1,147 @@
+import heapq
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.dispatch import receiver
+
+from . import days
+from .models import PostLike, CommentLike, KarmaRollup, POST_LIKE_KARMA, COMMENT_LIKE_KARMA
+from .signals import like_toggled
+
+ROLLUP_FIELDS = {PostLike: 'post_likes', CommentLike: 'comment_likes'}
+
+
+@receiver(like_toggled)
+def record_like(sender, user, liked, karma_day, **kwargs):
+    # Buffered likes are not in the database yet, like_buffer.flush() applies them
+    if karma_day is None or settings.LIKE_WRITE_BEHIND:
+        return
+    field = ROLLUP_FIELDS[sender]
+    delta = 1 if liked else -1
+    rows = KarmaRollup.objects.filter(user=user, bucket=karma_day)
+
+    if rows.update(**{field: F(field) + delta}):
+        return
+    try:
+        with transaction.atomic():
+            KarmaRollup.objects.create(user=user, bucket=karma_day, **{field: max(delta, 0)})
+    except IntegrityError:
+        # Created by a concurrent like in the meantime
+        rows.update(**{field: F(field) + delta})
+
+
+def apply_deltas(like_model, deltas):
+    """
+    Add {(user_id, day): delta} to the like_model likes of the rollup rows,
+    creating the missing ones; one UPDATE per distinct (day, delta).
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    field = ROLLUP_FIELDS[like_model]
+    KarmaRollup.objects.bulk_create(
+        [KarmaRollup(user_id=user_id, bucket=day) for user_id, day in deltas], ignore_conflicts=True,
+    )
+    groups = defaultdict(list)
+    for (user_id, day), delta in deltas.items():
+        groups[day, delta].append(user_id)
+    for (day, delta), user_ids in groups.items():
+        KarmaRollup.objects.filter(bucket=day, user_id__in=user_ids).update(**{field: F(field) + delta})
+
+
+def rebuild_day(day):
+    """
+    Recompute the rollup rows of `day` from the like tables; returns
+    {user_id: {'post_likes', 'comment_likes', 'total'}} for that day.
+    """
+    start, end = days.day_window(day)
+
+    # Read and replace in one transaction with the day's rows locked first:
+    # record_like() increments wait for the rebuilt rows instead of landing
+    # between the read and the delete
+    with transaction.atomic():
+        list(KarmaRollup.objects.select_for_update().filter(bucket=day).values_list('pk', flat=True))
+
+        # Range scans on the created_at indexes
+        post_karma = PostLike.objects.filter(created_at__gte=start, created_at__lt=end).values('user').annotate(post_count=Count('id'))
+        comment_karma = CommentLike.objects.filter(created_at__gte=start, created_at__lt=end).values('user').annotate(comment_count=Count('id'))
+
+        user_karma = {}
+        for post in post_karma:
+            user_karma[post['user']] = {'post_likes': post['post_count'], 'comment_likes': 0}
+        for comment in comment_karma:
+            user_karma.setdefault(comment['user'], {'post_likes': 0, 'comment_likes': 0})
+            user_karma[comment['user']]['comment_likes'] = comment['comment_count']
+        for data in user_karma.values():
+            data['total'] = data['post_likes'] * POST_LIKE_KARMA + data['comment_likes'] * COMMENT_LIKE_KARMA
+
+        KarmaRollup.objects.filter(bucket=day).delete()
+        KarmaRollup.objects.bulk_create([
+            KarmaRollup(user_id=user_id, bucket=day, post_likes=data['post_likes'], comment_likes=data['comment_likes'])
+            for user_id, data in user_karma.items()
+        ], batch_size=1000)
+    return user_karma
+
+
+def karma_totals(user, day):
+    """Karma of `user` for the day, calendar week and calendar month containing `day`"""
+    week_start = day - timedelta(days=day.weekday())
+    month_start = day.replace(day=1)
+    karma = F('post_likes') * POST_LIKE_KARMA + F('comment_likes') * COMMENT_LIKE_KARMA
+
+    totals = KarmaRollup.objects.filter(
+        user=user, bucket__gte=min(week_start, month_start), bucket__lte=day
+    ).aggregate(
+        daily=Sum(karma, filter=Q(bucket=day)),
+        weekly=Sum(karma, filter=Q(bucket__gte=week_start)),
+        monthly=Sum(karma, filter=Q(bucket__gte=month_start)),
+    )
+    return {period: value or 0 for period, value in totals.items()}
+
+
+def top_karma(day, n):
+    """
+    Top `n` users of the daily, weekly (calendar week) and all-time boards, in
+    one pass over the per-user totals of the rollup table.
+
+    Returns {'daily': [...], 'weekly': [...], 'all_time': [...]}, each a list of
+    {'user_id', 'karma', 'post_likes', 'comment_likes'} dicts, best first.
+    """
+    periods = {
+        'daily': Q(bucket=day),
+        'weekly': Q(bucket__gte=day - timedelta(days=day.weekday()), bucket__lte=day),
+        'all_time': Q(bucket__lte=day),
+    }
+    annotations = {}
+    for period, q in periods.items():
+        annotations[f'{period}_post_likes'] = Sum('post_likes', filter=q)
+        annotations[f'{period}_comment_likes'] = Sum('comment_likes', filter=q)
+    totals = KarmaRollup.objects.values('user').order_by().annotate(**annotations)
+
+    # Min-heaps of (karma, -user_id, ...) capped at n, ties go to the lower user id
+    heaps = {period: [] for period in periods}
+    for row in totals.iterator(chunk_size=2000):
+        for period, heap in heaps.items():
+            post_likes = row[f'{period}_post_likes'] or 0
+            comment_likes = row[f'{period}_comment_likes'] or 0
+            karma = post_likes * POST_LIKE_KARMA + comment_likes * COMMENT_LIKE_KARMA
+            if karma <= 0:
+                continue
+            entry = (karma, -row['user'], post_likes, comment_likes)
+            if len(heap) < n:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+
+    return {
+        period: [{
+            'user_id': -neg_user_id,
+            'karma': karma,
+            'post_likes': post_likes,
+            'comment_likes': comment_likes,
+        } for karma, neg_user_id, post_likes, comment_likes in sorted(heap, reverse=True)]
+        for period, heap in heaps.items()
+    }
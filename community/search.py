@@ -0,0 +1,369 @@
+"""
+Full-text search over posts and comments, ranked with BM25.
+
+Two interchangeable index backends (settings.SEARCH_BACKEND):
+
+- "fts5": an SQLite FTS5 virtual table next to the other tables, written in
+  the same transaction as the post/comment. The rowid encodes the document:
+  2 * id for a post, 2 * id + 1 for a comment.
+- "disk": a pure-Python inverted index in dbm files under
+  settings.SEARCH_INDEX_DIR, for databases without FTS5. Saves and deletes
+  are indexed by the update_search_index task once the transaction commits,
+  so rolled back rows never reach it and requests never wait on its file
+  lock, which serializes the writes.
+
+"auto" picks fts5 on SQLite builds that have it. The index follows post and
+comment saves and deletes through signals (saved() / deleted());
+`manage.py rebuild_search_index` rebuilds it in bulk.
+"""
+import dbm
+import fcntl
+import json
+import math
+import os
+import re
+from collections import Counter
+from contextlib import contextmanager
+from functools import cache
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Post, Comment
+
+POST, COMMENT = 'post', 'comment'
+KINDS = {POST: 0, COMMENT: 1}
+
+WORD_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return WORD_RE.findall(text.lower())
+
+
+def documents(kind, objects):
+    """(kind, id, post_id, title, body) of posts or comments"""
+    if kind == POST:
+        return [(POST, post.id, post.id, post.title, post.body) for post in objects]
+    return [(COMMENT, comment.id, comment.post_id, '', comment.body) for comment in objects]
+
+
+class Fts5Index:
+    TABLE = 'community_search'
+
+    def ensure(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.TABLE} USING fts5("
+                "post_id UNINDEXED, title, body, tokenize = 'porter unicode61')"
+            )
+
+    def clear(self):
+        self.ensure()
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.TABLE}")
+
+    @staticmethod
+    def _rowid(kind, object_id):
+        return 2 * object_id + KINDS[kind]
+
+    def add(self, docs):
+        rows = [(self._rowid(kind, object_id), post_id, title, body) for kind, object_id, post_id, title, body in docs]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.TABLE} WHERE rowid = %s", [row[:1] for row in rows])
+            cursor.executemany(f"INSERT INTO {self.TABLE} (rowid, post_id, title, body) VALUES (%s, %s, %s, %s)", rows)
+
+    def remove(self, kind, object_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {self.TABLE} WHERE rowid = %s",
+                [(self._rowid(kind, object_id),) for object_id in object_ids],
+            )
+
+    def saved(self, kind, objects):
+        # In the same transaction as the rows
+        self.add(documents(kind, objects))
+
+    def deleted(self, kind, object_ids):
+        self.remove(kind, object_ids)
+
+    def optimize(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {self.TABLE} ({self.TABLE}) VALUES ('optimize')")
+
+    def search(self, query, kind, offset, limit):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        # Every term quoted: plain words, whatever FTS5 operators the user typed
+        match = ' '.join(f'"{term}"' for term in terms)
+        sql = (
+            f"SELECT rowid, post_id, bm25({self.TABLE}, 0, %s, 1) AS score FROM {self.TABLE} "
+            f"WHERE {self.TABLE} MATCH %s"
+        )
+        params = [settings.SEARCH_TITLE_WEIGHT, match]
+        if kind:
+            sql += " AND rowid %% 2 = %s"
+            params.append(KINDS[kind])
+        # bm25() is negative, lower is better
+        sql += " ORDER BY score, rowid LIMIT %s OFFSET %s"
+        params += [limit, offset]
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        return [(COMMENT if rowid % 2 else POST, rowid // 2, post_id, -score) for rowid, post_id, score in rows]
+
+
+class DiskIndex:
+    """
+    Inverted index in a dbm file:
+
+        t:<term>                number of documents with the term
+        t:<term>#<slot>         "<kind>:<id>" of one of them, slots 0 to n - 1
+        t:<term>:<kind>:<id>    "<weighted term frequency> <slot>"
+        d:<kind>:<id>           [post_id, length, [terms]]
+        meta                    [documents, total length]
+
+    Writing a document touches a few keys per term, however many documents
+    share it. A search walks the slots of its rarest term and looks the other
+    terms up per document. Title words count SEARCH_TITLE_WEIGHT times.
+    """
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, directory=None):
+        self.directory = str(directory or settings.SEARCH_INDEX_DIR)
+        self.path = os.path.join(self.directory, 'index')
+
+    def ensure(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    @contextmanager
+    def _open(self, flag='c'):
+        self.ensure()
+        with open(os.path.join(self.directory, 'lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if flag != 'r' else fcntl.LOCK_SH)
+            with dbm.open(self.path, flag) as db:
+                yield db
+
+    @staticmethod
+    def _get(db, key, default):
+        value = db.get(key)
+        return json.loads(value) if value is not None else default
+
+    def clear(self):
+        with self._open('n'):
+            pass
+
+    def _weighted_terms(self, title, body):
+        terms = Counter(tokenize(body))
+        for term in tokenize(title):
+            terms[term] += settings.SEARCH_TITLE_WEIGHT
+        return terms
+
+    @staticmethod
+    def _post(db, term, key, tf):
+        count = int(db.get(f't:{term}', 0))
+        db[f't:{term}#{count}'] = key
+        db[f't:{term}:{key}'] = f'{tf} {count}'
+        db[f't:{term}'] = str(count + 1)
+
+    @staticmethod
+    def _unpost(db, term, key):
+        _, slot = db[f't:{term}:{key}'].decode().split()
+        last = int(db[f't:{term}']) - 1
+        # The last document of the term takes the freed slot
+        if int(slot) != last:
+            moved = db[f't:{term}#{last}'].decode()
+            tf, _ = db[f't:{term}:{moved}'].decode().split()
+            db[f't:{term}#{slot}'] = moved
+            db[f't:{term}:{moved}'] = f'{tf} {slot}'
+        del db[f't:{term}#{last}']
+        del db[f't:{term}:{key}']
+        if last:
+            db[f't:{term}'] = str(last)
+        else:
+            del db[f't:{term}']
+
+    def _write(self, docs, removals):
+        with self._open() as db:
+            documents_count, total_length = self._get(db, 'meta', [0, 0])
+
+            for key in removals + [f'{kind}:{object_id}' for kind, object_id, *_ in docs]:
+                old = self._get(db, f'd:{key}', None)
+                if old is None:
+                    continue
+                _, length, terms = old
+                for term in terms:
+                    self._unpost(db, term, key)
+                documents_count -= 1
+                total_length -= length
+                del db[f'd:{key}']
+
+            for kind, object_id, post_id, title, body in docs:
+                key = f'{kind}:{object_id}'
+                terms = self._weighted_terms(title, body)
+                length = sum(terms.values())
+                for term, tf in terms.items():
+                    self._post(db, term, key, tf)
+                db[f'd:{key}'] = json.dumps([post_id, length, list(terms)])
+                documents_count += 1
+                total_length += length
+
+            db['meta'] = json.dumps([documents_count, total_length])
+
+    def add(self, docs):
+        docs = list(docs)
+        if docs:
+            self._write(docs, [])
+
+    def remove(self, kind, object_ids):
+        keys = [f'{kind}:{object_id}' for object_id in object_ids]
+        if keys:
+            self._write([], keys)
+
+    def saved(self, kind, objects):
+        self._update_later(kind, [obj.id for obj in objects])
+
+    def deleted(self, kind, object_ids):
+        self._update_later(kind, list(object_ids))
+
+    @staticmethod
+    def _update_later(kind, object_ids):
+        # Imported here, tasks.py imports this module
+        from .tasks import update_search_index
+
+        if object_ids:
+            transaction.on_commit(lambda: update_search_index.delay(kind, object_ids))
+
+    def optimize(self):
+        pass
+
+    def search(self, query, kind, offset, limit):
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return []
+        try:
+            with self._open('r') as db:
+                documents_count, total_length = self._get(db, 'meta', [0, 0])
+                counts = [int(db.get(f't:{term}', 0)) for term in terms]
+                # Every term must match, like the FTS5 backend
+                rarest = min(range(len(terms)), key=counts.__getitem__)
+                keys = [db[f't:{terms[rarest]}#{slot}'].decode() for slot in range(counts[rarest])]
+                if kind:
+                    keys = [key for key in keys if key.startswith(f'{kind}:')]
+                frequencies = {}
+                for key in keys:
+                    entries = [db.get(f't:{term}:{key}') for term in terms]
+                    if None not in entries:
+                        frequencies[key] = [int(entry.split()[0]) for entry in entries]
+                docs = {key: self._get(db, f'd:{key}', None) for key in frequencies}
+        except dbm.error:
+            # Nothing indexed yet
+            return []
+
+        average_length = total_length / documents_count if documents_count else 0
+        idfs = [math.log(1 + (documents_count - count + 0.5) / (count + 0.5)) for count in counts]
+        scores = Counter()
+        for key, tfs in frequencies.items():
+            length = docs[key][1]
+            for idf, tf in zip(idfs, tfs):
+                scores[key] += idf * tf * (self.K1 + 1) / (
+                    tf + self.K1 * (1 - self.B + self.B * length / average_length)
+                )
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[offset:offset + limit]
+        results = []
+        for key, score in ranked:
+            doc_kind, object_id = key.split(':')
+            results.append((doc_kind, int(object_id), docs[key][0], score))
+        return results
+
+
+@cache
+def _fts5_available():
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def get_index():
+    backend = settings.SEARCH_BACKEND
+    if backend == 'auto':
+        backend = 'fts5' if _fts5_available() else 'disk'
+    return Fts5Index() if backend == 'fts5' else DiskIndex()
+
+
+def create_index(using='default', **kwargs):
+    """post_migrate: the FTS5 table is not a model, create it with the others"""
+    if using == 'default' and isinstance(get_index(), Fts5Index):
+        Fts5Index().ensure()
+
+
+def search(query, kind=None, offset=0, limit=20):
+    """[(kind, id, post_id, score)] best first"""
+    try:
+        return get_index().search(query, kind, offset, limit)
+    except OperationalError:
+        # FTS5 table not created yet
+        return []
+
+
+def reindex(kind, object_ids):
+    """Bring the index entries of the posts or comments `object_ids` in line with their rows, deleted ones included"""
+    model = Post if kind == POST else Comment
+    docs = documents(kind, model.objects.filter(id__in=object_ids))
+    index = get_index()
+    index.remove(kind, set(object_ids) - {doc[1] for doc in docs})
+    index.add(docs)
+    return len(docs)
+
+
+def rebuild(batch_size=1000):
+    """Recreate the index from the posts and comments tables; returns the number of documents indexed"""
+    index = get_index()
+    indexed = 0
+    with transaction.atomic():
+        index.clear()
+        for kind, queryset in ((POST, Post.objects.only('id', 'title', 'body')),
+                               (COMMENT, Comment.objects.only('id', 'post_id', 'body'))):
+            batch = []
+            for obj in queryset.order_by().iterator(chunk_size=batch_size):
+                batch.append(obj)
+                if len(batch) >= batch_size:
+                    index.add(documents(kind, batch))
+                    indexed += len(batch)
+                    batch = []
+            index.add(documents(kind, batch))
+            indexed += len(batch)
+    index.optimize()
+    return indexed
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        get_index().saved(POST, [instance])
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, raw=False, **kwargs):
+    if not raw:
+        get_index().saved(COMMENT, [instance])
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    get_index().deleted(POST, [instance.id])
+
+
+@receiver(post_delete, sender=Comment)
+def unindex_comment(sender, instance, **kwargs):
+    get_index().deleted(COMMENT, [instance.id])
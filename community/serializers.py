@@ -1,13 +1,58 @@
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 from .models import Post, PostLike, Comment, CommentLike
 
 
 # For Posts
 class PostSerializer(serializers.ModelSerializer):
+    # Set by likes.annotate_likes() on list pages, left out otherwise
+    liked_by_me = serializers.ReadOnlyField()
+
+    class Meta:
+        model = Post
+        fields = ['id', 'author', 'title', 'body', 'created_at', 'like_count', 'liked_by_me']
+        read_only_fields = ['id', 'author', 'created_at', 'like_count']
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    ListSerializer for batch writes where an invalid item does not fail the batch.
+    After is_valid(), validated_data holds (index, data) of the valid items and
+    item_errors {index: errors} the others; only a malformed batch is invalid.
+    """
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: ["Expected a list of items."]})
+        if not data:
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: ["This list may not be empty."]})
+        if self.max_length is not None and len(data) > self.max_length:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [f"Ensure this field has no more than {self.max_length} elements."]
+            })
+
+        valid = []
+        self.item_errors = {}
+        for index, item in enumerate(data):
+            try:
+                valid.append((index, self.child.run_validation(item)))
+            except serializers.ValidationError as exc:
+                self.item_errors[index] = exc.detail
+        return valid
+
+
+class PostBulkSerializer(PostSerializer):
+    class Meta(PostSerializer.Meta):
+        list_serializer_class = BulkListSerializer
+
+
+class PostSummarySerializer(serializers.ModelSerializer):
+    """PostSerializer without the body, for list views"""
+    liked_by_me = serializers.ReadOnlyField()
+
     class Meta:
         model = Post
-        fields = ['id', 'author', 'title', 'body', 'created_at']
-        read_only_fields = ['id', 'author', 'created_at']
+        fields = ['id', 'author', 'title', 'created_at', 'like_count', 'liked_by_me']
+        read_only_fields = fields
 
 
 # For Comments
@@ -19,11 +64,63 @@ class RecursiveCommentSerializer(serializers.Serializer):
 class CommentSerializer(serializers.ModelSerializer):
     author = serializers.StringRelatedField(read_only=True)
     children = RecursiveCommentSerializer(many=True, read_only=True)
+    # Set by likes.annotate_likes() on list pages, left out otherwise
+    liked_by_me = serializers.ReadOnlyField()
+
+    class Meta:
+        model = Comment
+        fields = [ 'id', 'post', 'author', 'parent', 'body', 'created_at', 'like_count', 'liked_by_me', 'children']
+        read_only_fields = ['id', 'post', 'author', 'created_at', 'like_count', 'children']
+
+    def validate_parent(self, parent):
+        if parent and self.instance and self.instance.path and parent.path.startswith(self.instance.path):
+            raise serializers.ValidationError("A comment cannot be moved under its own reply.")
+        return parent
+
+
+class CommentTreeSerializer(CommentSerializer):
+    """CommentSerializer for trees loaded by threads.attach_replies()"""
+    children = serializers.SerializerMethodField()
+    more_replies = serializers.ReadOnlyField()
+
+    class Meta(CommentSerializer.Meta):
+        fields = CommentSerializer.Meta.fields + ['more_replies']
+
+    def get_children(self, obj):
+        return CommentTreeSerializer(obj.replies, many=True, context=self.context).data
+
+
+class CommentSummarySerializer(serializers.ModelSerializer):
+    """CommentSerializer without the replies, for list views"""
+    author = serializers.StringRelatedField(read_only=True)
+    liked_by_me = serializers.ReadOnlyField()
 
     class Meta:
         model = Comment
-        fields = [ 'id', 'post', 'author', 'parent', 'body', 'created_at', 'children']
-        read_only_fields = ['id', 'post', 'author', 'created_at', 'children']
+        fields = ['id', 'post', 'author', 'parent', 'body', 'created_at', 'like_count', 'liked_by_me']
+        read_only_fields = fields
+
+
+class CommentBulkSerializer(serializers.ModelSerializer):
+    """
+    One comment of a batch. `post` and `parent` are plain ids, checked for the
+    whole batch at once by ingest.ingest_comments(); `parent_ref` points to the
+    `ref` of a comment earlier in the batch.
+    """
+    post = serializers.IntegerField(min_value=1)
+    parent = serializers.IntegerField(min_value=1, required=False, allow_null=True)
+    ref = serializers.CharField(max_length=64, required=False)
+    parent_ref = serializers.CharField(max_length=64, required=False)
+
+    class Meta:
+        model = Comment
+        fields = ['post', 'parent', 'body', 'ref', 'parent_ref']
+        list_serializer_class = BulkListSerializer
+
+    def validate(self, attrs):
+        if attrs.get('parent') and attrs.get('parent_ref'):
+            raise serializers.ValidationError("Give either parent or parent_ref, not both.")
+        return attrs
 
 
 # For postlike
@@ -0,0 +1,12 @@
+from django.dispatch import Signal
+
+# Sent once a like toggle has been stored (after commit, or right away when the
+# like buffer is on). sender is PostLike or CommentLike.
+#   target_id   id of the liked post/comment
+#   post_id     id of the post, the liked one or the one of the comment
+#   user        who toggled
+#   liked       the new state
+#   karma_day   the day whose karma changed: today for a like, the day the
+#               like was made for an unlike. None when unknown (the like
+#               buffer removing a like already flushed, flush() handles it)
+like_toggled = Signal()
@@ -1,41 +1,107 @@
 from celery import shared_task
-from django.utils import timezone
-from django.db.models import Count
-from django.core.cache import cache
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import PostLike, CommentLike
+from datetime import date
+from . import days, feed, karma_cache, leaderboard, like_buffer, rollups, search, trending
+from .models import Post, PostLike, Comment, CommentLike
 
 User = get_user_model()
 
-@shared_task
-def update_daily_karma_cache():
-    today = timezone.now().date()
-    
-    post_karma = PostLike.objects.filter(created_at__date=today).values('user').annotate(post_count=Count('id'))
-    comment_karma = CommentLike.objects.filter(created_at__date=today).values('user').annotate(comment_count=Count('id'))
-    
-    user_karma = {}
-    for post in post_karma:
-        user_karma[post['user']] = {'post_likes': post['post_count'], 'comment_likes': 0, 'total': post['post_count'] * 5}
-    
-    for comment in comment_karma:
-        if comment['user'] in user_karma:
-            user_karma[comment['user']]['comment_likes'] += comment['comment_count']
-            user_karma[comment['user']]['total'] += comment['comment_count']
-        else:
-            user_karma[comment['user']] = {'post_likes': 0, 'comment_likes': comment['comment_count'], 'total': comment['comment_count']}
-    
-    # Cache top 5
-    top_users = sorted(user_karma.items(), key=lambda x: x[1]['total'], reverse=True)[:5]
-    cache_data = [{
-        'user_id': uid,
-        'username': User.objects.get(id=uid).username,
-        'daily_karma': data['total'],
-        'post_likes': data['post_likes'],
-        'comment_likes': data['comment_likes']
-    } for uid, data in top_users]
-    
-    cache.set('daily_karma_top5', cache_data, 300)
-    cache.set('daily_karma_all', user_karma, 300)
-    
+@shared_task(bind=True)
+def update_daily_karma_cache(self):
+    """
+    Reconciliation: rebuild today's karma rollup from the like tables, then the
+    real-time leaderboard and the cached daily / weekly / all-time top lists.
+    """
+    try:
+        return _update_daily_karma_cache()
+    finally:
+        karma_cache.release_refresh_lock(self.request.id, reconcile=True)
+
+
+@shared_task(bind=True)
+def refresh_karma_boards(self):
+    """
+    Stale-while-revalidate of karma_cache: recompute the cached top-N boards
+    from the rollups. Leaves the rollups and the real-time leaderboard alone,
+    the likes recorded meanwhile are already in them.
+    """
+    try:
+        _store_boards(days.today())
+        return "Karma leaderboards refreshed"
+    finally:
+        karma_cache.release_refresh_lock(self.request.id)
+
+
+def _update_daily_karma_cache():
+    today = days.today()
+    user_karma = rollups.rebuild_day(today)
+    leaderboard.rebuild(today, user_karma)
+    _store_boards(today)
     return f"Karma updated for {len(user_karma)} users"
+
+
+def _store_boards(today):
+    # Top N of every board in one pass, usernames in one query
+    boards = rollups.top_karma(today, settings.KARMA_LEADERBOARD_SIZE)
+    user_ids = {entry['user_id'] for board in boards.values() for entry in board}
+    usernames = dict(User.objects.filter(id__in=user_ids).values_list('id', 'username'))
+    for board in boards.values():
+        for entry in board:
+            entry['username'] = usernames.get(entry['user_id'])
+    
+    karma_cache.store(boards)
+
+
+@shared_task
+def rollup_karma(day=None):
+    """Recompute the KarmaRollup rows of one day (ISO date, default today), e.g. to backfill"""
+    day = date.fromisoformat(day) if day else days.today()
+    user_karma = rollups.rebuild_day(day)
+    return f"Karma rollup of {day} rebuilt for {len(user_karma)} users"
+
+
+@shared_task
+def flush_like_buffer():
+    posts = like_buffer.flush(PostLike, Post)
+    comments = like_buffer.flush(CommentLike, Comment)
+    return f"Flushed buffered likes for {posts} posts and {comments} comments"
+
+
+@shared_task
+def update_trending_scores():
+    """Incremental: rescore only the posts created, liked or commented since the last run"""
+    scored = trending.update_scores()
+    return f"Trending scores updated for {scored} posts"
+
+
+@shared_task
+def update_search_index(kind, object_ids):
+    """Index saved posts or comments (kind "post" / "comment") for the disk search backend, unindex deleted ones"""
+    indexed = search.reindex(kind, object_ids)
+    return f"Indexed {indexed} of {len(object_ids)} {kind}s"
+
+
+@shared_task
+def fan_out_post(post_id):
+    """Push a new post to the feed timelines of its author and followers"""
+    author_id = Post.objects.filter(id=post_id).values_list('author_id', flat=True).first()
+    if author_id is None:
+        return f"Post {post_id} is gone"
+    written = feed.fan_out(post_id, author_id)
+    return f"Post {post_id} pushed to {written} timelines"
+
+
+@shared_task
+def fan_out_posts(post_ids):
+    """fan_out_post for a batch of posts, e.g. from ingest.ingest_posts()"""
+    written = 0
+    for post_id, author_id in Post.objects.filter(id__in=post_ids).values_list('id', 'author_id'):
+        written += feed.fan_out(post_id, author_id)
+    return f"{len(post_ids)} posts pushed to {written} timelines"
+
+
+@shared_task
+def backfill_timeline(user_id, followee_id):
+    added = feed.backfill(user_id, followee_id)
+    return f"Merged {added} posts of user {followee_id} into the timeline of user {user_id}"
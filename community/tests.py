@@ -1,3 +1,1268 @@
-from django.test import TestCase
+import contextlib
+import json
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django_redis import get_redis_connection
+from rest_framework.test import APITestCase
+
+from . import days, export, feed, karma_cache, leaderboard, rollups, search, trending
+from .likes import annotate_likes, toggle_like
+from .models import Post, PostLike, Comment, CommentLike, KarmaRollup, comment_path_segment
+from .signals import like_toggled
+from .tasks import (
+    backfill_timeline, fan_out_post, fan_out_posts, flush_like_buffer, refresh_karma_boards, rollup_karma, update_daily_karma_cache,
+    update_search_index, update_trending_scores,
+)
+
+User = get_user_model()
+
+
+class PostListTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.client.force_authenticate(self.user)
+        self.url = reverse('post-list-create')
+
+    def test_keyset_pagination_newest_first(self):
+        posts = [Post.objects.create(author=self.user, title=f'Post {i}', body='text') for i in range(5)]
+        other = User.objects.create_user(username='bob', password='pass12345')
+        Post.objects.create(author=other, title='Not mine', body='text')
+
+        first = self.client.get(self.url, {'limit': 2})
+        rest = self.client.get(self.url, {'limit': 10, 'cursor': first.data['next_cursor']})
+
+        ids = [p['id'] for p in first.data['results'] + rest.data['results']]
+        self.assertEqual(ids, [p.id for p in reversed(posts)])
+        self.assertIsNone(rest.data['next_cursor'])
+
+    def test_summary_mode_leaves_out_body(self):
+        Post.objects.create(author=self.user, title='Post', body='long text')
+
+        response = self.client.get(self.url, {'summary': 'true'})
+
+        self.assertEqual(response.data['results'][0]['title'], 'Post')
+        self.assertNotIn('body', response.data['results'][0])
+
+
+class CommentListTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.post = Post.objects.create(author=self.user, title='Hello', body='World')
+        self.client.force_authenticate(self.user)
+        self.url = reverse('comment-list-create', kwargs={'post_id': self.post.id})
+
+    def _make_thread(self, roots, depth):
+        for _ in range(roots):
+            parent = None
+            for _ in range(depth):
+                parent = Comment.objects.create(post=self.post, author=self.user, parent=parent, body='hi')
+
+    def test_nested_shape(self):
+        root = Comment.objects.create(post=self.post, author=self.user, body='root')
+        child = Comment.objects.create(post=self.post, author=self.user, parent=root, body='child')
+        Comment.objects.create(post=self.post, author=self.user, parent=child, body='grandchild')
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['next_cursor'])
+        self.assertEqual(len(response.data['results']), 1)
+        node = response.data['results'][0]
+        self.assertEqual(node['author'], 'alice')
+        self.assertEqual(node['body'], 'root')
+        self.assertEqual(node['children'][0]['body'], 'child')
+        self.assertEqual(node['children'][0]['parent'], root.id)
+        self.assertEqual(node['children'][0]['children'][0]['body'], 'grandchild')
+        self.assertEqual(node['children'][0]['children'][0]['children'], [])
+        self.assertIsNone(node['more_replies'])
+
+    def test_query_count_does_not_grow_with_comments(self):
+        # Page, replies, the viewer's likes
+        self._make_thread(roots=2, depth=2)
+        with self.assertNumQueries(3):
+            self.client.get(self.url)
+
+        self._make_thread(roots=10, depth=6)
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data['results']), 12)
+
+    def test_cursor_pagination(self):
+        self._make_thread(roots=5, depth=1)
+
+        first = self.client.get(self.url, {'limit': 3})
+        second = self.client.get(self.url, {'limit': 3, 'cursor': first.data['next_cursor']})
+
+        self.assertEqual(len(first.data['results']), 3)
+        self.assertEqual(len(second.data['results']), 2)
+        self.assertIsNone(second.data['next_cursor'])
+        ids = [c['id'] for c in first.data['results'] + second.data['results']]
+        self.assertEqual(ids, sorted(ids))
+
+    def test_page_only_gets_its_own_replies(self):
+        roots = [Comment.objects.create(post=self.post, author=self.user, body=f'root {i}') for i in range(3)]
+        for root in roots:
+            Comment.objects.create(post=self.post, author=self.user, parent=root, body=f'reply to {root.body}')
+
+        response = self.client.get(self.url, {'limit': 2})
+
+        bodies = [[c['body'] for c in node['children']] for node in response.data['results']]
+        self.assertEqual(bodies, [['reply to root 0'], ['reply to root 1']])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_replies_per_node_returns_continuation_cursor(self):
+        root = Comment.objects.create(post=self.post, author=self.user, body='root')
+        for i in range(5):
+            Comment.objects.create(post=self.post, author=self.user, parent=root, body=f'reply {i}')
+
+        response = self.client.get(self.url, {'replies_per_node': 2})
+        node = response.data['results'][0]
+        self.assertEqual([c['body'] for c in node['children']], ['reply 0', 'reply 1'])
+        self.assertIsNotNone(node['more_replies'])
+
+        more_url = reverse('comment-replies', kwargs={'comment_id': root.id})
+        response = self.client.get(more_url, {'cursor': node['more_replies']})
+        self.assertEqual([c['body'] for c in response.data['results']], ['reply 2', 'reply 3', 'reply 4'])
+
+    def test_max_depth_returns_continuation_cursor(self):
+        self._make_thread(roots=1, depth=4)
+
+        response = self.client.get(self.url, {'max_depth': 1})
+
+        child = response.data['results'][0]['children'][0]
+        self.assertEqual(child['children'], [])
+        more_url = reverse('comment-replies', kwargs={'comment_id': child['id']})
+        response = self.client.get(more_url, {'cursor': child['more_replies']})
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class CommentPathTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.post = Post.objects.create(author=self.user, title='Hello', body='World')
+        self.client.force_authenticate(self.user)
+        self.root = Comment.objects.create(post=self.post, author=self.user, body='root')
+        self.child = Comment.objects.create(post=self.post, author=self.user, parent=self.root, body='child')
+        self.grandchild = Comment.objects.create(post=self.post, author=self.user, parent=self.child, body='grandchild')
+
+    def test_path_and_depth_set_on_create(self):
+        self.grandchild.refresh_from_db()
+        self.assertEqual(self.grandchild.depth, 2)
+        self.assertEqual(
+            self.grandchild.path,
+            f"{self.root.id:010d}/{self.child.id:010d}/{self.grandchild.id:010d}/",
+        )
+
+    def test_replies_endpoint_returns_subtree(self):
+        url = reverse('comment-replies', kwargs={'comment_id': self.root.id})
+
+        response = self.client.get(url)
+        self.assertEqual([c['body'] for c in response.data['results']], ['child'])
+        self.assertEqual(response.data['results'][0]['children'][0]['body'], 'grandchild')
+
+        response = self.client.get(url, {'max_depth': 0})
+        self.assertEqual(response.data['results'][0]['children'], [])
+
+    def test_moving_a_comment_moves_its_subtree(self):
+        other = Comment.objects.create(post=self.post, author=self.user, body='other')
+        url = reverse('comment-update-delete', kwargs={'comment_id': self.child.id})
+
+        response = self.client.put(url, {'parent': other.id}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.grandchild.refresh_from_db()
+        self.assertTrue(self.grandchild.path.startswith(other.path))
+        self.assertEqual(self.grandchild.depth, 2)
+
+    def test_cannot_move_comment_under_its_own_reply(self):
+        url = reverse('comment-update-delete', kwargs={'comment_id': self.root.id})
+        response = self.client.put(url, {'parent': self.grandchild.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_backfill_command(self):
+        Comment.objects.update(path='', depth=0)
+
+        call_command('backfill_comment_paths', stdout=StringIO())
+
+        self.grandchild.refresh_from_db()
+        self.assertEqual(self.grandchild.depth, 2)
+        self.assertTrue(self.grandchild.path.startswith(f"{self.root.id:010d}/"))
+
+
+class LikeCountTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.post = Post.objects.create(author=self.user, title='Hello', body='World')
+        self.comment = Comment.objects.create(post=self.post, author=self.user, body='hi')
+        self.client.force_authenticate(self.user)
+
+    def test_post_like_toggle_keeps_counter(self):
+        url = reverse('post-like', kwargs={'post_id': self.post.id})
+
+        response = self.client.post(url)
+        self.assertEqual(response.data, {'liked': True, 'count': 1})
+        response = self.client.post(url)
+        self.assertEqual(response.data, {'liked': False, 'count': 0})
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+
+    def test_comment_like_toggle_keeps_counter(self):
+        url = reverse('comment-like', kwargs={'comment_id': self.comment.id})
+
+        response = self.client.post(url)
+        self.assertEqual(response.data, {'liked': True, 'count': 1})
+
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.like_count, 1)
+
+    def test_failing_receiver_does_not_fail_the_toggle(self):
+        def broken(**kwargs):
+            raise ConnectionError("Redis is down")
+        like_toggled.connect(broken)
+        self.addCleanup(like_toggled.disconnect, broken)
+
+        with self.assertLogs('django.dispatch', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('post-like', kwargs={'post_id': self.post.id}))
+        self.assertEqual(response.data, {'liked': True, 'count': 1})
+
+    def test_reconcile_command_repairs_drift(self):
+        PostLike.objects.create(post=self.post, user=self.user)
+        Post.objects.filter(pk=self.post.pk).update(like_count=7)
+        Comment.objects.filter(pk=self.comment.pk).update(like_count=3)
+
+        call_command('reconcile_like_counts', stdout=StringIO())
+
+        self.post.refresh_from_db()
+        self.comment.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+        self.assertEqual(self.comment.like_count, 0)
+
+    def test_like_missing_post(self):
+        url = reverse('post-like', kwargs={'post_id': self.post.id + 100})
+
+        response = self.client.post(url)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(PostLike.objects.exists())
+
+
+class LikeToggleConcurrencyTests(TransactionTestCase):
+    THREADS = 8
+    TOGGLES = 15
+
+    def test_concurrent_toggles_keep_count_consistent(self):
+        author = User.objects.create_user(username='author', password='pass12345')
+        post = Post.objects.create(author=author, title='Hot', body='post')
+        # Two threads per user, so the same user double-taps concurrently
+        users = [User.objects.create_user(username=f'user{i}', password='pass12345') for i in range(self.THREADS // 2)]
+        errors = []
+        start = threading.Barrier(self.THREADS)
+
+        def hammer(user):
+            start.wait()
+            try:
+                for _ in range(self.TOGGLES):
+                    for attempt in range(100):
+                        try:
+                            toggle_like(PostLike, Post, post.id, user)
+                            break
+                        except OperationalError:
+                            time.sleep(0.001 * attempt)  # SQLite table lock, back off like a client would
+                    else:
+                        raise OperationalError("database stayed locked")
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=hammer, args=(users[i % len(users)],)) for i in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        post.refresh_from_db()
+        self.assertEqual(post.like_count, PostLike.objects.filter(post=post).count())
+
+
+@override_settings(LIKE_WRITE_BEHIND=True)
+class LikeBufferTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.other = User.objects.create_user(username='bob', password='pass12345')
+        self.post = Post.objects.create(author=self.user, title='Hello', body='World')
+        self.comment = Comment.objects.create(post=self.post, author=self.user, body='hi')
+        PostLike.objects.create(post=self.post, user=self.other)
+        Post.objects.filter(pk=self.post.pk).update(like_count=1)
+        self.client.force_authenticate(self.user)
+        self.url = reverse('post-like', kwargs={'post_id': self.post.id})
+
+    def test_comment_like_bumps_its_post_without_a_query(self):
+        url = reverse('comment-like', kwargs={'comment_id': self.comment.id})
+        comments_url = reverse('comment-list-create', kwargs={'post_id': self.post.id})
+        self.client.post(url)
+        etag = self.client.get(comments_url)['ETag']
+
+        with self.assertNumQueries(0), self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url)
+        self.assertNotEqual(self.client.get(comments_url)['ETag'], etag)
+
+    def test_toggle_is_served_from_redis_until_flush(self):
+        response = self.client.post(self.url)
+        self.assertEqual(response.data, {'liked': True, 'count': 2})
+        self.assertEqual(PostLike.objects.count(), 1)
+
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url)
+        self.assertEqual(response.data, {'liked': False, 'count': 1})
+        response = self.client.post(self.url)
+        self.assertEqual(response.data, {'liked': True, 'count': 2})
+
+        flush_like_buffer()
+
+        self.assertTrue(PostLike.objects.filter(post=self.post, user=self.user).exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 2)
+
+    def test_flush_applies_unlikes(self):
+        self.client.force_authenticate(self.other)
+        response = self.client.post(self.url)
+        self.assertEqual(response.data, {'liked': False, 'count': 0})
+        self.client.post(reverse('comment-like', kwargs={'comment_id': self.comment.id}))
+
+        flush_like_buffer()
+
+        self.assertFalse(PostLike.objects.exists())
+        self.assertEqual(CommentLike.objects.get().user, self.other)
+        self.post.refresh_from_db()
+        self.comment.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.comment.like_count), (0, 1))
+
+    def test_flush_updates_rollups_and_cached_totals(self):
+        today = days.today()
+        yesterday = today - timedelta(days=1)
+        like = CommentLike.objects.create(comment=self.comment, user=self.other)
+        CommentLike.objects.filter(pk=like.pk).update(created_at=days.day_window(yesterday)[0])
+        rollups.rebuild_day(today)
+        rollups.rebuild_day(yesterday)
+        self.assertEqual(karma_cache.get_user_totals(self.user, today)['daily'], 0)
+
+        self.client.post(self.url)
+        self.client.force_authenticate(self.other)
+        self.client.post(self.url)
+        self.client.post(reverse('comment-like', kwargs={'comment_id': self.comment.id}))
+        self.assertEqual(karma_cache.get_user_totals(self.user, today)['daily'], 0)
+
+        flush_like_buffer()
+
+        rows = {(row.user_id, row.bucket): (row.post_likes, row.comment_likes) for row in KarmaRollup.objects.all()}
+        self.assertEqual(rows, {
+            (self.user.id, today): (1, 0), (self.other.id, today): (0, 0), (self.other.id, yesterday): (0, 0),
+        })
+        self.assertEqual(karma_cache.get_user_totals(self.user, today)['daily'], 5)
+
+    def test_missing_post(self):
+        response = self.client.post(reverse('post-like', kwargs={'post_id': self.post.id + 100}))
+        self.assertEqual(response.status_code, 404)
+
+
+class LeaderboardTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='pass12345')
+        self.bob = User.objects.create_user(username='bob', password='pass12345')
+        self.post = Post.objects.create(author=self.alice, title='Hello', body='World')
+        self.comment = Comment.objects.create(post=self.post, author=self.alice, body='hi')
+        self.today = days.today()
+
+    def like(self, user, url_name, **kwargs):
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse(url_name, kwargs=kwargs))
+
+    def test_like_events_update_leaderboard(self):
+        self.like(self.alice, 'post-like', post_id=self.post.id)
+        self.like(self.bob, 'comment-like', comment_id=self.comment.id)
+        self.like(self.alice, 'comment-like', comment_id=self.comment.id)
+
+        top = leaderboard.top(self.today, 5)
+        self.assertEqual([(u['username'], u['daily_karma']) for u in top], [('alice', 6), ('bob', 1)])
+        self.assertEqual((top[0]['post_likes'], top[0]['comment_likes']), (1, 1))
+
+        self.like(self.alice, 'post-like', post_id=self.post.id)
+        top = leaderboard.top(self.today, 5)
+        self.assertCountEqual([(u['username'], u['daily_karma']) for u in top], [('alice', 1), ('bob', 1)])
+
+    def test_reconciliation_matches_incremental_board(self):
+        self.like(self.alice, 'post-like', post_id=self.post.id)
+        self.like(self.bob, 'comment-like', comment_id=self.comment.id)
+        incremental = leaderboard.top(self.today, 5)
+
+        cache.clear()
+        update_daily_karma_cache()
+
+        self.assertTrue(leaderboard.is_built(self.today))
+        self.assertEqual(leaderboard.top(self.today, 5), incremental)
+
+    def test_karma_view_reads_leaderboard(self):
+        self.like(self.bob, 'post-like', post_id=self.post.id)
+        update_daily_karma_cache()
+
+        self.client.force_authenticate(self.bob)
+        response = self.client.get(reverse('user-karma'))
+
+        self.assertEqual(response.data['top_users'][0]['username'], 'bob')
+        self.assertEqual(response.data['current_user']['daily_karma'], 5)
+        self.assertEqual(response.data['current_user']['rank'], 1)
+        self.assertEqual(response.data['cache_age'], 0)
+
+    def test_rank_for_any_user_with_neighbors(self):
+        users = [User.objects.create_user(username=f'user{i}', password='pass12345') for i in range(8)]
+        for karma, user in enumerate(users, start=1):
+            for _ in range(karma):
+                leaderboard.record_like(CommentLike, user=user, liked=True, karma_day=self.today)
+
+        self.client.force_authenticate(users[1])
+        with self.assertNumQueries(3):  # rollup totals, usernames of the top users and of the neighbors
+            response = self.client.get(reverse('user-karma'), {'around': 1})
+
+        current = response.data['current_user']
+        self.assertEqual((current['rank'], current['daily_karma']), (7, 2))
+        self.assertEqual([n['username'] for n in current['neighbors']], ['user2', 'user1', 'user0'])
+        self.assertEqual([n['rank'] for n in current['neighbors']], [6, 7, 8])
+
+    def test_rank_without_karma(self):
+        standing = leaderboard.standing(self.today, self.alice.id, around=2)
+        self.assertEqual((standing['rank'], standing['daily_karma'], standing['neighbors']), (None, 0, []))
+
+
+class KarmaRollupTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='pass12345')
+        self.post = Post.objects.create(author=self.alice, title='Hello', body='World')
+        self.comment = Comment.objects.create(post=self.post, author=self.alice, body='hi')
+        self.today = days.today()
+        self.client.force_authenticate(self.alice)
+
+    def toggle(self, url_name, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse(url_name, kwargs=kwargs))
+
+    def test_like_events_maintain_rollup(self):
+        self.toggle('post-like', post_id=self.post.id)
+        self.toggle('comment-like', comment_id=self.comment.id)
+
+        rollup = KarmaRollup.objects.get(user=self.alice, bucket=self.today)
+        self.assertEqual((rollup.post_likes, rollup.comment_likes, rollup.karma), (1, 1, 6))
+
+        self.toggle('post-like', post_id=self.post.id)
+        rollup.refresh_from_db()
+        self.assertEqual((rollup.post_likes, rollup.karma), (0, 1))
+
+    def test_unlike_takes_karma_back_from_the_day_of_the_like(self):
+        yesterday = self.today - timedelta(days=1)
+        like = PostLike.objects.create(post=self.post, user=self.alice)
+        PostLike.objects.filter(pk=like.pk).update(created_at=days.day_window(yesterday)[0])
+        Post.objects.filter(pk=self.post.pk).update(like_count=1)
+        rollup_karma(yesterday.isoformat())
+
+        self.toggle('post-like', post_id=self.post.id)
+
+        self.assertEqual(KarmaRollup.objects.get(user=self.alice, bucket=yesterday).post_likes, 0)
+        self.assertFalse(KarmaRollup.objects.filter(bucket=self.today).exists())
+        totals = rollups.karma_totals(self.alice, self.today)
+        self.assertEqual((totals['weekly'], totals['monthly']), (0, 0))
+
+    def test_rollup_task_rebuilds_day(self):
+        PostLike.objects.create(post=self.post, user=self.alice)
+        KarmaRollup.objects.create(user=self.alice, bucket=self.today, post_likes=9)
+
+        rollup_karma(self.today.isoformat())
+
+        rollup = KarmaRollup.objects.get(user=self.alice, bucket=self.today)
+        self.assertEqual((rollup.post_likes, rollup.comment_likes), (1, 0))
+
+    def test_karma_view_reports_weekly_and_monthly(self):
+        KarmaRollup.objects.create(user=self.alice, bucket=self.today, post_likes=1)
+        KarmaRollup.objects.create(user=self.alice, bucket=self.today - timedelta(days=40), post_likes=100)
+        earlier = self.today - timedelta(days=1)
+        if earlier.isocalendar()[1] == self.today.isocalendar()[1] and earlier.month == self.today.month:
+            KarmaRollup.objects.create(user=self.alice, bucket=earlier, comment_likes=2)
+            expected = 7
+        else:
+            expected = 5
+
+        response = self.client.get(reverse('user-karma'))
+
+        self.assertEqual(response.data['current_user']['weekly_karma'], expected)
+        self.assertEqual(response.data['current_user']['monthly_karma'], expected)
+
+
+class KarmaLeaderboardTaskTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.today = days.today()
+        self.users = [User.objects.create_user(username=f'user{i}', password='pass12345') for i in range(6)]
+        for karma, user in enumerate(self.users, start=1):
+            KarmaRollup.objects.create(user=user, bucket=self.today - timedelta(days=400), comment_likes=10 * karma)
+        post = Post.objects.create(author=self.users[0], title='Hello', body='World')
+        for user in self.users[:3]:
+            PostLike.objects.create(post=post, user=user)
+
+    def test_boards_are_built_in_one_pass(self):
+        with override_settings(KARMA_LEADERBOARD_SIZE=2):
+            update_daily_karma_cache()
+        boards, _ = karma_cache.get_boards()
+
+        self.assertEqual([e['username'] for e in boards['daily']], ['user0', 'user1'])
+        self.assertEqual(boards['daily'][0]['karma'], 5)
+        self.assertEqual([e['username'] for e in boards['all_time']], ['user5', 'user4'])
+        self.assertEqual(boards['all_time'][1]['karma'], 50)
+
+    def test_query_count_does_not_depend_on_board_size(self):
+        with override_settings(KARMA_LEADERBOARD_SIZE=1), CaptureQueriesContext(connection) as small:
+            update_daily_karma_cache()
+        with override_settings(KARMA_LEADERBOARD_SIZE=1000), CaptureQueriesContext(connection) as large:
+            update_daily_karma_cache()
+
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(len(karma_cache.get_boards()[0]['all_time']), 6)
+
+
+class DayWindowTests(APITestCase):
+    def test_window_is_local_midnight_in_utc(self):
+        # Asia/Kolkata is UTC+05:30
+        start, end = days.day_window(date(2026, 1, 15))
+        self.assertEqual(start, datetime(2026, 1, 14, 18, 30, tzinfo=dt_timezone.utc))
+        self.assertEqual(end, datetime(2026, 1, 15, 18, 30, tzinfo=dt_timezone.utc))
+
+    @override_settings(TIME_ZONE='America/New_York')
+    def test_dst_days(self):
+        start, end = days.day_window(date(2026, 3, 8))  # clocks go forward
+        self.assertEqual(end - start, timedelta(hours=23))
+        start, end = days.day_window(date(2026, 11, 1))  # clocks go back
+        self.assertEqual(end - start, timedelta(hours=25))
+        self.assertEqual(start, datetime(2026, 11, 1, 4, tzinfo=dt_timezone.utc))
+
+    @override_settings(TIME_ZONE='America/Santiago')
+    def test_dst_change_at_midnight(self):
+        # 2026-09-06 00:00 does not exist in Santiago, the day starts at 01:00 local (04:00 UTC)
+        start, end = days.day_window(date(2026, 9, 6))
+        self.assertEqual(start, datetime(2026, 9, 6, 4, tzinfo=dt_timezone.utc))
+        self.assertEqual(end - start, timedelta(hours=23))
+
+    def test_rollup_counts_likes_by_local_day(self):
+        user = User.objects.create_user(username='alice', password='pass12345')
+        posts = [Post.objects.create(author=user, title=f'Post {i}', body='text') for i in range(3)]
+        day = date(2026, 1, 15)
+        start, end = days.day_window(day)
+        for post, created_at in zip(posts, [start - timedelta(seconds=1), start, end - timedelta(seconds=1)]):
+            like = PostLike.objects.create(post=post, user=user)
+            PostLike.objects.filter(pk=like.pk).update(created_at=created_at)
+        PostLike.objects.create(post=Post.objects.create(author=user, title='Late', body='text'), user=user)
+        PostLike.objects.filter(post__title='Late').update(created_at=end)
+
+        rollup_karma(day.isoformat())
+
+        self.assertEqual(KarmaRollup.objects.get(user=user, bucket=day).post_likes, 2)
+
+
+@mock.patch.object(update_daily_karma_cache, 'apply_async')
+@mock.patch.object(refresh_karma_boards, 'apply_async')
+class KarmaCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.client.force_authenticate(self.user)
+
+    def test_missing_boards_enqueue_a_single_refresh(self, apply_async, reconcile):
+        for _ in range(5):
+            response = self.client.get(reverse('user-karma'))
+
+        self.assertEqual(apply_async.call_count, 1)
+        # Redis lost the day too: rebuilt once
+        self.assertEqual(reconcile.call_count, 1)
+        self.assertIsNone(response.data['cache_age'])
+
+    def test_stale_boards_are_served_while_refreshing(self, apply_async, reconcile):
+        karma_cache.store({'weekly': [{'user_id': self.user.id, 'username': 'alice', 'karma': 3}]})
+        entry = cache.get(karma_cache.CACHE_KEY)
+        entry['computed_at'] -= 1000
+        cache.set(karma_cache.CACHE_KEY, entry)
+        leaderboard.rebuild(days.today(), {})
+
+        response = self.client.get(reverse('user-karma'))
+        self.client.get(reverse('user-karma'))
+
+        self.assertEqual(response.data['weekly_top_users'][0]['username'], 'alice')
+        self.assertGreaterEqual(response.data['cache_age'], 1000)
+        self.assertEqual(apply_async.call_count, 1)
+        reconcile.assert_not_called()
+
+    def test_manual_refresh_joins_the_one_in_flight(self, apply_async, reconcile):
+        first = self.client.post(reverse('update-karma-cache'))
+        second = self.client.post(reverse('update-karma-cache'))
+
+        self.assertEqual(reconcile.call_count, 1)
+        self.assertEqual(first.data['status'], 'queued')
+        self.assertEqual(second.data['status'], 'in_progress')
+        self.assertEqual(second.data['task_id'], first.data['task_id'])
+
+    def test_finished_refresh_releases_the_lock(self, apply_async, reconcile):
+        task_id, _ = karma_cache.request_refresh()
+        refresh_karma_boards.apply(task_id=task_id)
+        _, enqueued = karma_cache.request_refresh()
+        self.assertTrue(enqueued)
+
+        task_id, _ = karma_cache.request_refresh(reconcile=True)
+        update_daily_karma_cache.apply(task_id=task_id)
+        _, enqueued = karma_cache.request_refresh(reconcile=True)
+        self.assertTrue(enqueued)
+
+    def test_boards_refresh_keeps_the_live_leaderboard(self, apply_async, reconcile):
+        # A like the live leaderboard has and the like tables not (yet)
+        leaderboard.rebuild(days.today(), {self.user.id: {'post_likes': 1, 'comment_likes': 0, 'total': 5}})
+
+        refresh_karma_boards()
+
+        self.assertEqual([entry['username'] for entry in leaderboard.top(days.today(), 5)], ['alice'])
+        self.assertIsNotNone(cache.get(karma_cache.CACHE_KEY))
+
+
+class UserKarmaCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.post = Post.objects.create(author=self.user, title='Hello', body='World')
+        self.today = days.today()
+
+    def test_totals_are_cached_until_a_like_toggle(self):
+        with self.assertNumQueries(1):
+            karma_cache.get_user_totals(self.user, self.today)
+        with self.assertNumQueries(0):
+            totals = karma_cache.get_user_totals(self.user, self.today)
+        self.assertEqual(totals['weekly'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            toggle_like(PostLike, Post, self.post.id, self.user)
+
+        totals = karma_cache.get_user_totals(self.user, self.today)
+        self.assertEqual((totals['daily'], totals['weekly']), (5, 5))
+        self.assertEqual(karma_cache.user_totals_stats(), {'hits': 1, 'misses': 2, 'hit_rate': 0.3333})
+
+    def test_stats_endpoint_is_staff_only(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(reverse('karma-cache-stats')).status_code, 403)
+
+        self.user.is_staff = True
+        response = self.client.get(reverse('karma-cache-stats'))
+        self.assertEqual(response.data['hits'], 0)
+
+
+# Run the feed tasks inline
+@mock.patch.object(backfill_timeline, 'delay', lambda *args: backfill_timeline(*args))
+@mock.patch.object(fan_out_post, 'delay', lambda *args: fan_out_post(*args))
+class FeedTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='pass12345')
+        self.bob = User.objects.create_user(username='bob', password='pass12345')
+        self.carol = User.objects.create_user(username='carol', password='pass12345')
+        self.url = reverse('post-feed')
+
+    def post(self, author, title):
+        self.client.force_authenticate(author)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('post-list-create'), {'title': title, 'body': 'text'}, format='json')
+        return Post.objects.get(title=title)
+
+    def follow(self, follower, followee):
+        self.client.force_authenticate(follower)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('account:follow-toggle', kwargs={'user_id': followee.id}))
+
+    def feed_titles(self, user, **params):
+        self.client.force_authenticate(user)
+        return [p['title'] for p in self.client.get(self.url, params).data['results']]
+
+    def test_new_posts_are_fanned_out_to_followers(self):
+        self.follow(self.alice, self.bob)
+        self.post(self.bob, 'bob 1')
+        self.post(self.carol, 'carol 1')
+        self.post(self.alice, 'alice 1')
+        self.post(self.bob, 'bob 2')
+
+        self.assertEqual(self.feed_titles(self.alice), ['bob 2', 'alice 1', 'bob 1'])
+        self.assertEqual(self.feed_titles(self.carol), ['carol 1'])
+
+    def test_cursor_pagination(self):
+        self.follow(self.alice, self.bob)
+        for i in range(5):
+            self.post(self.bob, f'bob {i}')
+
+        self.client.force_authenticate(self.alice)
+        first = self.client.get(self.url, {'limit': 2})
+        second = self.client.get(self.url, {'limit': 2, 'cursor': first.data['next_cursor']})
+        third = self.client.get(self.url, {'limit': 2, 'cursor': second.data['next_cursor']})
+
+        titles = [p['title'] for page in (first, second, third) for p in page.data['results']]
+        self.assertEqual(titles, ['bob 4', 'bob 3', 'bob 2', 'bob 1', 'bob 0'])
+        self.assertIsNone(third.data['next_cursor'])
+        self.assertEqual(self.client.get(self.url, {'cursor': 'nope'}).status_code, 400)
+
+    def test_page_is_hydrated_in_one_query(self):
+        self.follow(self.alice, self.bob)
+        for i in range(30):
+            self.post(self.bob, f'bob {i}')
+
+        self.client.force_authenticate(self.alice)
+        # followees + in_bulk
+        with self.assertNumQueries(2):
+            posts, _ = feed.page(self.alice, None, 20)
+        self.assertEqual(len(posts), 20)
+
+    def test_follow_backfills_and_unfollow_hides(self):
+        self.post(self.bob, 'bob 1')
+        self.assertEqual(self.feed_titles(self.alice), [])
+
+        self.assertEqual(self.follow(self.alice, self.bob).data, {'following': True})
+        self.assertEqual(self.feed_titles(self.alice), ['bob 1'])
+
+        self.assertEqual(self.follow(self.alice, self.bob).data, {'following': False})
+        self.assertEqual(self.feed_titles(self.alice), [])
+        self.assertEqual(self.follow(self.alice, self.alice).status_code, 400)
+
+    @override_settings(FEED_CELEBRITY_THRESHOLD=2)
+    def test_celebrity_posts_are_pulled_on_read(self):
+        self.follow(self.alice, self.bob)
+        self.follow(self.carol, self.bob)
+        self.post(self.carol, 'carol 1')
+        self.post(self.bob, 'bob 1')
+
+        # Not pushed to the followers' timelines
+        redis = get_redis_connection('default')
+        self.assertEqual(redis.lrange(feed._timeline_key(self.alice.id), 0, -1), [])
+        self.assertTrue(redis.sismember(feed.CELEBRITIES_KEY, self.bob.id))
+
+        self.assertEqual(self.feed_titles(self.alice), ['bob 1'])
+        self.assertEqual(self.feed_titles(self.carol), ['bob 1', 'carol 1'])
+
+
+class TrendingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='pass12345')
+        self.bob = User.objects.create_user(username='bob', password='pass12345')
+        self.url = reverse('post-trending')
+
+    def test_hot_score_trades_activity_for_age(self):
+        now = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        newer = now + timedelta(seconds=45000)
+        self.assertAlmostEqual(trending.hot_score(100, 0, now), trending.hot_score(10, 0, newer))
+        self.assertAlmostEqual(trending.hot_score(0, 5, now), trending.hot_score(10, 0, now))
+        self.assertEqual(trending.hot_score(0, 0, now), trending.hot_score(1, 0, now))
+
+    def test_scores_follow_likes_and_comments(self):
+        quiet = Post.objects.create(author=self.alice, title='quiet', body='text')
+        busy = Post.objects.create(author=self.alice, title='busy', body='text')
+        self.assertEqual(update_trending_scores(), 'Trending scores updated for 2 posts')
+
+        self.client.force_authenticate(self.bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('post-like', kwargs={'post_id': quiet.id}))
+        Comment.objects.create(post=quiet, author=self.bob, body='hi')
+        update_trending_scores()
+        self.assertEqual([p['title'] for p in self.client.get(self.url).data['results']], ['quiet', 'busy'])
+
+        # An unlike and a deleted comment leave no row behind, the dirty set catches them
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('post-like', kwargs={'post_id': quiet.id}))
+        Comment.objects.filter(post=quiet).delete()
+        self.assertEqual(trending.update_scores(since=timezone.now()), 1)
+        self.assertEqual([p['title'] for p in self.client.get(self.url).data['results']], ['busy', 'quiet'])
+
+        busy.delete()
+        self.assertEqual([p['title'] for p in self.client.get(self.url).data['results']], ['quiet'])
+
+    def test_cursor_pagination_handles_equal_scores(self):
+        redis = get_redis_connection('default')
+        posts = [Post.objects.create(author=self.alice, title=f'Post {i}', body='text') for i in range(12)]
+        # Same score for all but the first post
+        redis.zadd(trending.HOT_KEY, {post.id: 1.5 for post in posts[1:]})
+        redis.zadd(trending.HOT_KEY, {posts[0].id: 2.0})
+
+        self.client.force_authenticate(self.bob)
+        ids, cursor = [], None
+        while True:
+            params = {'limit': 5, 'cursor': cursor} if cursor else {'limit': 5}
+            response = self.client.get(self.url, params)
+            ids += [p['id'] for p in response.data['results']]
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                break
+
+        self.assertEqual(ids[0], posts[0].id)
+        self.assertCountEqual(ids, [post.id for post in posts])
+        self.assertEqual(self.client.get(self.url, {'cursor': 'nope'}).status_code, 400)
+
+    def test_page_reads_the_sorted_set_and_one_query(self):
+        for i in range(30):
+            Post.objects.create(author=self.alice, title=f'Post {i}', body='text')
+        update_trending_scores()
+
+        with self.assertNumQueries(1):
+            posts, position = trending.page(None, 20)
+        self.assertEqual(len(posts), 20)
+        self.assertIsNotNone(position)
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='pass12345')
+        self.client.force_authenticate(self.alice)
+        self.url = reverse('search')
+
+    @contextlib.contextmanager
+    def writes(self):
+        # The disk index is written by a task once the transaction commits
+        if settings.SEARCH_BACKEND != 'disk':
+            yield
+            return
+        with mock.patch.object(update_search_index, 'delay', side_effect=update_search_index), \
+                self.captureOnCommitCallbacks(execute=True):
+            yield
+
+    def create_content(self):
+        with self.writes():
+            self.create_posts()
+
+    def create_posts(self):
+        self.redis_post = Post.objects.create(author=self.alice, title='Redis sorted sets', body='Leaderboards in memory')
+        self.django_post = Post.objects.create(author=self.alice, title='Django tips', body='The ORM and redis caching')
+        self.comment = Comment.objects.create(post=self.django_post, author=self.alice, body='What about redis streams?')
+
+    def hits(self, **params):
+        response = self.client.get(self.url, params)
+        return [(hit['type'], hit['object']['id']) for hit in response.data['results']]
+
+    def check_search(self):
+        self.assertEqual(self.hits(q='redis')[0], ('post', self.redis_post.id))
+        self.assertCountEqual(self.hits(q='redis'), [
+            ('post', self.redis_post.id), ('post', self.django_post.id), ('comment', self.comment.id),
+        ])
+        self.assertEqual(self.hits(q='redis streams'), [('comment', self.comment.id)])
+        self.assertEqual(self.hits(q='redis', type='comment'), [('comment', self.comment.id)])
+        self.assertEqual(self.hits(q='"unbalanced OR'), [])
+
+        # Kept up to date on update and delete
+        with self.writes():
+            self.django_post.title = 'Django and Celery'
+            self.django_post.body = 'Background jobs'
+            self.django_post.save()
+            self.comment.delete()
+        self.assertEqual(self.hits(q='redis'), [('post', self.redis_post.id)])
+        self.assertEqual(self.hits(q='celery'), [('post', self.django_post.id)])
+
+    def test_fts5_index(self):
+        self.create_content()
+        self.check_search()
+
+    def test_disk_index(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                self.settings(SEARCH_BACKEND='disk', SEARCH_INDEX_DIR=directory):
+            self.create_content()
+            self.check_search()
+
+            # Rolled back rows are never indexed
+            with self.writes(), transaction.atomic():
+                Post.objects.create(author=self.alice, title='Rolled back', body='redis')
+                transaction.set_rollback(True)
+            self.assertEqual(self.hits(q='rolled'), [])
+
+            # Documents sharing terms come and go without disturbing each other
+            with self.writes():
+                posts = [Post.objects.create(author=self.alice, title=f'Redis {i}', body='shared') for i in range(4)]
+            with self.writes():
+                posts[0].delete()
+                posts[2].delete()
+            self.assertCountEqual(self.hits(q='shared redis'), [('post', posts[1].id), ('post', posts[3].id)])
+
+    def test_pagination(self):
+        posts = [Post.objects.create(author=self.alice, title=f'Search {i}', body='needle') for i in range(5)]
+
+        first = self.client.get(self.url, {'q': 'needle', 'limit': 3})
+        rest = self.client.get(self.url, {'q': 'needle', 'limit': 3, 'cursor': first.data['next_cursor']})
+        ids = [hit['object']['id'] for hit in first.data['results'] + rest.data['results']]
+        self.assertCountEqual(ids, [post.id for post in posts])
+        self.assertIsNone(rest.data['next_cursor'])
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+
+    def test_rebuild_command(self):
+        with mock.patch.object(search.Fts5Index, 'add'):
+            self.create_content()
+        self.assertEqual(self.hits(q='redis'), [])
+
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 3 posts and comments', out.getvalue())
+        self.assertEqual(len(self.hits(q='redis')), 3)
+
+
+@mock.patch.object(fan_out_posts, 'delay')
+class BulkIngestTests(APITestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='pass12345')
+        self.client.force_authenticate(self.alice)
+        self.post = Post.objects.create(author=self.alice, title='Hello', body='World')
+        self.existing = Comment.objects.create(post=self.post, author=self.alice, body='top')
+
+    def test_posts_are_created_in_chunks_with_per_item_errors(self, fan_out):
+        items = [{'title': f'Post {i}', 'body': 'text'} for i in range(1200)]
+        items[3] = {'title': '', 'body': 'text'}
+        items[700] = {'body': 'no title'}
+
+        with self.settings(BULK_CHUNK_SIZE=500), self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse('post-bulk'), items, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['created']), 1198)
+        self.assertEqual([error['index'] for error in response.data['errors']], [3, 700])
+        self.assertIn('title', response.data['errors'][1]['errors'])
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "community_post"')]
+        # SQLite's variable limit may split a chunk further, still far from one INSERT per post
+        self.assertLess(len(inserts), 10)
+        created = response.data['created'][0]
+        self.assertEqual(Post.objects.get(id=created['id']).title, 'Post 0')
+        fan_out.assert_called_once()
+
+    def test_malformed_batches_are_rejected(self, fan_out):
+        self.assertEqual(self.client.post(reverse('post-bulk'), {'title': 'x'}, format='json').status_code, 400)
+        with self.settings(BULK_MAX_ITEMS=2):
+            items = [{'title': 'x', 'body': 'y'}] * 3
+            self.assertEqual(self.client.post(reverse('post-bulk'), items, format='json').status_code, 400)
+        self.assertEqual(Post.objects.count(), 1)
+
+    def test_comments_can_reply_within_the_batch(self, fan_out):
+        other_post = Post.objects.create(author=self.alice, title='Other', body='post')
+        items = [
+            {'post': self.post.id, 'body': 'root', 'ref': 'a'},
+            {'post': self.post.id, 'body': 'reply', 'parent_ref': 'a', 'ref': 'b'},
+            {'post': self.post.id, 'body': 'reply of reply', 'parent_ref': 'b'},
+            {'post': self.post.id, 'body': 'under existing', 'parent': self.existing.id},
+            {'post': self.post.id, 'body': 'forward ref', 'parent_ref': 'later'},
+            {'post': 999999, 'body': 'no post', 'ref': 'broken'},
+            {'post': self.post.id, 'body': 'child of failed', 'parent_ref': 'broken'},
+            {'post': other_post.id, 'body': 'wrong post', 'parent_ref': 'a'},
+            {'post': self.post.id, 'body': '', 'ref': 'later'},
+        ]
+        response = self.client.post(reverse('comment-bulk'), items, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([error['index'] for error in response.data['errors']], [4, 5, 6, 7, 8])
+        ids = {item['index']: item['id'] for item in response.data['created']}
+        root, reply, deep, under = (Comment.objects.get(id=ids[i]) for i in range(4))
+        self.assertEqual(reply.parent_id, root.id)
+        self.assertEqual(deep.parent_id, reply.id)
+        self.assertEqual(deep.path, root.path + comment_path_segment(reply.id) + comment_path_segment(deep.id))
+        self.assertEqual(deep.depth, 2)
+        self.assertEqual(under.path, self.existing.path + comment_path_segment(under.id))
+        self.assertEqual(under.depth, 1)
+        self.assertEqual(self.client.get(reverse('search'), {'q': 'reply'}).data['results'][0]['type'], 'comment')
+
+    def test_import_commands(self, fan_out):
+        with tempfile.TemporaryDirectory() as directory:
+            posts_file = f'{directory}/posts.jsonl'
+            with open(posts_file, 'w') as f:
+                f.write('{"title": "Imported", "body": "text"}\nnot json\n')
+            out, err = StringIO(), StringIO()
+            call_command('import_posts', posts_file, author='alice', stdout=out, stderr=err)
+            self.assertIn('Created 1, failed 1', out.getvalue())
+            self.assertIn('line 2:', err.getvalue())
+
+            comments_file = f'{directory}/comments.jsonl'
+            with open(comments_file, 'w') as f:
+                f.write(f'{{"post": {self.post.id}, "body": "root", "ref": "r"}}\n')
+                f.write(f'{{"post": {self.post.id}, "body": "reply", "parent_ref": "r"}}\n')
+            out = StringIO()
+            # Batches of one: the ref is carried over to the next batch
+            call_command('import_comments', comments_file, author='alice', batch_size=1, stdout=out)
+            self.assertIn('Created 2, failed 0', out.getvalue())
+
+        reply = Comment.objects.get(body='reply')
+        self.assertEqual(reply.parent.body, 'root')
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='pass12345')
+        self.bob = User.objects.create_user(username='bob', password='pass12345')
+        self.post = Post.objects.create(author=self.alice, title='Hello', body='World')
+        self.comment = Comment.objects.create(post=self.post, author=self.bob, body='hi')
+        PostLike.objects.create(post=self.post, user=self.bob)
+        CommentLike.objects.create(comment=self.comment, user=self.alice)
+        self.url = reverse('export')
+
+    def export(self, user, **params):
+        self.client.force_authenticate(user)
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_users_export_their_own_data(self):
+        records = self.export(self.bob)
+        self.assertEqual([(r['type'], r['id']) for r in records], [
+            ('comment', self.comment.id), ('post_like', PostLike.objects.get().id),
+        ])
+        self.client.force_authenticate(self.bob)
+        self.assertEqual(self.client.get(self.url, {'author': self.alice.id}).status_code, 403)
+        self.assertEqual(self.client.get(self.url, {'type': 'users'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'since': 'yesterday'}).status_code, 400)
+
+    def test_staff_filters(self):
+        self.alice.is_staff = True
+        self.alice.save()
+        other = Post.objects.create(author=self.bob, title='Other', body='post')
+
+        self.assertEqual(len(self.export(self.alice)), 5)
+        by_post = self.export(self.alice, post=self.post.id)
+        self.assertEqual({r['type'] for r in by_post}, {'post', 'comment', 'post_like', 'comment_like'})
+        self.assertNotIn(other.id, [r['id'] for r in by_post if r['type'] == 'post'])
+        self.assertEqual(len(self.export(self.alice, type='post', author=self.bob.id)), 1)
+
+        today = days.today()
+        self.assertEqual(len(self.export(self.alice, type='post', since=today.isoformat(), until=today.isoformat())), 2)
+        tomorrow = (today + timedelta(days=1)).isoformat()
+        self.assertEqual(self.export(self.alice, since=tomorrow), [])
+
+    def test_command_writes_a_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/export.ndjson'
+            err = StringIO()
+            call_command('export_ndjson', type=['comment', 'comment_like'], author='alice', output=path, stderr=err)
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+        self.assertEqual([r['type'] for r in records], ['comment_like'])
+        self.assertIn('Exported 1 objects', err.getvalue())
+
+    def test_memory_stays_flat(self):
+        body = 'x' * 1000
+        Post.objects.bulk_create(
+            [Post(author=self.alice, title=f'Post {i}', body=body) for i in range(20000)], batch_size=1000
+        )
+
+        tracemalloc.start()
+        try:
+            exported = sum(len(line) for line in export.ndjson_lines(['post'], chunk_size=500))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        # ~20 MB exported, a few chunks of rows held at a time
+        self.assertGreater(exported, 20 * 1024 * 1024)
+        self.assertLess(peak, 4 * 1024 * 1024)
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='pass12345')
+        self.post = Post.objects.create(author=self.alice, title='Hello', body='World')
+        self.comment = Comment.objects.create(post=self.post, author=self.alice, body='hi')
+        self.client.force_authenticate(self.alice)
+        self.url = reverse('comment-list-create', kwargs={'post_id': self.post.id})
+
+    def assertNotModified(self, url, etag):
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def assertModified(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response['ETag']
+
+    def test_comments_etag_follows_comment_and_like_writes(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        self.assertNotModified(self.url, etag)
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, {'body': 'new'}, format='json')
+        etag = self.assertModified(self.url, etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('comment-like', kwargs={'comment_id': self.comment.id}))
+        etag = self.assertModified(self.url, etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('comment-update-delete', kwargs={'comment_id': self.comment.id}))
+        etag = self.assertModified(self.url, etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('comment-bulk'), [{'post': self.post.id, 'body': 'bulk'}], format='json')
+        self.assertModified(self.url, etag)
+
+    def test_bumps_within_a_second_change_the_etag_not_the_date(self):
+        now = timezone.now().replace(microsecond=500000)
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            response = self.client.get(self.url)
+            # Within the same second
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(self.url, {'body': 'new'}, format='json')
+            etag = self.assertModified(self.url, response['ETag'])
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(self.url, {'body': 'newer'}, format='json')
+            self.assertModified(self.url, etag)
+            # Never ahead of the clock
+            self.assertEqual(self.client.get(self.url)['Last-Modified'], response['Last-Modified'])
+
+    def test_other_posts_keep_their_etag(self):
+        other = Post.objects.create(author=self.alice, title='Other', body='post')
+        other_url = reverse('comment-list-create', kwargs={'post_id': other.id})
+        etag = self.client.get(other_url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, {'body': 'new'}, format='json')
+        self.assertNotModified(other_url, etag)
+
+    @mock.patch.object(update_daily_karma_cache, 'apply_async')
+    @mock.patch.object(refresh_karma_boards, 'apply_async')
+    def test_karma_etag_follows_likes(self, apply_async, reconcile):
+        url = reverse('user-karma')
+        etag = self.client.get(url)['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('post-like', kwargs={'post_id': self.post.id}))
+        etag = self.assertModified(url, etag)
+
+        # Someone else's etag is not ours
+        bob = User.objects.create_user(username='bob', password='pass12345')
+        self.client.force_authenticate(bob)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @override_settings(KARMA_LEADERBOARD_SIZE=1)
+    @mock.patch.object(update_daily_karma_cache, 'apply_async')
+    @mock.patch.object(refresh_karma_boards, 'apply_async')
+    def test_karma_etag_ignores_likes_out_of_view(self, apply_async, reconcile):
+        url = reverse('user-karma')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('post-like', kwargs={'post_id': self.post.id}))
+        etag = self.client.get(url, {'around': 0})['ETag']
+
+        # Below the top 1 and not next to alice
+        bob = User.objects.create_user(username='bob', password='pass12345')
+        self.client.force_authenticate(bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('comment-like', kwargs={'comment_id': self.comment.id}))
+        self.client.force_authenticate(self.alice)
+        self.assertEqual(self.client.get(url, {'around': 0}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Weekly / all-time boards
+        with self.captureOnCommitCallbacks(execute=True):
+            karma_cache.store({'weekly': [], 'all_time': []})
+        self.assertEqual(self.client.get(url, {'around': 0}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class LikedByMeTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='pass12345')
+        self.bob = User.objects.create_user(username='bob', password='pass12345')
+        self.client.force_authenticate(self.alice)
+
+    def make_posts(self, n):
+        posts = Post.objects.bulk_create([Post(author=self.alice, title=f'Post {i}', body='text') for i in range(n)])
+        # Every other post liked by alice, all by bob
+        PostLike.objects.bulk_create(
+            [PostLike(post=post, user=self.alice) for post in posts[::2]] + [PostLike(post=post, user=self.bob) for post in posts]
+        )
+        for post in posts:
+            post.like_count = 2 if post in posts[::2] else 1
+        Post.objects.bulk_update(posts, ['like_count'])
+        return posts
+
+    def make_comments(self, n):
+        post = Post.objects.create(author=self.alice, title='Thread', body='text')
+        roots = Comment.objects.bulk_create(
+            [Comment(post=post, author=self.bob, body=f'root {i}', path=comment_path_segment(i + 1)) for i in range(n)]
+        )
+        for root in roots:
+            root.path = comment_path_segment(root.id)
+        Comment.objects.bulk_update(roots, ['path'])
+        reply = Comment.objects.create(post=post, author=self.bob, parent=roots[0], body='reply')
+        CommentLike.objects.bulk_create([CommentLike(comment=c, user=self.alice) for c in roots[1::2] + [reply]])
+        return post, roots, reply
+
+    @override_settings(POST_MAX_PAGE_SIZE=1000)
+    def test_posts_page_uses_one_lookup(self):
+        for n in (1, 100, 1000):
+            with self.subTest(n=n):
+                Post.objects.all().delete()
+                posts = self.make_posts(n)
+                # Posts, the viewer's likes
+                with self.assertNumQueries(2):
+                    response = self.client.get(reverse('post-list-create'), {'limit': n})
+
+                results = {p['id']: p for p in response.data['results']}
+                self.assertEqual(len(results), n)
+                for i, post in enumerate(posts):
+                    self.assertEqual(results[post.id]['liked_by_me'], i % 2 == 0)
+                    self.assertEqual(results[post.id]['like_count'], 2 if i % 2 == 0 else 1)
+
+    @override_settings(COMMENT_MAX_PAGE_SIZE=1000)
+    def test_comment_tree_uses_one_lookup(self):
+        for n in (1, 100, 1000):
+            with self.subTest(n=n):
+                Post.objects.all().delete()
+                post, roots, reply = self.make_comments(n)
+                url = reverse('comment-list-create', kwargs={'post_id': post.id})
+                # Page, replies, the viewer's likes
+                with self.assertNumQueries(3):
+                    response = self.client.get(url, {'limit': n})
+
+                nodes = response.data['results']
+                self.assertEqual(len(nodes), n)
+                self.assertEqual([node['liked_by_me'] for node in nodes], [i % 2 == 1 for i in range(n)])
+                self.assertTrue(nodes[0]['children'][0]['liked_by_me'])
+                self.assertEqual(nodes[0]['children'][0]['id'], reply.id)
+
+    @override_settings(LIKE_WRITE_BEHIND=True)
+    def test_buffered_likes_are_visible_before_the_flush(self):
+        post = Post.objects.create(author=self.bob, title='Hello', body='World')
+        self.client.post(reverse('post-like', kwargs={'post_id': post.id}))
+
+        # Still one lookup, plus a Redis round trip
+        with self.assertNumQueries(1):
+            posts = annotate_likes(PostLike, Post, [Post(id=post.id, like_count=0)], self.alice)
+        self.assertEqual((posts[0].liked_by_me, posts[0].like_count), (True, 1))
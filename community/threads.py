@@ -0,0 +1,89 @@
+from django.db.models import Exists, F, OuterRef, Window
+from django.db.models.functions import RowNumber, Substr
+
+from .models import Comment
+from .pagination import encode_cursor
+
+# Sorts after every character of a path, so `path + PATH_END` bounds a subtree
+PATH_END = '\x7f'
+
+
+def with_reply_flags(queryset):
+    """Annotate `has_replies` so truncated nodes can offer a "more replies" cursor"""
+    return queryset.annotate(
+        has_replies=Exists(Comment.objects.filter(parent=OuterRef('pk')))
+    )
+
+
+def walk(comments):
+    """Every comment of the trees built by attach_replies(), parents first"""
+    for comment in comments:
+        yield comment
+        yield from walk(getattr(comment, 'replies', ()))
+
+
+def attach_replies(comments, max_depth, replies_per_node):
+    """
+    Load a bounded slice of the replies below `comments` in one query.
+
+    `comments` is a page of siblings (same post, same depth) fetched through
+    with_reply_flags(). Every comment in the resulting tree gets:
+
+    - `replies`: at most `replies_per_node` children, up to `max_depth` levels down
+    - `more_replies`: None when all children are present, otherwise a cursor to
+      pass to GET comments/<id>/replies to continue where the slice stopped
+    """
+    nodes = {}
+    for comment in comments:
+        comment.replies = []
+        nodes[comment.id] = comment
+    if not comments:
+        return comments
+
+    if max_depth > 0:
+        # Siblings have paths of the same length: a reply belongs to the page
+        # when its path starts with one of theirs. The page's subtrees all sit
+        # in one path range, which the (post, path) index can seek; the exact
+        # prefix test then only runs on the rows of that range. One IN list
+        # rather than a LIKE per comment, which SQLite cannot parse for large
+        # pages.
+        depth = comments[0].depth
+        paths = sorted(comment.path for comment in comments)
+        subtrees = Comment.objects.filter(
+            post_id=comments[0].post_id,
+            path__gt=paths[0],
+            path__lt=paths[-1] + PATH_END,
+            depth__gt=depth,
+            depth__lte=depth + max_depth,
+        ).annotate(
+            subtree=Substr('path', 1, len(paths[0]))
+        ).filter(subtree__in=paths)
+
+        # replies_per_node + 1 per parent, the extra one tells us the list was cut
+        descendants = with_reply_flags(subtrees).select_related('author').annotate(
+            sibling_rank=Window(
+                RowNumber(),
+                partition_by=[F('parent_id')],
+                order_by=[F('created_at').asc(), F('id').asc()],
+            )
+        ).filter(sibling_rank__lte=replies_per_node + 1).order_by('path')
+
+        # Path order visits every parent before its children
+        for reply in descendants:
+            parent = nodes.get(reply.parent_id)
+            if parent is None:
+                continue  # below a sibling that was cut off
+            reply.replies = []
+            parent.replies.append(reply)
+            nodes[reply.id] = reply
+
+    deepest = comments[0].depth + max_depth
+    for node in nodes.values():
+        node.more_replies = None
+        if len(node.replies) > replies_per_node:
+            node.replies = node.replies[:replies_per_node]
+            last = node.replies[-1]
+            node.more_replies = encode_cursor(last.created_at, last.id)
+        elif node.has_replies and node.depth >= deepest:
+            node.more_replies = encode_cursor()
+    return comments
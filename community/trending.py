@@ -0,0 +1,156 @@
+"""
+Trending posts, ranked Reddit-style:
+
+    hot = log10(max(activity, 1)) + created_at / TRENDING_GRAVITY
+
+activity is like_count + TRENDING_COMMENT_WEIGHT * comments. A post needs
+10x the activity to rank with a post TRENDING_GRAVITY seconds newer. The
+score does not depend on the current time, so it only changes when the post
+gets liked or commented and can be kept in a sorted set:
+
+    trending:hot        ZSET post id -> hot score, capped at TRENDING_SIZE
+    trending:dirty      SET of post ids that lost activity (unlike, deleted
+                        comment) since the last update
+    trending:since      timestamp of the last update_trending_scores run
+
+update_trending_scores rescores the posts created, liked or commented since
+the last run (plus the dirty ones); reading a page is one range query on the
+sorted set and one in_bulk.
+"""
+import math
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+
+from .models import Post, PostLike, Comment
+from .signals import like_toggled
+
+HOT_KEY = 'trending:hot'
+DIRTY_KEY = 'trending:dirty'
+SINCE_KEY = 'trending:since'
+
+# Rows committed a little after their created_at are picked up by the next run
+OVERLAP_SECONDS = 60
+SCORE_CHUNK = 1000
+
+
+def hot_score(like_count, comment_count, created_at):
+    activity = like_count + settings.TRENDING_COMMENT_WEIGHT * comment_count
+    return math.log10(max(activity, 1)) + created_at.timestamp() / settings.TRENDING_GRAVITY
+
+
+@receiver(like_toggled, sender=PostLike)
+def mark_unliked(sender, target_id, liked, **kwargs):
+    # New likes are found through PostLike.created_at, unlikes leave no row behind
+    if not liked:
+        get_redis_connection('default').sadd(DIRTY_KEY, target_id)
+
+
+@receiver(post_delete, sender=Comment)
+def mark_comment_deleted(sender, instance, **kwargs):
+    get_redis_connection('default').sadd(DIRTY_KEY, instance.post_id)
+
+
+@receiver(post_delete, sender=Post)
+def drop_post(sender, instance, **kwargs):
+    get_redis_connection('default').zrem(HOT_KEY, instance.id)
+
+
+def _take_dirty(redis):
+    taken = f'{DIRTY_KEY}:{uuid.uuid4().hex}'
+    try:
+        redis.rename(DIRTY_KEY, taken)
+    except ResponseError:
+        # Nothing marked since the last run
+        return set()
+    post_ids = {int(post_id) for post_id in redis.smembers(taken)}
+    redis.delete(taken)
+    return post_ids
+
+
+def update_scores(since=None):
+    """
+    Rescore the posts with activity since the last run (or `since`); the first
+    run covers the last TRENDING_WINDOW seconds. Returns the number of posts scored.
+    """
+    redis = get_redis_connection('default')
+    now = timezone.now()
+    if since is None:
+        last_run = redis.get(SINCE_KEY)
+        since = parse_datetime(last_run.decode()) if last_run else now - timedelta(seconds=settings.TRENDING_WINDOW)
+
+    # Range scans on the created_at indexes
+    post_ids = _take_dirty(redis)
+    post_ids.update(Post.objects.filter(created_at__gte=since).values_list('id', flat=True))
+    post_ids.update(PostLike.objects.filter(created_at__gte=since).values_list('post_id', flat=True).distinct())
+    post_ids.update(Comment.objects.filter(created_at__gte=since).values_list('post_id', flat=True).distinct())
+
+    post_ids = sorted(post_ids)
+    scored = 0
+    for i in range(0, len(post_ids), SCORE_CHUNK):
+        chunk = post_ids[i:i + SCORE_CHUNK]
+        rows = (
+            Post.objects.filter(id__in=chunk).order_by()
+            .annotate(comment_count=Count('comments'))
+            .values_list('id', 'like_count', 'comment_count', 'created_at')
+        )
+        scores = {post_id: hot_score(likes, comments, created_at) for post_id, likes, comments, created_at in rows}
+        with redis.pipeline() as pipe:
+            if scores:
+                pipe.zadd(HOT_KEY, scores)
+            gone = set(chunk).difference(scores)
+            if gone:
+                pipe.zrem(HOT_KEY, *gone)
+            pipe.execute()
+        scored += len(scores)
+
+    with redis.pipeline() as pipe:
+        # Keep the TRENDING_SIZE best posts
+        pipe.zremrangebyrank(HOT_KEY, 0, -settings.TRENDING_SIZE - 1)
+        pipe.set(SINCE_KEY, (now - timedelta(seconds=OVERLAP_SECONDS)).isoformat())
+        pipe.execute()
+    return scored
+
+
+def page_ids(position, limit, key=HOT_KEY):
+    """
+    Post ids of one page of `key`, best first, after `position` ((score, post id)
+    of the last post of the previous page, None for the first page).
+    Returns (ids, next_position); next_position is None on the last page.
+
+    O(log n + limit): the range starts at the cursor's score. Equal scores are
+    ordered by member (descending, as strings) in the sorted set, so the ones
+    already served are skipped by comparing members.
+    """
+    redis = get_redis_connection('default')
+    if position is None:
+        entries = redis.zrevrangebyscore(key, '+inf', '-inf', start=0, num=limit + 1, withscores=True)
+    else:
+        score, last_id = position
+        last_member = str(last_id).encode()
+        ties = redis.zcount(key, score, score)
+        entries = redis.zrevrangebyscore(key, score, '-inf', start=0, num=ties + limit + 1, withscores=True)
+        entries = [(member, s) for member, s in entries if s != score or member < last_member]
+
+    entries = entries[:limit + 1]
+    next_position = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        member, score = entries[-1]
+        next_position = (score, int(member))
+    return [int(member) for member, _ in entries], next_position
+
+
+def page(position, limit):
+    """Posts of one trending page, see page_ids(); deleted posts are skipped"""
+    ids, next_position = page_ids(position, limit)
+    posts = Post.objects.in_bulk(ids)
+    return [posts[post_id] for post_id in ids if post_id in posts], next_position
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import PostViewSet, CommentViewSet, PostLikeToggleViewSet, CommentLikeToggleViewSet, UserKarmaView, UpdateKarmaCacheView
+from .views import PostViewSet, CommentViewSet, PostLikeToggleViewSet, CommentLikeToggleViewSet, UserKarmaView, UpdateKarmaCacheView, KarmaCacheStatsView, SearchView, ExportView
 
 
 # Posts
@@ -8,6 +8,18 @@ post_list_create = PostViewSet.as_view({
     'post': 'create',
     })
 
+post_feed = PostViewSet.as_view({
+    'get': 'feed',
+})
+
+post_trending = PostViewSet.as_view({
+    'get': 'trending',
+})
+
+post_bulk = PostViewSet.as_view({
+    'post': 'bulk',
+})
+
 post_update_delete = PostViewSet.as_view({
     'put': 'update',
     'delete': 'destroy',
@@ -19,11 +31,19 @@ comment_list_create = CommentViewSet.as_view({
     'post': 'create',
 })
 
+comment_bulk = CommentViewSet.as_view({
+    'post': 'bulk',
+})
+
 comment_update_delete = CommentViewSet.as_view({
     'put': 'update',
     'delete': 'destroy',
 })
 
+comment_replies = CommentViewSet.as_view({
+    'get': 'replies',
+})
+
 # Post like/unlike
 post_like_toggle = PostLikeToggleViewSet.as_view({
     'post': 'create'
@@ -39,16 +59,28 @@ urlpatterns = [
     # Posts methods
     path('posts', post_list_create, name = 'post-list-create'),
     path('posts/<int:post_id>', post_update_delete, name = 'post-update-delete'),
+    path('posts/trending', post_trending, name = 'post-trending'),
+    path('posts/bulk', post_bulk, name = 'post-bulk'),
+    path('feed', post_feed, name = 'post-feed'),
 
     # Comments methods
     path('posts/<int:post_id>/comments', comment_list_create, name = 'comment-list-create'),
+    path('comments/bulk', comment_bulk, name = 'comment-bulk'),
     path('comments/<int:comment_id>', comment_update_delete, name = 'comment-update-delete'),
+    path('comments/<int:comment_id>/replies', comment_replies, name = 'comment-replies'),
 
     # Post and Comment like/unlike
     path('posts/<int:post_id>/like', post_like_toggle, name='post-like'),
     path('comments/<int:comment_id>/like', comment_like_toggle, name='comment-like'),
 
+    # Full-text search
+    path('search', SearchView.as_view(), name='search'),
+
+    # NDJSON export
+    path('export', ExportView.as_view(), name='export'),
+
     path('karma', UserKarmaView.as_view(), name='user-karma'),
     path('karma/update-cache', UpdateKarmaCacheView.as_view(), name='update-karma-cache'),
+    path('karma/cache-stats', KarmaCacheStatsView.as_view(), name='karma-cache-stats'),
 ]
 
@@ -0,0 +1,99 @@
+"""
+Version tokens for conditional GETs (ETag / Last-Modified).
+
+    version:post:<id>   bumped when a comment of the post is written or
+                        deleted, and when the post or one of its comments
+                        is liked / unliked
+    version:karma:boards        bumped when the weekly / all-time leaderboards
+                                are stored
+    version:karma:user:<id>     bumped when the karma of the user changes (a
+                                like toggle or a like buffer flush)
+
+The daily leaderboard needs no version, leaderboard.fingerprint() reads what
+a caller would see of it straight from the sorted set.
+
+A version is {'token', 'modified'}; a missing one (never bumped, evicted) is
+created on read, which costs clients one full response. Bumps happen once
+the write is committed, so a token never describes uncommitted data.
+"""
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Comment
+from .signals import like_toggled
+
+BOARDS_KEY = 'version:karma:boards'
+
+
+def _post_key(post_id):
+    return f'version:post:{post_id}'
+
+
+def _user_karma_key(user_id):
+    return f'version:karma:user:{user_id}'
+
+
+def _new_version(previous=None):
+    # HTTP dates have a one second resolution: bumps within the same second
+    # keep the date (never moving it backwards) and are told apart by the
+    # token, which clients send back as If-None-Match
+    modified = timezone.now().replace(microsecond=0)
+    if previous is not None:
+        modified = max(modified, previous['modified'])
+    return {'token': uuid.uuid4().hex, 'modified': modified}
+
+
+def _current(key):
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        if not cache.add(key, version, settings.VERSION_TTL):
+            version = cache.get(key) or version
+    return version
+
+
+def _bump(key):
+    cache.set(key, _new_version(cache.get(key)), settings.VERSION_TTL)
+
+
+def post_version(post_id):
+    return _current(_post_key(post_id))
+
+
+def boards_version():
+    return _current(BOARDS_KEY)
+
+
+def user_karma_version(user_id):
+    return _current(_user_karma_key(user_id))
+
+
+def bump_posts(post_ids):
+    post_ids = set(post_ids)
+    transaction.on_commit(lambda: [_bump(_post_key(post_id)) for post_id in post_ids])
+
+
+def bump_boards():
+    transaction.on_commit(lambda: _bump(BOARDS_KEY))
+
+
+def bump_user_karma(user_ids):
+    user_ids = set(user_ids)
+    transaction.on_commit(lambda: [_bump(_user_karma_key(user_id)) for user_id in user_ids])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_written(sender, instance, **kwargs):
+    bump_posts([instance.post_id])
+
+
+@receiver(like_toggled)
+def like_written(sender, post_id, user, **kwargs):
+    bump_posts([post_id])
+    bump_user_karma([user.id])
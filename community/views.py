@@ -1,16 +1,52 @@
 from rest_framework.views import APIView
 from rest_framework import status, viewsets
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 
 from .models import Post, PostLike, Comment, CommentLike
-from .serializers import PostSerializer, CommentSerializer
+from .serializers import PostSerializer, PostSummarySerializer, CommentSerializer, CommentSummarySerializer, CommentTreeSerializer
+from . import days, export, feed, karma_cache, leaderboard, search, trending, versions
+from .ingest import ingest_comments, ingest_posts
+from .likes import annotate_likes, toggle_like
+from .pagination import decode_id_cursor, decode_score_cursor, encode_cursor, get_int_param, keyset_paginate
+from .tasks import fan_out_post
+from .threads import attach_replies, walk, with_reply_flags
 
-from .tasks import update_daily_karma_cache
+from django.conf import settings
 from django.core.cache import cache
+from django.http import StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.db import transaction
 from django.db.models import Prefetch
 from datetime import timedelta
-from django.utils import timezone
+
+
+def _post_version(request, post_id=None):
+    # Read once per request, by both the ETag and the Last-Modified function
+    if not hasattr(request, '_post_version'):
+        request._post_version = versions.post_version(post_id)
+    return request._post_version
+
+
+def _comments_etag(request, post_id=None):
+    # Per viewer because of liked_by_me
+    return f'"{_post_version(request, post_id)["token"]}-{request.user.id}"'
+
+
+def _comments_last_modified(request, post_id=None):
+    return _post_version(request, post_id)['modified']
+
+
+def _karma_etag(request):
+    # Weak: cache_age moves on while the leaderboards stay the same
+    today = days.today()
+    around = get_int_param(request, 'around', settings.KARMA_NEIGHBORS, maximum=settings.KARMA_MAX_NEIGHBORS)
+    daily = leaderboard.fingerprint(today, request.user.id, settings.KARMA_LEADERBOARD_SIZE, around)
+    boards = versions.boards_version()['token']
+    totals = versions.user_karma_version(request.user.id)['token']
+    return f'W/"{daily}-{boards}-{totals}-{request.user.id}-{today.isoformat()}"'
 
 
 # Create your views here.
@@ -21,14 +57,28 @@ class PostViewSet(viewsets.ViewSet):
     
     def retrieve(self, request):
         """
-        GET /community/posts       - Get post by user
+        GET /community/posts       - Get post by user (newest first, paginated)
+        GET /community/posts?cursor=<next_cursor>&limit=20&summary=true
+
+        `summary=true` leaves out the body of each post.
 
         """
-        posts = self.queryset
-        author_id = request.user
-        posts = posts.filter(author_id=author_id)
-        serializer = self.serializer_class(posts, many=True)
-        return Response(serializer.data)
+        limit = get_int_param(request, 'limit', settings.POST_PAGE_SIZE, minimum=1, maximum=settings.POST_MAX_PAGE_SIZE)
+        summary = request.query_params.get('summary', '').lower() in ('1', 'true', 'yes')
+
+        # Keyset pagination on (-created_at, -id), served by the (author, -created_at, -id) index
+        posts = self.queryset.filter(author_id=request.user.id)
+        if summary:
+            posts = posts.defer('body')
+        posts, next_cursor = keyset_paginate(posts, request.query_params.get('cursor'), limit, descending=True)
+        annotate_likes(PostLike, Post, posts, request.user)
+
+        serializer_class = PostSummarySerializer if summary else self.serializer_class
+        serializer = serializer_class(posts, many=True)
+        return Response({
+            "results": serializer.data,
+            "next_cursor": next_cursor,
+        })
     
     def create(self, request):
         """
@@ -42,13 +92,63 @@ class PostViewSet(viewsets.ViewSet):
         serializer = self.serializer_class(data=request.data)
         print()
         if serializer.is_valid():
-            serializer.save(author=request.user)
+            post = serializer.save(author=request.user)
+            transaction.on_commit(lambda: fan_out_post.delay(post.id))
             return Response(
                 {"message": "Post created successfully!"}, 
                 status=status.HTTP_201_CREATED
             )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+    def bulk(self, request):
+        """
+        POST /community/posts/bulk     - Create up to BULK_MAX_ITEMS posts at once
+        [
+            {"title": "My new Post", "body": "This is my post content!"},
+            ...
+        ]
+
+        Invalid items are reported by index, the others are created.
+        """
+        result = ingest_posts(request.user, request.data)
+        return Response(result, status=status.HTTP_201_CREATED if result["created"] else status.HTTP_400_BAD_REQUEST)
+
+    def feed(self, request):
+        """
+        GET /community/feed        - Newest posts of the users you follow, and your own
+        GET /community/feed?cursor=<next_cursor>&limit=20
+
+        """
+        limit = get_int_param(request, 'limit', settings.FEED_PAGE_SIZE, minimum=1, maximum=settings.FEED_MAX_PAGE_SIZE)
+        cursor = request.query_params.get('cursor')
+        before = decode_id_cursor(cursor) if cursor else None
+
+        posts, next_before = feed.page(request.user, before, limit)
+        annotate_likes(PostLike, Post, posts, request.user)
+        serializer = self.serializer_class(posts, many=True)
+        return Response({
+            "results": serializer.data,
+            "next_cursor": encode_cursor(next_before) if next_before is not None else None,
+        }, status=status.HTTP_200_OK)
+
+    def trending(self, request):
+        """
+        GET /community/posts/trending     - Hottest posts first (precomputed scores)
+        GET /community/posts/trending?cursor=<next_cursor>&limit=20
+
+        """
+        limit = get_int_param(request, 'limit', settings.TRENDING_PAGE_SIZE, minimum=1, maximum=settings.TRENDING_MAX_PAGE_SIZE)
+        cursor = request.query_params.get('cursor')
+        position = decode_score_cursor(cursor) if cursor else None
+
+        posts, next_position = trending.page(position, limit)
+        annotate_likes(PostLike, Post, posts, request.user)
+        serializer = PostSummarySerializer(posts, many=True)
+        return Response({
+            "results": serializer.data,
+            "next_cursor": encode_cursor(*next_position) if next_position else None,
+        }, status=status.HTTP_200_OK)
+
     def update(self, request, post_id=None):
         """
         PUT /community/posts/<post_id>      - Update posts (author only)
@@ -88,17 +188,54 @@ class CommentViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
     queryset = Comment.objects.select_related('author', 'post', 'parent')
 
+    @method_decorator(condition(etag_func=_comments_etag, last_modified_func=_comments_last_modified))
     def list(self, request, post_id=None):
         """
-        GET /community/posts/<post_id>/comments        - Fetch all top-level comments for a post (with nested replies)
+        GET /community/posts/<post_id>/comments        - Fetch a page of top-level comments for a post (with nested replies)
+        GET /community/posts/<post_id>/comments?cursor=<next_cursor>&limit=20&max_depth=3&replies_per_node=5
 
+        Answers 304 Not Modified to If-None-Match / If-Modified-Since while the
+        post version (versions.py) is unchanged, without querying the comments.
         """
-        comments = self.queryset.filter(
-            post_id=post_id,
-            parent__isnull=True
+        comments = with_reply_flags(
+            Comment.objects.filter(post_id=post_id, parent__isnull=True)
+        ).select_related('author')
+        return self._thread_page(request, comments)
+
+    def replies(self, request, comment_id=None):
+        """
+        GET /community/comments/<comment_id>/replies        - Fetch a page of replies to a comment (with nested replies)
+        GET /community/comments/<comment_id>/replies?cursor=<more_replies>&limit=20&max_depth=3&replies_per_node=5
+
+        """
+        if not Comment.objects.filter(id=comment_id).exists():
+            return Response({"error": "Comment not found"}, status=404)
+
+        comments = with_reply_flags(
+            Comment.objects.filter(parent_id=comment_id)
+        ).select_related('author')
+        return self._thread_page(request, comments)
+
+    def _thread_page(self, request, comments):
+        limit = get_int_param(request, 'limit', settings.COMMENT_PAGE_SIZE, minimum=1, maximum=settings.COMMENT_MAX_PAGE_SIZE)
+        max_depth = get_int_param(request, 'max_depth', settings.COMMENT_MAX_DEPTH, maximum=settings.COMMENT_MAX_DEPTH_LIMIT)
+        replies_per_node = get_int_param(
+            request, 'replies_per_node', settings.COMMENT_REPLIES_PER_NODE,
+            minimum=1, maximum=settings.COMMENT_MAX_REPLIES_PER_NODE
         )
-        serializer = CommentSerializer(comments, many=True)
-        return Response(serializer.data)
+
+        # Keyset pagination on (created_at, id), served by the (post, created_at)
+        # and (parent, created_at) indexes
+        page, next_cursor = keyset_paginate(comments, request.query_params.get('cursor'), limit)
+        attach_replies(page, max_depth, replies_per_node)
+        # One lookup for the whole tree
+        annotate_likes(CommentLike, Comment, walk(page), request.user)
+
+        serializer = CommentTreeSerializer(page, many=True)
+        return Response({
+            "results": serializer.data,
+            "next_cursor": next_cursor,
+        })
 
     def create(self, request, post_id=None):
         """
@@ -125,6 +262,21 @@ class CommentViewSet(viewsets.ViewSet):
             )
         return Response(serializer.errors, status=400)
 
+    def bulk(self, request):
+        """
+        POST /community/comments/bulk      - Create up to BULK_MAX_ITEMS comments at once
+        [
+            {"post": 1, "body": "First!", "ref": "a"},
+            {"post": 1, "body": "A reply", "parent_ref": "a"},
+            {"post": 1, "body": "Reply to an existing comment", "parent": 7}
+        ]
+
+        `parent_ref` points to the `ref` of a comment earlier in the batch.
+        Invalid items are reported by index, the others are created.
+        """
+        result = ingest_comments(request.user, request.data)
+        return Response(result, status=status.HTTP_201_CREATED if result["created"] else status.HTTP_400_BAD_REQUEST)
+
     def update(self, request, comment_id=None):
         """
         PUT /community/comments/<comment_id>        - Update comment (author only)
@@ -173,26 +325,13 @@ class PostLikeToggleViewSet(viewsets.ViewSet):
         
         """
         try:
-            post = Post.objects.get(id=post_id)
+            liked, count = toggle_like(PostLike, Post, post_id, request.user)
         except Post.DoesNotExist:
             return Response({"error": "Post not found"}, status=404)
-        
-        like, created = PostLike.objects.get_or_create(
-            user=request.user, 
-            post=post,
-            defaults={'post': post}
-        )
-        
-        if not created:
-            like.delete()
-            return Response({
-                "liked": False, 
-                "count": post.likes.count()
-            })
-        
+
         return Response({
-            "liked": True, 
-            "count": post.likes.count()
+            "liked": liked, 
+            "count": count
         })
 
 
@@ -205,85 +344,172 @@ class CommentLikeToggleViewSet(viewsets.ViewSet):
         
         """
         try:
-            comment = Comment.objects.get(id=comment_id)
+            liked, count = toggle_like(CommentLike, Comment, comment_id, request.user)
         except Comment.DoesNotExist:
             return Response({"error": "Comment not found"}, status=404)
-        
-        like, created = CommentLike.objects.get_or_create(
-            user=request.user,
-            comment=comment,
-            defaults={'comment': comment}
-        )
-        
-        if not created:
-            like.delete()
-            return Response({
-                "liked": False,
-                "count": comment.likes.count()
-            })
-        
+
         return Response({
-            "liked": True,
-            "count": comment.likes.count()
+            "liked": liked,
+            "count": count
         })
 
 
+class SearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        GET /community/search?q=<words>&type=post|comment&cursor=<next_cursor>&limit=20
+
+        Posts and comments containing every word, best BM25 match first.
+
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"q": "This parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
+        kind = request.query_params.get('type') or None
+        if kind not in (None, search.POST, search.COMMENT):
+            return Response({"type": "Must be 'post' or 'comment'."}, status=status.HTTP_400_BAD_REQUEST)
+        limit = get_int_param(request, 'limit', settings.SEARCH_PAGE_SIZE, minimum=1, maximum=settings.SEARCH_MAX_PAGE_SIZE)
+        cursor = request.query_params.get('cursor')
+        offset = max(decode_id_cursor(cursor), 0) if cursor else 0
+
+        hits = search.search(query, kind, offset, limit + 1)
+        next_cursor = encode_cursor(offset + limit) if len(hits) > limit else None
+        hits = hits[:limit]
+
+        # Two queries, whatever the page size
+        posts = Post.objects.in_bulk([object_id for hit_kind, object_id, _, _ in hits if hit_kind == search.POST])
+        comments = Comment.objects.select_related('author').in_bulk(
+            [object_id for hit_kind, object_id, _, _ in hits if hit_kind == search.COMMENT]
+        )
+        annotate_likes(PostLike, Post, posts.values(), request.user)
+        annotate_likes(CommentLike, Comment, comments.values(), request.user)
+        results = []
+        for hit_kind, object_id, _, score in hits:
+            if hit_kind == search.POST and object_id in posts:
+                data = PostSummarySerializer(posts[object_id]).data
+            elif hit_kind == search.COMMENT and object_id in comments:
+                data = CommentSummarySerializer(comments[object_id]).data
+            else:
+                continue
+            results.append({"type": hit_kind, "score": round(score, 4), "object": data})
+
+        return Response({
+            "results": results,
+            "next_cursor": next_cursor,
+        }, status=status.HTTP_200_OK)
+
+
+class ExportView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        GET /community/export?type=post,comment,post_like,comment_like&author=<user_id>&since=2025-01-01&until=2025-01-31&post=<post_id>
+
+        Streams NDJSON, one object per line. Staff can export anything, other
+        users only their own posts, comments and likes. `since` / `until` are
+        dates (whole days, inclusive) or datetimes.
+
+        """
+        types = request.query_params.get('type')
+        types = types.split(',') if types else list(export.EXPORTS)
+        unknown = set(types) - set(export.EXPORTS)
+        if unknown:
+            raise ValidationError({'type': f"Unknown type(s): {', '.join(sorted(unknown))}."})
+
+        author_id = get_int_param(request, 'author', None, minimum=1)
+        if not request.user.is_staff:
+            if author_id not in (None, request.user.id):
+                raise PermissionDenied("You can only export your own data.")
+            author_id = request.user.id
+
+        filters = {'author_id': author_id, 'post_id': get_int_param(request, 'post', None, minimum=1)}
+        for param, key, end in (('since', 'start', False), ('until', 'end', True)):
+            value = request.query_params.get(param)
+            try:
+                filters[key] = export.parse_bound(value, end=end) if value else None
+            except ValueError:
+                raise ValidationError({param: 'Must be a date or datetime.'})
+
+        response = StreamingHttpResponse(
+            export.ndjson_lines(types, **filters),
+            content_type='application/x-ndjson',
+        )
+        response['Content-Disposition'] = 'attachment; filename="karmageddon-export.ndjson"'
+        return response
+
+
 class UserKarmaView(APIView):
     permission_classes = [IsAuthenticated]
     
+    @method_decorator(condition(etag_func=_karma_etag))
     def get(self, request):
-        today = timezone.now().date()
+        """
+        GET /community/karma        - Today's leaderboard and the caller's standing
+        GET /community/karma?around=3       - also list the 3 users ranked above and below the caller
+
+        Answers 304 Not Modified to If-None-Match until the caller's karma,
+        the part of today's leaderboard in the response or the weekly /
+        all-time leaderboards change.
+        """
+        today = days.today()
+        around = get_int_param(request, 'around', settings.KARMA_NEIGHBORS, maximum=settings.KARMA_MAX_NEIGHBORS)
         
-        # Current user karma (real-time)
-        current_karma = self._calculate_user_karma(request.user, today)
-        top_users = cache.get('daily_karma_top5', [])
+        # Current user karma and rank (real-time, from the sorted set)
+        standing = leaderboard.standing(today, request.user.id, around)
+        totals = karma_cache.get_user_totals(request.user, today)
+        top_users = leaderboard.top(today, settings.KARMA_LEADERBOARD_SIZE)
+        boards, cache_age = karma_cache.get_boards()
         
-        # Trigger cache update if missing
-        if not top_users:
-            update_daily_karma_cache.delay()
+        # Rebuild the day from the database if Redis does not have it
+        if not leaderboard.is_built(today):
+            karma_cache.request_refresh(reconcile=True)
         
         return Response({
             'current_user': {
                 'username': request.user.username,
-                'daily_karma': current_karma['total'],
-                'post_likes': current_karma['post_likes'],
-                'comment_likes': current_karma['comment_likes'],
-                'rank': self._get_user_rank(request.user.username, top_users)
+                'daily_karma': standing['daily_karma'],
+                'post_likes': standing['post_likes'],
+                'comment_likes': standing['comment_likes'],
+                'weekly_karma': totals['weekly'],
+                'monthly_karma': totals['monthly'],
+                'rank': standing['rank'],
+                'neighbors': standing['neighbors'],
             },
             'top_users': top_users,
+            'weekly_top_users': boards.get('weekly', []),
+            'all_time_top_users': boards.get('all_time', []),
             'date': today.strftime('%Y-%m-%d'),
             'reset_time': (today + timedelta(days=1)).strftime('%Y-%m-%d 00:00'),
-            'cache_fresh': bool(top_users)
+            'cache_age': cache_age
         })
     
-    def _calculate_user_karma(self, user, date):
-        post_count = PostLike.objects.filter(user=user, created_at__date=date).count()
-        comment_count = CommentLike.objects.filter(user=user, created_at__date=date).count()
-        return {
-            'total': (post_count * 5) + comment_count,
-            'post_likes': post_count,
-            'comment_likes': comment_count
-        }
-    
-    def _get_user_rank(self, username, top_users):
-        for i, user_data in enumerate(top_users):
-            if user_data['username'] == username:
-                return i + 1
-        return None
-    
 
 class UpdateKarmaCacheView(APIView):
     def post(self, request):
         """
-        POST /karma/update-cache        - Manually refresh karma leaderboard
+        POST /karma/update-cache        - Manually rebuild today's karma and the leaderboards
         
         """
         
-        # Trigger Celery task immediately (fire and forget)
-        task = update_daily_karma_cache.delay()
+        # Joins the rebuild already in flight instead of enqueuing another one
+        task_id, enqueued = karma_cache.request_refresh(reconcile=True)
         
         return Response({
-            'message': 'Karma cache update triggered successfully',
-            'task_id': task.id,
-            'status': 'queued'
-        }, status=status.HTTP_202_ACCEPTED)
\ No newline at end of file
+            'message': 'Karma cache update triggered successfully' if enqueued else 'Karma cache update already in progress',
+            'task_id': task_id,
+            'status': 'queued' if enqueued else 'in_progress'
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class KarmaCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        """
+        GET /karma/cache-stats      - Hit/miss counters of the per-user karma cache (staff only)
+
+        """
+        return Response(karma_cache.user_totals_stats())
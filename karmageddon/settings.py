@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 from pathlib import Path
 from datetime import timedelta
 from celery.schedules import crontab
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -107,6 +108,40 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing. The first hasher of the policy hashes new passwords; a
+# password stored with another one (or other PBKDF2 iterations) is rehashed
+# with it on the next successful login. PBKDF2 keeps Django's iteration count,
+# which follows the current recommendation with every Django release.
+PASSWORD_PBKDF2_ITERATIONS = PBKDF2PasswordHasher.iterations
+PASSWORD_HASHER_POLICIES = {
+    'pbkdf2': [
+        'account.hashers.PBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.ScryptPasswordHasher',
+        'django.contrib.auth.hashers.Argon2PasswordHasher',
+    ],
+    'scrypt': [
+        'django.contrib.auth.hashers.ScryptPasswordHasher',
+        'account.hashers.PBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.Argon2PasswordHasher',
+    ],
+    # Needs argon2-cffi
+    'argon2': [
+        'django.contrib.auth.hashers.Argon2PasswordHasher',
+        'account.hashers.PBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.ScryptPasswordHasher',
+    ],
+}
+PASSWORD_HASHER_POLICY = 'pbkdf2'
+PASSWORD_HASHERS = PASSWORD_HASHER_POLICIES[PASSWORD_HASHER_POLICY]
+
+# Login / signup throttling (account/throttling.py), fixed windows in seconds
+LOGIN_IP_LIMIT = 30                 # login attempts per client IP
+LOGIN_IP_WINDOW = 60
+LOGIN_USERNAME_LIMIT = 5            # failed logins per username, reset by a successful one
+LOGIN_USERNAME_WINDOW = 60 * 5
+SIGNUP_IP_LIMIT = 10                # signups per client IP
+SIGNUP_IP_WINDOW = 60 * 60
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/6.0/topics/i18n/
@@ -130,7 +165,7 @@ STATIC_URL = 'static/'
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'account.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -166,8 +201,79 @@ SIMPLE_JWT = {
     'TOKEN_TYPE_CLAIM': 'token_type',
     
     'JTI_CLAIM': 'jti',
+
+    # Redis blacklist and token versions instead of database lookups (account/blacklist.py)
+    'TOKEN_REFRESH_SERIALIZER': 'account.serializers.TokenRefreshSerializer',
 }
 
+# Seconds CachedJWTAuthentication keeps a user row; 0 builds request.user from the token claims
+ACCOUNT_USER_CACHE_TTL = 60
+
+# Expired OutstandingToken rows deleted per query by purge_expired_tokens
+ACCOUNT_TOKEN_PURGE_BATCH = 1000
+
+
+# Post listing (GET posts)
+POST_PAGE_SIZE = 20
+POST_MAX_PAGE_SIZE = 100
+
+# Comment threads (GET posts/<post_id>/comments, comments/<comment_id>/replies)
+COMMENT_PAGE_SIZE = 20              # top-level comments per page
+COMMENT_MAX_PAGE_SIZE = 100
+COMMENT_MAX_DEPTH = 3               # reply levels loaded below each comment
+COMMENT_MAX_DEPTH_LIMIT = 10
+COMMENT_REPLIES_PER_NODE = 5        # children shown per comment before "more replies"
+COMMENT_MAX_REPLIES_PER_NODE = 50
+
+# Karma (GET karma?around=N lists the N users ranked above and below the caller)
+KARMA_LEADERBOARD_SIZE = 5          # users per leaderboard
+KARMA_CACHE_SOFT_TTL = 300          # seconds before cached boards are refreshed in the background
+KARMA_CACHE_HARD_TTL = 60 * 60 * 48 # seconds stale boards are still served
+KARMA_REFRESH_LOCK_TTL = 120        # upper bound for one refresh, in case a worker dies
+KARMA_USER_CACHE_TTL = 60 * 60      # per-user karma totals, dropped earlier by the user's like toggles
+KARMA_NEIGHBORS = 2
+KARMA_MAX_NEIGHBORS = 25
+
+# Like toggles are buffered in Redis and written to the database in batches
+# by community.tasks.flush_like_buffer when enabled
+LIKE_WRITE_BEHIND = False
+LIKE_BUFFER_TTL = 60 * 60 * 24       # seconds a loaded like set stays in Redis
+LIKE_BUFFER_FLUSH_BATCH = 500        # objects per flush round
+
+# Home feed: post ids fanned out to per-user Redis timelines on write, authors
+# with many followers are merged in on read instead
+FEED_TIMELINE_SIZE = 800
+FEED_CELEBRITY_THRESHOLD = 10000
+FEED_FANOUT_BATCH = 1000             # timelines written per Redis round trip
+FEED_PAGE_SIZE = 20
+FEED_MAX_PAGE_SIZE = 100
+
+# Trending posts: Reddit-style hot score kept in a Redis sorted set by
+# community.tasks.update_trending_scores
+TRENDING_GRAVITY = 45000             # seconds newer that outweigh 10x the activity
+TRENDING_COMMENT_WEIGHT = 2          # a comment counts as this many likes
+TRENDING_WINDOW = 60 * 60 * 24 * 2   # activity scanned by the first run
+TRENDING_SIZE = 50000                # posts kept in the sorted set
+TRENDING_PAGE_SIZE = 20
+TRENDING_MAX_PAGE_SIZE = 100
+
+# Full-text search: "fts5" (SQLite), "disk" (pure-Python index in
+# SEARCH_INDEX_DIR) or "auto" for fts5 where the SQLite build has it
+SEARCH_BACKEND = 'auto'
+SEARCH_INDEX_DIR = BASE_DIR / 'search_index'
+SEARCH_TITLE_WEIGHT = 3              # a title match counts as this many body matches
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+# Batch ingestion (posts/bulk, comments/bulk, import_posts, import_comments)
+BULK_MAX_ITEMS = 5000                # items per request
+BULK_CHUNK_SIZE = 500                # rows per INSERT
+
+# Streaming NDJSON export (community/export, export_ndjson)
+EXPORT_CHUNK_SIZE = 2000             # rows fetched from the database at a time
+
+# Version tokens behind the ETag / Last-Modified of the comment and karma reads
+VERSION_TTL = 60 * 60 * 24 * 7
 
 
 # Redis as Celery Broker + Cache Backend
@@ -178,7 +284,7 @@ CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
-CELERY_TIMEZONE = 'UTC'
+CELERY_TIMEZONE = TIME_ZONE  # beat's crontab hours and the karma day use the same clock
 
 # Cache Backend (Redis)
 CACHES = {
@@ -188,13 +294,39 @@ CACHES = {
         'OPTIONS': {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
         }
-    }
+    },
+    # Token versions and the refresh-token blacklist (account/tokens.py,
+    # account/blacklist.py), read as raw Redis keys. A database of
+    # their own: cache.clear() flushes db 1 only, and the keys must outlive
+    # cache evictions (run Redis with maxmemory-policy noeviction, or point
+    # this at an instance that does).
+    'auth': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/2',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        }
+    },
 }
 
-# Celery Beat Schedule (Hourly karma updates)
+# Celery Beat Schedule
 CELERY_BEAT_SCHEDULE = {
+    # The leaderboard is kept up to date by like events, this is the nightly
+    # reconciliation against the database
     'update-daily-karma': {
         'task': 'community.tasks.update_daily_karma_cache',
-        'schedule': crontab(minute=0, hour='*/1'),  # Every hour
+        'schedule': crontab(minute=55, hour=23),
+    },
+    'flush-like-buffer': {
+        'task': 'community.tasks.flush_like_buffer',
+        'schedule': timedelta(seconds=10),
+    },
+    'update-trending-scores': {
+        'task': 'community.tasks.update_trending_scores',
+        'schedule': timedelta(seconds=60),
+    },
+    'purge-expired-tokens': {
+        'task': 'account.tasks.purge_expired_tokens',
+        'schedule': crontab(minute=30),
     },
 }
\ No newline at end of file